@@ -0,0 +1,565 @@
+'''Benchmark suite for the drf_apis hot paths
+
+Seeds a synthetic dataset into the configured database, stubs the
+S3/SQS/SWF clients and times the analysis endpoints and permission helpers,
+printing latency percentiles and query counts as JSON:
+
+  DJANGO_SETTINGS_MODULE=... python benchmarks/analysis_api.py \
+    --analyses 20000 --samples 20000 --output bench.json
+
+The seed writes to the database: it only runs against a database named
+test_* / bench*, with settings.BENCHMARK_DATABASE set, or with --allow-seed.
+'''
+
+# Lib imports
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from unittest import mock
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import django
+
+SERVICES = ['S3', 'SQS', 'SWF']
+VIEWSET_MODULE = 'bpapp.api3.resources.api_views'
+
+
+class StubService:
+  '''Stand-in for the S3/SQS/SWF clients'''
+
+  def __init__(self, *args, **kwargs):
+    self.calls = 0
+
+  def get_credentials(self):
+    '''Stub credentials'''
+    self.calls += 1
+    return {}
+
+  def get_self_signed(self, path, expires):  # pylint: disable=unused-argument
+    '''Stub signed url'''
+    self.calls += 1
+    return f'https://stub.local/{path}'
+
+  def send_message(self, *args, **kwargs):  # pylint: disable=unused-argument
+    '''Stub queue message'''
+    self.calls += 1
+    return {}
+
+  def terminate(self, *args, **kwargs):  # pylint: disable=unused-argument
+    '''Stub workflow termination'''
+    self.calls += 1
+    return {}
+
+
+def percentile(values, pct):
+  '''Nearest-rank percentile'''
+  ordered = sorted(values)
+  index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+  return ordered[index]
+
+
+def summarize(timings, queries):
+  '''Latency percentiles (ms) and query counts of a scenario'''
+  timings_ms = [timing * 1000 for timing in timings]
+  return {
+    'iterations': len(timings_ms),
+    'latency_ms': {
+      'max': max(timings_ms),
+      'mean': statistics.mean(timings_ms),
+      'p50': percentile(timings_ms, 50),
+      'p90': percentile(timings_ms, 90),
+      'p99': percentile(timings_ms, 99),
+    },
+    'queries': {
+      'max': max(queries),
+      'mean': statistics.mean(queries),
+    },
+  }
+
+
+class Benchmark:
+  '''Seed the dataset and run the scenarios'''
+
+  def __init__(self, options):
+    # imported after django.setup()
+    from django.core.cache import cache  # pylint: disable=import-outside-toplevel
+    from django.db import connection  # pylint: disable=import-outside-toplevel
+    from django.test.utils import CaptureQueriesContext  # pylint: disable=import-outside-toplevel
+    from rest_framework.test import APIRequestFactory, force_authenticate  # pylint: disable=import-outside-toplevel
+
+    self.cache = cache
+    self.capture_queries = lambda: CaptureQueriesContext(connection)
+    self.connection = connection
+    self.factory = APIRequestFactory(SERVER_NAME=options.domain)
+    self.force_authenticate = force_authenticate
+    self.options = options
+    self.random = random.Random(options.seed)
+    self.data = {}
+
+  # seeding
+
+  def seed(self):
+    '''Create users, host, projects, samples, analyses, files, logs and shares'''
+    from bpapp.api3.resources.permission_cache import assign_perm  # pylint: disable=import-outside-toplevel
+    from bpapp.models import (  # pylint: disable=import-outside-toplevel
+      Analysis, AnalysisLog, BpUser, File, Host, HostsMembers, Project, Sample, Workflow
+    )
+
+    options = self.options
+    rand = self.random
+    run_id = int(time.time())
+
+    host, _ = Host.objects.get_or_create(domain=options.domain, defaults={'name': 'benchmark', 'config': {}})
+    users = BpUser.objects.bulk_create([
+      BpUser(email=f'bench-{run_id}-{index}@example.com', username=f'bench-{run_id}-{index}')
+      for index in range(options.users)
+    ])
+    HostsMembers.objects.bulk_create([HostsMembers(host=host, role='member', user=user) for user in users])
+    workflows = Workflow.objects.bulk_create([Workflow(name=f'bench-pipeline-{index}') for index in range(5)])
+
+    projects = Project.objects.bulk_create([
+      Project(name=f'bench-project-{index}', owner=rand.choice(users), visibility=rand.choice(['private', 'public']))
+      for index in range(options.projects)
+    ])
+    samples = Sample.objects.bulk_create([
+      Sample(name=f'bench-sample-{index}', owner=rand.choice(users))
+      for index in range(options.samples)
+    ])
+    Sample.projects.through.objects.bulk_create([
+      Sample.projects.through(sample_id=sample.id, project_id=rand.choice(projects).id) for sample in samples
+    ])
+
+    analyses = Analysis.objects.bulk_create([
+      Analysis(
+        host=host,
+        meta={'source': 'benchmark'},
+        name=f'bench-analysis-{index}',
+        owner=rand.choice(users),
+        params={'node': {'index_genome': {'index_genome_id': index}} if index % 50 == 0 else {}},
+        status=rand.choice(['completed', 'failed', 'running', 'waiting-in-queue']),
+        workflow=rand.choice(workflows),
+      ) for index in range(options.analyses)
+    ], batch_size=1000)
+    Analysis.backfill_index_genome_ids()
+    Analysis.projects.through.objects.bulk_create([
+      Analysis.projects.through(analysis_id=analysis.id, project_id=rand.choice(projects).id)
+      for analysis in analyses
+    ], batch_size=5000)
+    Analysis.samples.through.objects.bulk_create([
+      Analysis.samples.through(analysis_id=analysis.id, sample_id=rand.choice(samples).id)
+      for analysis in analyses
+    ], batch_size=5000)
+
+    File.objects.bulk_create([
+      File(analysis=rand.choice(analyses), path=f'bench/{index}.txt')
+      for index in range(options.files)
+    ], batch_size=5000)
+
+    log_entry = {'level': 'info', 'msg': 'x' * 200, 'display_in_report_view': False}
+    log_size = max(1, options.log_kb * 1024 // 256)
+    AnalysisLog.objects.bulk_create([
+      AnalysisLog(analysis=analysis, log={'infra': [log_entry] * log_size, 'bio': {}})
+      for analysis in analyses
+    ], batch_size=500)
+
+    # shares: each user gets view/edit/admin on a slice of other users' objects
+    for user in users:
+      for perm, model_objs in [('view', analyses), ('edit', samples), ('admin', projects)]:
+        shared = rand.sample(model_objs, min(options.shares, len(model_objs)))
+        model = type(shared[0])
+        assign_perm(perm, user, model.objects.filter(pk__in=[obj.pk for obj in shared]))
+
+    self.data = {
+      'analyses': analyses,
+      'host': host,
+      'projects': projects,
+      'samples': samples,
+      'users': users,
+      'workflows': workflows,
+    }
+
+  def load(self):
+    '''Reuse a dataset seeded by a previous run'''
+    from bpapp.models import Analysis, BpUser, Project, Sample, Workflow  # pylint: disable=import-outside-toplevel
+
+    self.data = {
+      'analyses': list(Analysis.objects.filter(name__startswith='bench-analysis-').select_related('owner')),
+      'projects': list(Project.objects.filter(name__startswith='bench-project-')),
+      'samples': list(Sample.objects.filter(name__startswith='bench-sample-').select_related('owner')),
+      'users': list(BpUser.objects.filter(username__startswith='bench-').exclude(username='bench-worker')),
+      'workflows': list(Workflow.objects.filter(name__startswith='bench-pipeline-')),
+    }
+
+  # scenarios
+
+  def run(self):
+    '''Run every scenario and return the JSON report'''
+    from bpapp.api3.resources.api_views import AnalysisViewSet  # pylint: disable=import-outside-toplevel
+
+    with ExitStack() as stack:
+      for service in SERVICES:
+        stack.enter_context(mock.patch(f'{VIEWSET_MODULE}.{service}', StubService))
+      for module in ['bpapp.api3.resources.serializer']:
+        stack.enter_context(mock.patch(f'{module}.S3', StubService))
+
+      results = {}
+      scenarios = {
+        'analysis.list': self._analysis_list(AnalysisViewSet),
+        'analysis.retrieve': self._analysis_retrieve(AnalysisViewSet),
+        'analysis.create': self._analysis_create(AnalysisViewSet),
+        'analysis.bulk_start': self._analysis_bulk_start(AnalysisViewSet),
+        'analysis.save_log': self._analysis_save_log(AnalysisViewSet),
+        'analysis.bulk_update_status': self._analysis_bulk_update_status(AnalysisViewSet),
+        'analysis.save_status': self._analysis_save_status(),
+        'analysis.update_with_sharing': self._analysis_update_with_sharing(AnalysisViewSet),
+        **self._analysis_deep_pages(AnalysisViewSet),
+        'analysis.provision_logs': self._analysis_provision_logs(),
+        **self._permission_helpers(),
+        **self._index_genome_lookups(),
+        **self._json_payloads(),
+      }
+      only = set(self.options.only or [])
+      for name, scenario in scenarios.items():
+        if only and name not in only:
+          continue
+        results[name] = self._time(scenario)
+
+    return {
+      'meta': {
+        'analyses': self.options.analyses,
+        'created_on': datetime.utcnow().isoformat(),
+        'database': self.connection.vendor,
+        'files': self.options.files,
+        'iterations': self.options.iterations,
+        'projects': self.options.projects,
+        'samples': self.options.samples,
+        'seed': self.options.seed,
+        'users': self.options.users,
+      },
+      'results': results,
+    }
+
+  def _time(self, scenario):
+    '''Time a scenario, each call returns nothing and raises on failure'''
+    timings, queries = [], []
+    for _ in range(self.options.iterations):
+      if self.options.cold_cache:
+        self.cache.clear()
+      with self.capture_queries() as captured:
+        start = time.perf_counter()
+        scenario()
+        timings.append(time.perf_counter() - start)
+      queries.append(len(captured.captured_queries))
+    return summarize(timings, queries)
+
+  def _request(self, viewset, actions, method, path, user, data=None, **kwargs):
+    '''Call a viewset action and check the response'''
+    request = getattr(self.factory, method)(path, data=data, format='json')
+    self.force_authenticate(request, user=user)
+    response = viewset.as_view(actions)(request, **kwargs)
+    if response.status_code >= 400:
+      raise RuntimeError(f'{method.upper()} {path} -> {response.status_code}: {getattr(response, "data", "")}')
+    if hasattr(response, 'render'):
+      response.render()
+    return response
+
+  def _pick_analysis(self):
+    '''Random analysis and its owner'''
+    analysis = self.random.choice(self.data['analyses'])
+    return analysis, analysis.owner
+
+  def _analysis_list(self, viewset):
+    def scenario():
+      user = self.random.choice(self.data['users'])
+      self._request(viewset, {'get': 'list'}, 'get', '/analyses/?limit=100', user)
+    return scenario
+
+  def _analysis_deep_pages(self, viewset):
+    '''Page of 100 analyses 90% deep into the list, by offset and by cursor'''
+    superuser = self._get_superuser()
+    depth = int(len(self.data['analyses']) * 0.9)
+
+    # walk the cursor pages once to reach the same depth
+    path, walked = '/analyses/?pagination=cursor&limit=1000', 0
+    while walked + 1000 <= depth:
+      next_url = self._request(viewset, {'get': 'list'}, 'get', path, superuser).data.get('next')
+      if not next_url:
+        break
+      query = parse_qs(urlsplit(next_url).query)
+      path = f"/analyses/?{urlencode({**{key: values[0] for key, values in query.items()}, 'limit': 1000})}"
+      walked += 1000
+    cursor_path = path.replace('limit=1000', 'limit=100')
+
+    # compare the two with growing --analyses: the cursor page should stay flat
+    return {
+      'analysis.list_deep_cursor': lambda: self._request(viewset, {'get': 'list'}, 'get', cursor_path, superuser),
+      'analysis.list_deep_offset': lambda: self._request(
+        viewset, {'get': 'list'}, 'get', f'/analyses/?limit=100&offset={walked}', superuser
+      ),
+    }
+
+  def _analysis_provision_logs(self):
+    '''Logs of a --batch-size batch of new analyses, rolled back after each run
+
+    The analyses insert is part of the timing, a single query on top of the logs one.
+    '''
+    from django.db import transaction  # pylint: disable=import-outside-toplevel
+    from bpapp.models import Analysis, provision_analysis_logs  # pylint: disable=import-outside-toplevel
+
+    def scenario():
+      owner = self.random.choice(self.data['users'])
+      workflow = self.random.choice(self.data['workflows'])
+      with transaction.atomic():
+        analyses = Analysis.objects.bulk_create([
+          Analysis(name=f'bench-provision-{index}', owner=owner, status='waiting-in-queue', workflow=workflow)
+          for index in range(self.options.batch_size)
+        ])
+        provision_analysis_logs(analyses)
+        transaction.set_rollback(True)
+    return scenario
+
+  def _analysis_retrieve(self, viewset):
+    def scenario():
+      analysis, owner = self._pick_analysis()
+      self._request(viewset, {'get': 'retrieve'}, 'get', f'/analyses/{analysis.id}/', owner, pk=analysis.id)
+    return scenario
+
+  def _analysis_create(self, viewset):
+    def scenario():
+      sample = self.random.choice(self.data['samples'])
+      project = self.random.choice(self.data['projects'])
+      workflow = self.random.choice(self.data['workflows'])
+      self._request(viewset, {'post': 'create'}, 'post', '/analyses/', sample.owner, data={
+        'meta': {'source': 'web'},
+        'name': 'bench-create',
+        'params': {},
+        'projects': [project.id],
+        'samples': [sample.id],
+        'workflow': workflow.id,
+      })
+    return scenario
+
+  def _analysis_bulk_start(self, viewset):
+    def scenario():
+      user = self.random.choice(self.data['users'])
+      project = self.random.choice(self.data['projects'])
+      self._request(viewset, {'post': 'bulk_start'}, 'post', '/analyses/bulk_start/', user, data={
+        'analyses': [{
+          'params': {},
+          'pipeline_id': self.random.choice(self.data['workflows']).id,
+          'samples': [self.random.choice(self.data['samples']).id],
+        } for _ in range(self.options.batch_size)],
+        'project_id': project.id,
+      })
+    return scenario
+
+  def _analysis_save_log(self, viewset):
+    def scenario():
+      analysis, owner = self._pick_analysis()
+      self._request(viewset, {'post': 'save_log'}, 'post', '/analyses/log/', owner, data={
+        'id': analysis.id,
+        'log': {'infra': [{'level': 'info', 'msg': 'benchmark'}]},
+      })
+    return scenario
+
+  def _analysis_bulk_update_status(self, viewset):
+    def scenario():
+      analyses = self.random.sample(self.data['analyses'], min(self.options.batch_size, len(self.data['analyses'])))
+      superuser = self._get_superuser()
+      self._request(viewset, {'post': 'bulk_update_status'}, 'post', '/analyses/status/', superuser, data={
+        'analyses': [{'id': analysis.id, 'status': self.random.choice(['running', 'started'])} for analysis in analyses],
+      })
+    return scenario
+
+  def _analysis_save_status(self):
+    '''A worker status update: load an analysis and save() it with a new status, its hooks included
+
+    Its query count is that of a single save(), the log is not touched once the analysis exists.
+    '''
+    from bpapp.models import Analysis  # pylint: disable=import-outside-toplevel
+
+    def scenario():
+      analysis = Analysis.objects.get(pk=self.random.choice(self.data['analyses']).pk)
+      analysis.status = 'started' if analysis.status == 'running' else 'running'
+      analysis.save()
+    return scenario
+
+  def _analysis_update_with_sharing(self, viewset):
+    def scenario():
+      analysis, owner = self._pick_analysis()
+      sharee = self.random.choice(self.data['users'])
+      params = json.dumps({'permission_data': {'emails': [sharee.email], 'perm': 'view'}})
+      self._request(viewset, {'put': 'update'}, 'put', f'/analyses/{analysis.id}/?params={params}', owner, data={
+        'name': analysis.name,
+        'projects': [],
+        'workflow': analysis.workflow_id,
+      }, pk=analysis.id)
+    return scenario
+
+  def _permission_helpers(self):
+    '''One scenario per permission helper'''
+    from bpapp.api3.resources.base_permission import BasePermission  # pylint: disable=import-outside-toplevel
+    from bpapp.api3.resources.permission import AnalysisPermission, SamplePermission  # pylint: disable=import-outside-toplevel
+
+    def _user():
+      return self.random.choice(self.data['users'])
+
+    def _analysis():
+      return self.random.choice(self.data['analyses'])
+
+    def _project():
+      return self.random.choice(self.data['projects'])
+
+    return {
+      'permission.can_analyze': lambda: AnalysisPermission.can_analyze(_user(), {
+        'projects': [_project().id], 'samples': [self.random.choice(self.data['samples']).id],
+      }),
+      'permission.can_add_sample': lambda: SamplePermission.can_add_sample(_user(), {'projects': [_project().id]}),
+      'permission.can_delete': lambda: BasePermission.can_delete(_user(), _analysis()),
+      'permission.can_edit': lambda: BasePermission.can_edit(_user(), _analysis()),
+      'permission.can_share': lambda: BasePermission.can_share(_user(), _analysis()),
+      'permission.get': lambda: BasePermission.get(_user(), _analysis()),
+      'permission.has_access_project': lambda: BasePermission.has_access(_user(), _project(), is_project=True),
+      'permission.has_auth_on_all_objs': lambda: BasePermission.has_auth_on_all_objs(
+        ['edit', 'admin'], _user(), self.random.sample(self.data['projects'], min(20, len(self.data['projects'])))
+      ),
+      'permission.has_project_perms': lambda: BasePermission.has_project_perms(['admin'], _user(), _analysis()),
+      'permission.has_sample_analysis_perms': lambda: BasePermission.has_sample_analysis_perms(
+        ['view', 'edit', 'admin'], _user(), _project()
+      ),
+    }
+
+  def _index_genome_lookups(self):
+    '''re_analyze genome lookup, through the params json scan and the indexed column'''
+    from bpapp.models import Analysis  # pylint: disable=import-outside-toplevel
+
+    genome_analyses = [
+      analysis for analysis in self.data['analyses']
+      if Analysis.get_index_genome_id(analysis.params) is not None
+    ] or self.data['analyses']
+
+    def _lookup(column):
+      def scenario():
+        analysis = self.random.choice(genome_analyses)
+        genome_id = Analysis.get_index_genome_id(analysis.params)
+        lookup = {'index_genome_id': genome_id} if column else {
+          'params__node__index_genome': {'index_genome_id': int(genome_id or 0)}
+        }
+        list(Analysis.objects.filter(owner_id=analysis.owner_id, **lookup)[:1])
+      return scenario
+
+    # compare runs with growing --analyses: the column lookup should stay flat
+    return {
+      'lookup.index_genome_column': _lookup(column=True),
+      'lookup.index_genome_json': _lookup(column=False),
+    }
+
+  def _json_payloads(self):
+    '''Render/parse scenarios on a large analysis payload'''
+    from rest_framework.parsers import JSONParser  # pylint: disable=import-outside-toplevel
+    from rest_framework.renderers import JSONRenderer  # pylint: disable=import-outside-toplevel
+    from bpapp.api3.resources.renderers import (  # pylint: disable=import-outside-toplevel
+      FastJSONParser, FastJSONRenderer, RawJSON
+    )
+
+    # ~`payload_mb` analysis detail, most of it in the workflow_data/params json columns
+    nodes = {
+      f'node_{index}': {'label': f'module {index}', 'params': {'values': list(range(50)), 'text': 'x' * 200}}
+      for index in range(self.options.payload_mb * 1024 * 1024 // 1200)
+    }
+    payload = {'id': 1, 'name': 'bench-payload', 'params': {'node': nodes}, 'workflow_data': {'nodes': nodes}}
+    raw_payload = {
+      **payload,
+      'params': RawJSON(JSONRenderer().render(payload['params']).decode('utf-8')),
+      'workflow_data': RawJSON(JSONRenderer().render(payload['workflow_data']).decode('utf-8')),
+    }
+    body = JSONRenderer().render(payload)
+
+    def _parse(parser):
+      return lambda: parser.parse(io.BytesIO(body), parser_context={})
+
+    return {
+      'json.render_stdlib': lambda: JSONRenderer().render(payload),
+      'json.render_fast': lambda: FastJSONRenderer().render(payload),
+      'json.render_fast_raw_columns': lambda: FastJSONRenderer().render(raw_payload),
+      'json.parse_stdlib': _parse(JSONParser()),
+      'json.parse_fast': _parse(FastJSONParser()),
+    }
+
+  def _get_superuser(self):
+    '''Superuser acting as compute worker'''
+    from bpapp.models import BpUser  # pylint: disable=import-outside-toplevel
+    superuser, _ = BpUser.objects.get_or_create(
+      username='bench-worker',
+      defaults={'email': 'bench-worker@example.com', 'is_superuser': True},
+    )
+    return superuser
+
+
+def parse_args(argv=None):
+  '''Command line options'''
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--allow-seed', action='store_true', help='seed whatever database is configured')
+  parser.add_argument('--analyses', type=int, default=20000)
+  parser.add_argument('--batch-size', type=int, default=50, help='items per bulk request')
+  parser.add_argument('--cold-cache', action='store_true', help='clear the django cache before each iteration')
+  parser.add_argument('--domain', default='testserver', help='host domain used for requests')
+  parser.add_argument('--files', type=int, default=50000)
+  parser.add_argument('--iterations', type=int, default=50)
+  parser.add_argument('--log-kb', type=int, default=256, help='size of each analysis log')
+  parser.add_argument('--only', nargs='*', help='scenario names to run')
+  parser.add_argument('--output', help='write the JSON report to this file')
+  parser.add_argument('--payload-mb', type=int, default=5, help='size of the json render/parse payload')
+  parser.add_argument('--projects', type=int, default=500)
+  parser.add_argument('--samples', type=int, default=20000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--shares', type=int, default=200, help='shared objects per user and model')
+  parser.add_argument('--skip-seed', action='store_true')
+  parser.add_argument('--users', type=int, default=50)
+  return parser.parse_args(argv)
+
+
+def check_seed_allowed(options):
+  '''Refuse to write the seed data outside a test/benchmark database, unless asked to'''
+  from django.conf import settings  # pylint: disable=import-outside-toplevel
+
+  name = str(settings.DATABASES['default'].get('NAME') or '')
+  if options.allow_seed or getattr(settings, 'BENCHMARK_DATABASE', False) \
+      or os.path.basename(name).startswith(('bench', 'test_')):
+    return
+  raise SystemExit(
+    f'Refusing to seed database {name!r}: use a test_*/bench* database, '
+    'set BENCHMARK_DATABASE = True in the settings or pass --allow-seed.'
+  )
+
+
+def main(argv=None):
+  '''Seed, run and report'''
+  options = parse_args(argv)
+  django.setup()
+
+  benchmark = Benchmark(options)
+  if options.skip_seed:
+    benchmark.load()
+  else:
+    check_seed_allowed(options)
+    benchmark.seed()
+  report = benchmark.run()
+
+  output = json.dumps(report, indent=2)
+  if options.output:
+    with open(options.output, 'w', encoding='utf-8') as output_file:
+      output_file.write(output)
+  else:
+    sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,28 @@
 
 class AnalysisFilterSet(FilterSet):
   '''Analysis filterset'''
+  q = CharFilter(method='filter_search')
+  # m2m name filters use EXISTS subqueries, joins would duplicate rows
+  controls__name__icontains = CharFilter(method='filter_controls_name')
+  samples__name__icontains = CharFilter(method='filter_samples_name')
+
+  def filter_search(self, queryset, name, value):  # pylint: disable=unused-argument, no-self-use
+    '''Search analysis, owner, workflow, sample and control names'''
+    return queryset.filter(search_text__contains=value.lower())
+
+  def filter_controls_name(self, queryset, name, value):  # pylint: disable=unused-argument, no-self-use
+    '''Filter by control name'''
+    return queryset.filter(Exists(Sample.objects.filter(
+      control_analyses=OuterRef('pk'),
+      name__icontains=value,
+    )))
+
+  def filter_samples_name(self, queryset, name, value):  # pylint: disable=unused-argument, no-self-use
+    '''Filter by sample name'''
+    return queryset.filter(Exists(Sample.objects.filter(
+      analyses=OuterRef('pk'),
+      name__icontains=value,
+    )))
 
   class Meta:
     model = Analysis
@@ -15,11 +37,9 @@ class AnalysisFilterSet(FilterSet):
       'owner__username': ['icontains'],
       'controls': ['exact'],
       'controls__id': ['exact'],
-      'controls__name': ['icontains'],
       'projects': ['exact'],
       'samples': ['exact'],
       'samples__id': ['exact'],
-      'samples__name': ['icontains'],
       'status': ['icontains', 'iregex', 'in'],
       'workflow': ['exact'],
       'workflow__id': ['exact'],
@@ -27,25 +47,83 @@ class AnalysisFilterSet(FilterSet):
     }
 
 
-class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
+# large json columns that status-only code paths don't need to load
+ANALYSIS_JSON_FIELDS = ['app_data', 'info', 'params', 'user_params', 'workflow_data']
+# json columns rendered pre-serialized on list/retrieve
+RAW_JSON_FIELDS = ['app_data', 'params', 'user_params', 'workflow_data']
+BULK_TERMINATE_WORKERS = 8
+
+
+class AnalysisViewSet(ExportMixin, BaseViewSet):  # pylint: disable=too-many-ancestors
   '''Analysis viewset'''
-  queryset = Analysis.objects.all()
+  queryset = Analysis.live.all()
   serializer_class = AnalysisSerializer
-  ordering = [
+  export_fields = (
+    'id',
+    'name',
+    'status',
+    'owner_id',
+    'owner__username',
+    'workflow_id',
+    'workflow__name',
+    'host_id',
+    'filesize',
+    'date_created',
+    'scheduled_on',
+    'started_on',
+    'completed_on',
+    'last_updated',
+  )
+  # newest first, served by the (-date_created, -id) indexes
+  ordering = ['-date_created', '-id']
+  # m2m fields (controls, samples) are not orderable, they duplicate rows
+  ordering_fields = [
     'completed_on',
-    'controls',
     'date_created',
     'filesize',
     'id',
     'last_updated',
     'name',
     'owner',
-    'samples',
     'started_on',
     'status',
   ]
   filterset_class = AnalysisFilterSet
+  pagination_class = AnalysisPagination
+  parser_classes = [FastJSONParser, FormParser, MultiPartParser]
   permission_classes = [AnalysisPermission]
+  renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+  def get_queryset(self):
+    '''Read the large json columns as raw text on list/retrieve, see RawJSONField
+
+    Lists leave archived analyses out unless `include_archived` is set.
+    '''
+    queryset = super().get_queryset()
+    include_archived = self.request.query_params.get('include_archived', '').lower() in ['1', 'true']
+    if self.action in ['export', 'list'] and not include_archived:
+      queryset = queryset.filter(archived_on__isnull=True)
+    if self.action in ['list', 'retrieve']:
+      queryset = queryset.defer(*RAW_JSON_FIELDS).annotate(**{
+        f'{field}_raw': Cast(field, output_field=TextField()) for field in RAW_JSON_FIELDS
+      })
+    return queryset
+
+  def get_object(self):
+    '''Restore archived analyses before any detail action reads or writes them'''
+    obj = super().get_object()
+    if obj.archived_on:
+      AnalysisArchive.rehydrate(obj.pk)
+      # read again with the restored json columns
+      obj = super().get_object()
+    return obj
+
+  @property
+  def paginator(self):
+    '''Use keyset pagination when a cursor is requested'''
+    if not hasattr(self, '_paginator') and AnalysisCursorPagination.is_requested(self.request):
+      self._paginator = AnalysisCursorPagination()  # pylint: disable=attribute-defined-outside-init
+    return super().paginator
 
   def create(self, request, *args, **kwargs):  # pylint: disable=too-many-locals
     '''Override obj create'''
@@ -55,15 +133,14 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
     payloads = request.data.copy()
 
     source = (payloads.get('meta', {}) or {}).get('source')
-    pipeline_id = (payloads.get('workflow') or '').split('/').pop()
-    if source == 'cli' and int(pipeline_id) in PIPELINE_NOT_ALLOWED_FROM_CLI:
+    pipeline_id = parse_pipeline_id(payloads.get('workflow'))
+    if source == 'cli' and pipeline_id in PIPELINE_NOT_ALLOWED_FROM_CLI:
       data = {
         'error': f'Analysis of pipeline id - {pipeline_id} cannot be started from CLI.'
       }
       return Response(data=data, status=status.HTTP_403_FORBIDDEN)
 
-    pipeline_validator = PipelineValidator(payloads)
-    validation_result = pipeline_validator.validate_all()
+    validation_result = validate(payloads, PipelineValidator)
     error = validation_result.get('error')
     warning = validation_result.get('warning')
 
@@ -77,46 +154,26 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
 
     serializer = self.get_serializer(data=payloads)
     serializer.is_valid(raise_exception=True)
-    obj = serializer.save()
-
-    obj.status = 'waiting-in-queue'
-    obj.meta = {'source': source or 'web', **(getattr(obj, 'meta', {}) or {})}
-    try:
-      obj.host = Host.objects.get(domain=request.get_host())
-    except Host.DoesNotExist:
-      member_of = HostsMembers.objects.filter(user=user).order_by('-created_on')[0]
-      obj.host = member_of.host
-    except IndexError:
-      obj.host = None
-    obj.save()
-
-    self.set_name(obj)
-
-    api_cfg = settings.CONFIG.get('api', {})
-    host = obj.host or Host.get_host_by_domain(api_cfg.get('host', ''))
-
-    queue_cfg = (host.config or {}).get('queue', {})
-    queue_settings = queue_cfg.get('settings', {})
-    queue_name = queue_settings.get('instance_queue', f'instance-{settings.MODE}')
-    queue = SQS({
-      'credentials': queue_cfg.get('credentials'),
-      'queue': queue_name,
-      'region': queue_settings.get('region'),
-    })
-    res = queue.send_message({
-      'action': 'start-analysis',
-      'analysis_id': obj.id,
-      'host': request.get_host()
-    })
-    if isinstance(res, dict) and res.get('error'):
-      msg = f"Cannot connect to analysis q from api:\n{res.get('detail')}"
-      if settings.MODE in ['prod', 'test']:
-        raise Exception(msg)
-      print(msg)
+    validated_data = serializer.validated_data
+
+    # everything is computed up front so the analysis is inserted with a single save,
+    # its m2m links are bulk inserted and the analysis log is created in the same transaction
+    with transaction.atomic():
+      obj = serializer.save(
+        host=self.get_request_host(request, user),
+        meta={'source': source or 'web', **(validated_data.get('meta') or {})},
+        name=validated_data.get('name') or self.get_default_name(
+          validated_data['workflow'], validated_data.get('samples') or []
+        ),
+        status='waiting-in-queue',
+      )
+
+      # update projects if different project list was given
+      projects = validated_data['projects']
+      update_projects(obj, projects)
+
+    transaction.on_commit(lambda: self._queue_start_analysis(obj, request))
 
-    # update projects if different project list was given
-    projects = serializer.validated_data['projects']
-    update_projects(obj, projects)
     serializer = self.get_serializer(obj)
     return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
@@ -132,7 +189,6 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
       payloads['workflow'] = payloads['workflow'].replace('workflows', 'pipelines')
 
     obj = self.get_object()
-    self.set_name(obj)
 
     # sharing validations - only owners/admins can share
     cannot_share = not BasePermission.can_share(user, obj)
@@ -141,14 +197,14 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
 
     # moving validations - only owners/admins can move analyses between projects
     project_ids = dict(payloads)['projects']
-    is_moving_copy = BasePermission.is_moving_or_copying(request, obj, project_ids, params)
-    cannot_move_copy = not BasePermission.can_move_or_copy(request, obj, project_ids, params)
-    if not user.is_superuser and is_moving_copy and cannot_move_copy:
+    move_plan = BasePermission.get_project_move_plan(request, obj, project_ids, params)
+    if not user.is_superuser and move_plan.is_moving_or_copying and not move_plan.is_authorized:
       raise exceptions.NotAuthorized('You are not authorized to move/copy this sample.')
 
     # if analysis is to be shared
     permission_data = params.get('permission_data')
     if permission_data:
+      self.set_name(obj)
       BasePermission.assign_obj_perms(obj, permission_data, request)
 
       # if user chose to share all of the analysis's samples
@@ -159,18 +215,21 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
 
     # if analysis permissions are to be changed
     elif params.get('update_permissions'):
+      self.set_name(obj)
       BasePermission.update_obj_perms(request, obj, params)
 
     else:
       serializer = self.get_serializer(obj, data=payloads)
       serializer.is_valid(raise_exception=True)
-      obj = serializer.save()
+      validated_data = serializer.validated_data
+      name = validated_data.get('name') or obj.name
+      if not name and 'samples' in validated_data:
+        name = self.get_default_name(validated_data['workflow'], validated_data['samples'])
+      obj = serializer.save(**({'name': name} if name else {}))
+      self.set_name(obj)
 
       # if we are moving an analysis from one project to another, remove the original project from the analysis
-      if params.get('old_project_id'):
-        obj.projects.remove(params['old_project_id'])
-      if params.get('new_project_id'):
-        obj.projects.add(params['new_project_id'])
+      move_plan.apply()
 
     serializer = self.get_serializer(obj)
     return Response(data=serializer.data, status=status.HTTP_204_NO_CONTENT)
@@ -190,18 +249,25 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
         obj.host = host
         obj.save()
 
+      # unchanged polls are answered without serializing or checking signed urls
       # we only check for signing url if user is not decider
-      if user.username != 'da_decider':
+      signed_urls = user.username != 'da_decider'
+      etag, last_modified = get_analysis_validators(obj.pk, user, signed_urls=signed_urls)
+      if is_not_modified(request, etag, last_modified):
+        return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+      if signed_urls:
         storage_cfg = (host.config or {}).get('storage', {}).get('user', {})
         storage_settings = storage_cfg.get('settings', {})
-        storage = S3({
+        storage = instrument_client(S3({
           'bucket': storage_settings.get('bucket'),
           'credentials': storage_cfg.get('credentials'),
           'region': storage_settings.get('region'),
-        })
+        }), 's3')
         session_credential = storage.get_credentials()
 
         # files_to_update = []
+        files_updated = False
         for file in obj.files.all():
           if file.is_url_expired(session_credential):
             result = storage.get_self_signed(file.path, 28800) # 8hs
@@ -214,17 +280,25 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
             file.uri = file.uri or f"s3://{storage_settings.get('bucket')}/{file.path}"
             file.url = result
             file.save()
+            files_updated = True
             # replace above line with below two after upgrading to django>=2.2
             #   files_to_update.append(file)
             # File.objects.bulk_update(files_to_update, ['url'])
 
+        if files_updated:
+          etag, last_modified = get_analysis_validators(obj.pk, user, signed_urls=signed_urls)
+
+      serializer = self.get_serializer(obj)
+      return set_validators(Response(data=serializer.data), etag, last_modified)
+
     serializer = self.get_serializer(obj)
     return Response(data=serializer.data)
 
   def destroy(self, request, *args, **kwargs):
     '''Override obj destroy'''
-    self.soft_destroy(request, *args, **kwargs)
+    # the queryset only has live analyses, fetch obj before it is soft deleted
     obj = self.get_object()
+    self.soft_destroy(request, *args, **kwargs)
     # delete log
     AnalysisLog.objects.filter(analysis_id=obj.id).delete()
 
@@ -236,11 +310,11 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
     queue_settings = queue_cfg.get('settings', {})
     queue_name = queue_settings.get('instance_queue', f'instance-{settings.MODE}')
 
-    queue = SQS({
+    queue = instrument_client(SQS({
       'credentials': queue_cfg.get('credentials'),
       'queue': queue_name,
       'region': queue_settings.get('region'),
-    })
+    }), 'sqs')
     queue.send_message({
       'action': 'terminate-instance',
       'analysis_id': obj.id,
@@ -262,43 +336,64 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
       queue_cfg = (host.config or {}).get('queue', {})
       queue_settings = queue_cfg.get('settings', {})
       queue_name = queue_settings.get('instance_queue', f'instance-{settings.MODE}')
-      queue = SQS({
+      queue = instrument_client(SQS({
         'credentials': queue_cfg.get('credentials'),
         'queue': queue_name,
         'region': queue_settings.get('region'),
-      })
-      # creating analyses
-      analyses = Analysis.objects.bulk_create([
-        Analysis(
-          host=host,
-          meta={'source': 'cli', **(analysis.get('meta') or {})},
-          name=analysis.get('name'),
-          owner=user,
-          params=analysis.get('params', {}),
-          status='waiting-in-queue',
-          workflow_id=analysis.get('pipeline_id'),
-        ) for analysis in data_analyses
-      ])
-
-      # TODO: move to celery pylint: disable=fixme
-      # we update the analysis if it was saved
-      for index, analysis in enumerate(analyses):
-        if analysis.id:
-          # set the m2m
-          analysis.samples.set(Sample.objects.filter(pk__in=data_analyses[index].get('samples', [])))
-          analysis.controls.set(Sample.objects.filter(pk__in=data_analyses[index].get('controls', [])))
-          analysis.projects.add(project_id)
-          # create analysis logs
-          analysis_log = AnalysisLog.objects.create(analysis=analysis)
-          analysis_log.reset()
-          # queuing message
-          queue.send_message({
-            'action': 'start-analysis',
-            'analysis_id': analysis.id,
-            'host': request.get_host()
-          })
-          response.append({'id': analysis.id, 'name': analysis.name, 'params': analysis.params})
-      return Response({'analyses': response, 'success': True})
+      }), 'sqs')
+
+      # validating analyses, invalid ones are reported by index and not created
+      errors = []
+      # same payload shape as create: the workflow uri
+      validation_results = validate_batch([
+        {**analysis, 'workflow': get_workflow_uri(analysis.get('pipeline_id'))} for analysis in data_analyses
+      ], PipelineValidator)
+      valid_analyses = []
+      for index, (analysis, validation_result) in enumerate(zip(data_analyses, validation_results)):
+        if get_errors(validation_result):
+          errors.append({'error': validation_result, 'index': index})
+        else:
+          valid_analyses.append(analysis)
+      data_analyses = valid_analyses
+
+      # creating analyses, their search_text is built once on commit, after the m2m are set
+      names = self.get_default_names(data_analyses)
+      with transaction.atomic():
+        analyses = Analysis.objects.bulk_create([
+          Analysis(
+            host=host,
+            meta={'source': 'cli', **(analysis.get('meta') or {})},
+            name=analysis.get('name') or names[index],
+            index_genome_id=Analysis.get_index_genome_id(analysis.get('params')),
+            owner=user,
+            params=analysis.get('params', {}),
+            status='waiting-in-queue',
+            workflow_id=analysis.get('pipeline_id'),
+          ) for index, analysis in enumerate(data_analyses)
+        ])
+
+        # create analysis logs, bulk_create doesn't send post_save
+        provision_analysis_logs(analyses)
+        Analysis.schedule_search_text_refresh([analysis.id for analysis in analyses if analysis.id])
+
+        # TODO: move to celery pylint: disable=fixme
+        # we update the analysis if it was saved
+        for index, analysis in enumerate(analyses):
+          if analysis.id:
+            # set the m2m
+            analysis.samples.set(Sample.objects.filter(pk__in=data_analyses[index].get('samples', [])))
+            analysis.controls.set(Sample.objects.filter(pk__in=data_analyses[index].get('controls', [])))
+            analysis.projects.add(project_id)
+            response.append({'id': analysis.id, 'name': analysis.name, 'params': analysis.params})
+
+      # queuing messages, once the analyses are committed
+      for started in response:
+        queue.send_message({
+          'action': 'start-analysis',
+          'analysis_id': started['id'],
+          'host': request.get_host()
+        })
+      return Response({'analyses': response, 'errors': errors, 'success': bool(response) or not errors})
     return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
 
   @action(detail=False, methods=['post'], url_path='log')
@@ -310,15 +405,111 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
       try:
         analysis_log = AnalysisLog.objects.filter(analysis_id=data.get('id'))[0]
       except IndexError:
-        return Response({'error': 'AnalysisLog object not found.'}, status=status.HTTP_400_BAD_REQUEST)
+        # logs are only provisioned on creation, older analyses get theirs on first write
+        if not Analysis.objects.filter(pk=data.get('id')).exists():
+          return Response({'error': 'AnalysisLog object not found.'}, status=status.HTTP_400_BAD_REQUEST)
+        analysis_log, _ = AnalysisLog.objects.get_or_create(
+          analysis_id=data.get('id'), defaults={'log': get_reset_log()}
+        )
 
       analysis_log.log = deep_merge(data.get('log'), (analysis_log.log or {}))
       analysis_log.save()
 
+      publish_analysis_event(
+        Analysis.objects.filter(pk=analysis_log.analysis_id).values_list('owner_id', flat=True).first(),
+        'log',
+        {'id': analysis_log.analysis_id, 'log': data.get('log')}
+      )
       return Response({'status': 'SUCCESS'})
     return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
 
+  @action(detail=False, methods=['get'], renderer_classes=[EventStreamRenderer, JSONRenderer])
+  def events(self, request):  # pylint: disable=no-self-use
+    '''Stream the user's analysis status and log events (server-sent events)'''
+    user = request.user
+    if user and user.is_authenticated:
+      response = StreamingHttpResponse(stream_user_events(user), content_type='text/event-stream')
+      response['Cache-Control'] = 'no-cache'
+      response['X-Accel-Buffering'] = 'no'
+      return response
+    return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
+
+  @action(detail=False, methods=['post'], url_path='status')
+  def bulk_update_status(self, request):  # pylint: disable=no-self-use
+    '''Apply status/timestamp updates of many analyses in one batch
+
+    Rows are validated first, nothing is saved when one of them is invalid.
+    '''
+    user = request.user
+    if user and user.is_authenticated:
+      updates = {str(item.get('id')): item for item in request.data.get('analyses') or [] if item.get('id')}
+
+      values, errors = {}, []
+      for analysis_id, update in updates.items():
+        values[analysis_id], error = self.parse_status_update(update)
+        if error:
+          errors.append({'error': error, 'id': analysis_id})
+      if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+      analyses = Analysis.objects.filter(pk__in=updates.keys()).defer(*ANALYSIS_JSON_FIELDS)
+      if not user.is_superuser:
+        analyses = analyses.filter(owner=user)
+      analyses = list(analyses)
+
+      fields = set()
+      for analysis in analyses:
+        for field, value in values[str(analysis.id)].items():
+          setattr(analysis, field, value)
+          fields.add(field)
+        if analysis.started_on and analysis.completed_on and analysis.completed_on < analysis.started_on:
+          errors.append({'error': {'completed_on': 'Must not be before started_on.'}, 'id': str(analysis.id)})
+      if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+      status_changed = Analysis.bulk_update_status(analyses, sorted(fields)) if fields else []
+
+      found_ids = {str(analysis.id) for analysis in analyses}
+      return Response({
+        'not_found': [analysis_id for analysis_id in updates if analysis_id not in found_ids],
+        'status_changed': [analysis.id for analysis in status_changed],
+        'updated': len(analyses),
+      })
+    return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
+
+  @staticmethod
+  def parse_status_update(update):
+    '''(values, errors) of a bulk status update row'''
+    values, errors = {}, {}
+    if 'status' in update:
+      value = update['status']
+      # workers report their step after started/running, the prefix terminate looks for
+      if isinstance(value, str) and (value in Analysis.STATUSES or re.search(r'^(started|running)', value)):
+        values['status'] = value
+      else:
+        errors['status'] = f"Must be one of {', '.join(Analysis.STATUSES)}, or start with started or running."
+    for field in ['started_on', 'completed_on']:
+      if field not in update:
+        continue
+      value = update[field]
+      try:
+        values[field] = parse_datetime(value) if isinstance(value, str) else None
+      except ValueError:  # well formatted but impossible, e.g. 2021-02-30
+        values[field] = None
+      if values[field] is None and value is not None:
+        errors[field] = 'Invalid datetime.'
+    if 'filesize' in update:
+      try:
+        values['filesize'] = int(update['filesize'] or 0)
+      except (TypeError, ValueError):
+        errors['filesize'] = 'Must be an integer.'
+      else:
+        if values['filesize'] < 0:
+          errors['filesize'] = 'Must not be negative.'
+    return values, errors or None
+
   @action(detail=False, methods=['post'], url_path='reanalyze')
+  @idempotent
   def re_analyze(self, request):  # pylint: disable=no-self-use, too-many-locals
     '''Re queue analysis to be re analyzed'''
     user = request.user
@@ -340,10 +531,8 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
         if not Genome.objects.filter(pk=genome_id).exists():
           raise exceptions.BadRequest(f'Genome not found with id: {genome_id}.')
         try:
-          analysis = Analysis.objects.filter(**{
-            'params__node__index_genome': {'index_genome_id': genome_id},
-            'owner': user
-          })[0]
+          # index_genome_id mirrors params.node.index_genome, see analysis_index_genome_idx
+          analysis = Analysis.objects.filter(index_genome_id=str(genome_id), owner=user)[0]
         except IndexError:
           try:
             Workflow.objects.get(pk=INDEX_GENOME_PIPELINE)
@@ -356,49 +545,63 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
       if analysis.deleted_on:
         raise exceptions.BadRequest('This analysis has been deleted.')
 
-      # set analysis status
-      analysis.status = 'waiting-in-queue'
-      analysis.meta = {
-        **analysis.meta,
-        'source': source
-      }
-      analysis.scheduled_on = datetime.now(pytz.utc)
-      analysis.save()
-
-      # send request to queue
-      api_cfg = settings.CONFIG.get('api', {})
-      host = analysis.host if analysis else Host.get_host_by_domain(api_cfg.get('host', ''))
-
-      queue_cfg = (host.config or {}).get('queue', {})
-      queue_settings = queue_cfg.get('settings', {})
-      queue_name = queue_settings.get('instance_queue', f'instance-{settings.MODE}')
+      # duplicate requests (webapp, cli, internal services) collapse into the first one
+      if not acquire_analysis_lock('re_analyze', analysis.id):
+        LOG.info(f'analysis.re_analyze: duplicate request from {source} for analysis id {analysis.id} ignored')
+        return Response({'status': 'SUCCESS', 'detail': 'Re-analysis already requested.'})
 
-      delay = 0 if source == 'webapp' else 300
-
-      queue = SQS({
-        'credentials': queue_cfg.get('credentials'),
-        'queue': queue_name,
-        'region': queue_settings.get('region'),
-      })
-      queue.send_message({
-        'action': 'restart-analysis',
-        'analysis_id': analysis_id,
-        'force': True,
-        'instance_type': data.get('instance_type'),
-        'send_completion_email': not user.is_superuser
-      }, delay=delay)
+      with hold_analysis_locks('re_analyze', [analysis.id]):
+        # archived analyses are restored before being queued again
+        if analysis.archived_on:
+          AnalysisArchive.rehydrate(analysis.id)
+          analysis.refresh_from_db()
 
-      # reset logs
-      analysis_log, _ = AnalysisLog.objects.get_or_create(analysis=analysis)
-      analysis_log.reset()
+        # set analysis status
+        analysis.status = 'waiting-in-queue'
+        analysis.meta = {
+          **analysis.meta,
+          'source': source
+        }
+        analysis.scheduled_on = datetime.now(pytz.utc)
+        analysis.save()
 
-      # delete all existing files
-      File.objects.filter(analysis_id=analysis.id).delete()
+        # send request to queue
+        api_cfg = settings.CONFIG.get('api', {})
+        host = analysis.host if analysis else Host.get_host_by_domain(api_cfg.get('host', ''))
+
+        queue_cfg = (host.config or {}).get('queue', {})
+        queue_settings = queue_cfg.get('settings', {})
+        queue_name = queue_settings.get('instance_queue', f'instance-{settings.MODE}')
+
+        delay = 0 if source == 'webapp' else 300
+
+        queue = instrument_client(SQS({
+          'credentials': queue_cfg.get('credentials'),
+          'queue': queue_name,
+          'region': queue_settings.get('region'),
+        }), 'sqs')
+        queue.send_message({
+          'action': 'restart-analysis',
+          'analysis_id': analysis_id,
+          'force': True,
+          'instance_type': data.get('instance_type'),
+          'send_completion_email': not user.is_superuser
+        }, delay=delay)
+
+        # reset logs
+        analysis_log, _ = AnalysisLog.objects.get_or_create(analysis=analysis)
+        analysis_log.reset()
+
+        # delete all existing files, in one delete after the request commits
+        file_ids = list(File.objects.filter(analysis_id=analysis.id).values_list('pk', flat=True))
+        if file_ids:
+          run_in_background(File.objects.filter(pk__in=file_ids).delete)
 
       return Response({'status': 'SUCCESS'})
     return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
 
   @action(detail=False, methods=['post'])
+  @idempotent
   def terminate(self, request):  # pylint: disable=no-self-use
     '''Terminate instance and delete SWF task'''
     user = request.user
@@ -424,18 +627,199 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
         raise exceptions.BadRequest(f'Analysis termination with status - {analysis.status} is not allowed.')
 
       if BasePermission.can_edit(user, analysis):
-        try:
-          self._terminate_workflow(analysis=analysis)
-          self._terminate_instance(analysis=analysis)
-        except Exception as error:  # pylint: disable=broad-except
-          print(f'ERROR: Terminating analysis failed - {str(error)}')
-          return Response({'error': f'Terminating analysis failed - {str(error)}'}, status=status.HTTP_400_BAD_REQUEST)
+        # duplicate requests (webapp, cli, internal services) collapse into the first one
+        if not acquire_analysis_lock('terminate', analysis.id):
+          LOG.info(f'analysis.terminate: duplicate request from {source} for analysis id - {analysis_id} ignored')
+          return Response({'status': 'SUCCESS', 'detail': 'Termination already requested.'})
 
-        # set analysis status
-        analysis.status = 'abort'
-        analysis.save()
-        try:
-          analysis_log = AnalysisLog.objects.get(analysis_id=analysis_id)
+        with hold_analysis_locks('terminate', [analysis.id]):
+          try:
+            self._terminate_workflow(analysis=analysis)
+            self._terminate_instance(analysis=analysis)
+          except Exception as error:  # pylint: disable=broad-except
+            print(f'ERROR: Terminating analysis failed - {str(error)}')
+            return Response(
+              {'error': f'Terminating analysis failed - {str(error)}'},
+              status=status.HTTP_400_BAD_REQUEST
+            )
+
+          # set analysis status
+          analysis.status = 'abort'
+          analysis.save()
+          try:
+            analysis_log = AnalysisLog.objects.get(analysis_id=analysis_id)
+            analysis_log.log = deep_merge({
+              'infra': [{
+                'display_in_report_view': False,
+                'level': 'info',
+                'msg': f'Analysis terminated after receiving request from {source}',
+              }]
+            }, (analysis_log.log or {}))
+            analysis_log.save()
+          except AnalysisLog.DoesNotExist:
+            print(f'ERROR: Analysis log object not found with analysis id - {analysis_id}')
+          return Response({'status': 'SUCCESS'})
+    return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
+
+  @staticmethod
+  def get_request_host(request, user):
+    '''Get the host an analysis created in this request belongs to'''
+    try:
+      return Host.objects.get(domain=request.get_host())
+    except Host.DoesNotExist:
+      member_of = HostsMembers.objects.filter(user=user).order_by('-created_on').first()
+      return member_of.host if member_of else None
+
+  @staticmethod
+  def get_default_name(workflow, samples):
+    '''Default analysis name from its workflow and samples'''
+    return Analysis.build_name(
+      workflow.name,
+      [sample.name for sample in samples if not sample.deleted_on]
+    )
+
+  @staticmethod
+  def get_default_names(data_analyses):
+    '''Default names for a bulk_start payload, with one query per model'''
+    unnamed = [analysis for analysis in data_analyses if not analysis.get('name')]
+    if not unnamed:
+      return [None] * len(data_analyses)
+
+    workflow_names = dict(Workflow.objects.filter(
+      pk__in={analysis.get('pipeline_id') for analysis in unnamed}
+    ).values_list('pk', 'name'))
+    sample_names = dict(Sample.objects.filter(
+      pk__in={sample_id for analysis in unnamed for sample_id in analysis.get('samples', [])},
+      deleted_on__isnull=True
+    ).values_list('pk', 'name'))
+    workflow_names = {str(pk): name for pk, name in workflow_names.items()}
+    sample_names = {str(pk): name for pk, name in sample_names.items()}
+
+    return [
+      None if analysis.get('name') else Analysis.build_name(
+        workflow_names.get(str(analysis.get('pipeline_id')), ''),
+        [
+          sample_names[str(sample_id)] for sample_id in analysis.get('samples', [])
+          if str(sample_id) in sample_names
+        ]
+      ) for analysis in data_analyses
+    ]
+
+  @staticmethod
+  def _queue_start_analysis(obj, request):
+    '''Send analysis start message'''
+    api_cfg = settings.CONFIG.get('api', {})
+    host = obj.host or Host.get_host_by_domain(api_cfg.get('host', ''))
+
+    queue_cfg = (host.config or {}).get('queue', {})
+    queue_settings = queue_cfg.get('settings', {})
+    queue_name = queue_settings.get('instance_queue', f'instance-{settings.MODE}')
+    queue = instrument_client(SQS({
+      'credentials': queue_cfg.get('credentials'),
+      'queue': queue_name,
+      'region': queue_settings.get('region'),
+    }), 'sqs')
+    res = queue.send_message({
+      'action': 'start-analysis',
+      'analysis_id': obj.id,
+      'host': request.get_host()
+    })
+    if isinstance(res, dict) and res.get('error'):
+      msg = f"Cannot connect to analysis q from api:\n{res.get('detail')}"
+      if settings.MODE in ['prod', 'test']:
+        raise Exception(msg)
+      print(msg)
+
+  @action(detail=False, methods=['post'], url_path='terminate/bulk')
+  def bulk_terminate(self, request):  # pylint: disable=too-many-locals
+    '''Terminate many analyses, returning a result per analysis
+
+    The SWF termination and the instance termination message of each analysis
+    are sent from a bounded pool. The SQS wrapper only has send_message (one
+    message with its delay), no SendMessageBatch, so the messages can't be
+    grouped 10 per call: they are sent concurrently instead.
+    '''
+    user = request.user
+    if user and user.is_authenticated:
+      data = request.data
+      source = data.get('source', 'N/A')
+      analysis_ids = list(dict.fromkeys(str(analysis_id) for analysis_id in data.get('ids') or []))
+      LOG.info(f'analysis.bulk_terminate: terminate request received from {source} for {len(analysis_ids)} analyses')
+      if not analysis_ids:
+        raise exceptions.BadRequest('Analysis ids required.')
+
+      analyses = {
+        str(analysis.id): analysis for analysis in Analysis.objects.filter(
+          pk__in=analysis_ids
+        ).select_related('host').defer(*ANALYSIS_JSON_FIELDS)
+      }
+      editable_ids = set(analyses) if user.is_superuser else {
+        str(pk) for pk in Analysis.objects.filter(
+          Q(owner=user) | Q(pk__in=get_objects_for_user(
+            user, ['edit', 'admin'], Analysis,
+            any_perm=True
+          ).values('pk')),
+          pk__in=analysis_ids
+        ).values_list('pk', flat=True)
+      }
+
+      # set-wise validation, same rules as `terminate`
+      results = {}
+      to_terminate = []
+      for analysis_id in analysis_ids:
+        analysis = analyses.get(analysis_id)
+        if not analysis:
+          results[analysis_id] = {'error': 'Analysis object not found.'}
+        elif analysis.deleted_on:
+          results[analysis_id] = {'error': 'Analysis has been deleted.'}
+        elif not re.search(r'^(started|running)', analysis.status or ''):
+          results[analysis_id] = {'error': f'Analysis termination with status - {analysis.status} is not allowed.'}
+        elif analysis_id not in editable_ids:
+          results[analysis_id] = {'error': 'UNAUTHORIZED'}
+        elif not acquire_analysis_lock('terminate', analysis.id):
+          results[analysis_id] = {'status': 'SUCCESS', 'detail': 'Termination already requested.'}
+        else:
+          to_terminate.append(analysis)
+
+      with hold_analysis_locks('terminate', [analysis.id for analysis in to_terminate]):
+        # one SWF and one SQS client per host, terminations sent through a bounded pool
+        # hosts and clients are resolved here: the workers make no queries, so open no db connection
+        clients, hosts = {}, {}
+        for analysis in to_terminate:
+          host = hosts[analysis.id] = self._get_analysis_host(analysis)
+          if host.pk not in clients:
+            clients[host.pk] = (self._get_workflow_service(host), self._get_instance_queue(host))
+
+        def _terminate(analysis):
+          '''Terminate SWF task and instance of one analysis'''
+          host = hosts[analysis.id]
+          workflow_service, queue = clients[host.pk]
+          self._terminate_workflow(analysis=analysis, workflow_service=workflow_service, host=host)
+          self._terminate_instance(analysis=analysis, queue=queue)
+
+        terminated = []
+        with ThreadPoolExecutor(max_workers=BULK_TERMINATE_WORKERS) as executor:
+          # each task runs in a copy of the request context, so its outbound calls reach the request metrics
+          futures = {
+            executor.submit(contextvars.copy_context().run, _terminate, analysis): analysis
+            for analysis in to_terminate
+          }
+          for future in as_completed(futures):
+            analysis = futures[future]
+            try:
+              future.result()
+            except Exception as error:  # pylint: disable=broad-except
+              results[str(analysis.id)] = {'error': f'Terminating analysis failed - {str(error)}'}
+            else:
+              analysis.status = 'abort'
+              terminated.append(analysis)
+              results[str(analysis.id)] = {'status': 'SUCCESS'}
+
+        # set analyses status
+        Analysis.bulk_update_status(terminated, ['status'])
+
+        analysis_logs = list(AnalysisLog.objects.filter(analysis_id__in=[analysis.id for analysis in terminated]))
+        for analysis_log in analysis_logs:
           analysis_log.log = deep_merge({
             'infra': [{
               'display_in_report_view': False,
@@ -443,36 +827,55 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
               'msg': f'Analysis terminated after receiving request from {source}',
             }]
           }, (analysis_log.log or {}))
-          analysis_log.save()
-        except AnalysisLog.DoesNotExist:
-          print(f'ERROR: Analysis log object not found with analysis id - {analysis_id}')
-        return Response({'status': 'SUCCESS'})
+        AnalysisLog.objects.bulk_update(analysis_logs, ['log'])
+
+      return Response({'results': [
+        {'id': analysis_id, **results[analysis_id]} for analysis_id in analysis_ids
+      ]})
     return Response({'error': 'UNAUTHORIZED'}, status=status.HTTP_401_UNAUTHORIZED)
 
   @staticmethod
   def set_name(obj):
     '''Set analysis name if empty'''
     if not obj.name:
-      obj.name = f'{obj.workflow.name}'
-      samples = obj.samples.filter(deleted_on__isnull=True)
-      if samples.count():
-        obj.name += f' on {samples[0].name}'
-      obj.save()
+      sample_names = obj.samples.filter(deleted_on__isnull=True).values_list('name', flat=True)[:1]
+      obj.name = Analysis.build_name(obj.workflow.name, list(sample_names))
+      obj.save(update_fields=['name', 'last_updated'])
 
   @staticmethod
-  def _terminate_instance(analysis=None):
-    '''Send ec2 instance termination message'''
+  def _get_analysis_host(analysis):
+    '''Host of an analysis, defaulting to the api host'''
     api_cfg = settings.CONFIG.get('api', {})
-    host = analysis.host or Host.get_host_by_domain(api_cfg.get('host', ''))
+    return analysis.host or Host.get_host_by_domain(api_cfg.get('host', ''))
 
+  @staticmethod
+  def _get_instance_queue(host):
+    '''Instance queue client of a host'''
     queue_cfg = (host.config or {}).get('queue', {})
     queue_settings = queue_cfg.get('settings', {})
 
-    queue = SQS({
+    return instrument_client(SQS({
       'credentials': queue_cfg.get('credentials'),
       'queue': queue_settings.get('instance_queue', f'instance-{settings.MODE}'),
       'region': queue_settings.get('region'),
-    })
+    }), 'sqs')
+
+  @staticmethod
+  def _get_workflow_service(host):
+    '''SWF client of a host'''
+    workflow_cfg = (host.config or {}).get('workflow', {})
+    workflow_settings = workflow_cfg.get('settings', {})
+
+    return instrument_client(SWF({
+      'credentials': workflow_cfg.get('credentials'),
+      'domain': workflow_settings.get('domain'),
+      'region': workflow_settings.get('region'),
+    }), 'swf')
+
+  @staticmethod
+  def _terminate_instance(analysis=None, queue=None):
+    '''Send ec2 instance termination message'''
+    queue = queue or AnalysisViewSet._get_instance_queue(AnalysisViewSet._get_analysis_host(analysis))
     queue.send_message({
       'action': 'terminate-instance',
       'analysis_id': analysis.id,
@@ -481,17 +884,62 @@ class AnalysisViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
     }, delay=0)
 
   @staticmethod
-  def _terminate_workflow(analysis=None):
+  def _terminate_workflow(analysis=None, workflow_service=None, host=None):
     '''Terminate SWF task'''
-    api_cfg = settings.CONFIG.get('api', {})
-    host = analysis.host or Host.get_host_by_domain(api_cfg.get('host', ''))
-
-    workflow_cfg = (host.config or {}).get('workflow', {})
-    workflow_settings = workflow_cfg.get('settings', {})
+    host = host or AnalysisViewSet._get_analysis_host(analysis)
+    workflow_service = workflow_service or AnalysisViewSet._get_workflow_service(host)
+    workflow_service.terminate(f"{host.domain.replace('.', '_')}-analysis-{analysis.id}")
+
+
+class InstanceViewSet(BaseViewSet):  # pylint: disable=too-many-ancestors
+  '''Instance viewset, read only'''
+  queryset = Instance.live.select_related('analysis').all()
+  serializer_class = InstanceSerializer
+  filterset_fields = {
+    'analysis': ['exact'],
+    'instance_type': ['exact', 'in'],
+    'lifecycle': ['exact', 'in'],
+    'mode': ['exact'],
+    'owner': ['exact'],
+    'requested_on': ['gte', 'lt'],
+    'terminated_on': ['isnull'],
+  }
+  http_method_names = ['get', 'options']
+  ordering = ['date_created', 'id', 'instance_type', 'ready_on', 'requested_on', 'terminated_on']
+  permission_classes = [InstancePermission]
+
+  def get_queryset(self):
+    '''Non superusers only see their own instances'''
+    queryset = super().get_queryset()
+    user = self.request.user
+    return queryset if user.is_superuser else queryset.filter(owner_id=user.id)
+
+  @action(detail=False, methods=['get'])
+  def report(self, request):
+    '''Average boot/run seconds, billed hours and cost grouped by `group_by`
+
+    Filtered like the list, `group_by` is a comma separated list of
+    analysis_id, host_id, instance_type, lifecycle, mode and owner_id
+    (defaults to instance_type,lifecycle), `days` restricts to the instances
+    requested in the last n days.
+    '''
+    group_by = [
+      group for group in request.query_params.get('group_by', 'instance_type,lifecycle').split(',') if group
+    ]
+    unknown = [group for group in group_by if group not in InstanceQuerySet.REPORT_GROUPS]
+    if unknown or not group_by:
+      raise ValidationError({'group_by': f"Must be a list of: {', '.join(InstanceQuerySet.REPORT_GROUPS)}."})
+
+    queryset = self.filter_queryset(self.get_queryset())
+    days = request.query_params.get('days')
+    if days:
+      try:
+        queryset = queryset.requested_between(start=datetime.now(pytz.utc) - timedelta(days=int(days)))
+      except ValueError as error:
+        raise ValidationError({'days': 'Must be an integer.'}) from error
 
-    workflow_service = SWF({
-      'credentials': workflow_cfg.get('credentials'),
-      'domain': workflow_settings.get('domain'),
-      'region': workflow_settings.get('region'),
+    return Response(data={
+      'group_by': group_by,
+      'results': list(queryset.order_by().report(group_by=group_by)),
     })
-    workflow_service.terminate(f"{host.domain.replace('.', '_')}-analysis-{analysis.id}")
\ No newline at end of file
+
@@ -1,13 +1,15 @@
 '''Base permission'''
 
 # Lib imports
-from guardian.shortcuts import assign_perm, remove_perm, get_objects_for_user
+from django.db.models import Q
+from guardian.shortcuts import get_objects_for_user
 from rest_framework.exceptions import APIException
 from rest_framework.permissions import (BasePermission as DRFBasePermission,
                                   IsAuthenticated)
 
 # App imports
 from bpapp.api3 import exceptions
+from bpapp.api3.resources.permission_cache import PermissionCache, assign_perm, remove_perm
 from bpapp.models import BpUser, Project, Analysis, Sample, Host
 from bpapp.share import Share
 
@@ -21,7 +23,14 @@ class BasePermission(DRFBasePermission):
   def has_object_permission(self, request, view, obj):
     '''object level permission check fallback'''
     user = request.user
-    return user.is_superuser or getattr(self, f'_{request.method.lower()}')(request, user, obj)
+    if user.is_superuser:
+      return True
+
+    action = request.method.lower()
+    return PermissionCache.get_or_compute(
+      self, user, obj, action,
+      lambda: getattr(self, f'_{action}')(request, user, obj)
+    )
 
   def _get(self, request, user, obj):
     '''read detail access'''
@@ -64,46 +73,21 @@ class BasePermission(DRFBasePermission):
             raise exceptions.NotAuthorized('You are not authorized to make this update.')
 
   @staticmethod
-  def is_moving_or_copying(request, obj, project_ids, params):  # pylint: disable=arguments-differ
-    '''Check if the user is moving or copying obj'''
-    old_projects_ids = obj.projects.filter(
-      deleted_on__isnull=True
-    ).values_list('pk', flat=True)
-
-    new_projects = Project.objects.filter(
-      pk__in=project_ids, deleted_on__isnull=True
-    ).exclude(pk__in=old_projects_ids)
+  def get_project_move_plan(request, obj, project_ids, params):
+    '''Build the project move plan for an update request'''
+    return ProjectMovePlan(request.user, obj, project_ids, params)
 
-    return params.get('old_project_id') \
-      or params.get('new_project_id') \
-      or new_projects
+  @staticmethod
+  def is_moving_or_copying(request, obj, project_ids, params, plan=None):  # pylint: disable=arguments-differ
+    '''Check if the user is moving or copying obj'''
+    plan = plan or BasePermission.get_project_move_plan(request, obj, project_ids, params)
+    return plan.is_moving_or_copying
 
   @staticmethod
-  def can_move_or_copy(request, obj, project_ids, params):  # pylint: disable=arguments-differ
+  def can_move_or_copy(request, obj, project_ids, params, plan=None):  # pylint: disable=arguments-differ
     '''Check if user can move or copy object'''
-
-    # get new project
-    old_projects_ids = obj.projects.filter(
-      deleted_on__isnull=True
-    ).values_list('pk', flat=True)
-
-    new_projects = Project.objects.filter(
-      pk__in=project_ids,
-      deleted_on__isnull=True
-    ).exclude(pk__in=old_projects_ids)
-
-    user = request.user
-    # if adding project via 'new_project_id', add it to new_projects
-    if params.get('new_project_id'):
-      new_projects = new_projects.union(
-        Project.objects.filter(id=params['new_project_id'])
-      )
-
-    return BasePermission.has_auth_on_all_objs(['admin'], user, new_projects) \
-      and (
-        BasePermission.is_owner_or_admin(user, obj) \
-        or BasePermission.has_project_perms(['admin'], user, obj)
-      )
+    plan = plan or BasePermission.get_project_move_plan(request, obj, project_ids, params)
+    return plan.is_authorized
 
   @staticmethod
   def update_obj_perms(request, obj, data):  # pylint: disable=arguments-differ
@@ -193,7 +177,7 @@ class BasePermission(DRFBasePermission):
         raise APIException('You can\'t share with yourself.')
 
       try:
-        user = BpUser.objects.get(email=email, deleted_on__isnull=True)
+        user = BpUser.live.get(email=email)
       except BpUser.DoesNotExist:
         user = BpUser(email=email) # emails is not an user yet
 
@@ -210,38 +194,58 @@ class BasePermission(DRFBasePermission):
     '''Check if user (who is not an owner) has permission for any of a projects samples or analyses'''
 
     # therefore the user can still access the shared samples/analyses even though he does not have permission for the project itself
-    owner_samples = project.samples.filter(
-      deleted_on__isnull=True,
-      owner=user
-    ).values_list('pk', flat=True)
-
-    owner_analyses = project.analyses.filter(
-      deleted_on__isnull=True,
-      owner=user
-    ).values_list('pk', flat=True)
-
-    shared_analyses = get_objects_for_user(
-      user, perms, Analysis,
-      any_perm=True
-    ).values_list('pk', flat=True)
+    return project.visibility == 'public' \
+      or project.pk in BasePermission.get_sample_analysis_project_ids(perms, user)
 
-    shared_samples = get_objects_for_user(
-      user, perms, Sample,
-      any_perm=True
-    ).values_list('pk', flat=True)
+  @staticmethod
+  def get_sample_analysis_project_ids(perms, user):
+    '''Ids of projects holding samples or analyses the user owns or has perms on'''
+
+    # computed once per user object, i.e. once per request, so checking a page
+    # of projects costs one query per model instead of one union per project
+    cache_attr = f"_sample_analysis_project_ids_{'_'.join(sorted(perms))}"
+    project_ids = getattr(user, cache_attr, None)
+    if project_ids is None:
+      project_ids = set()
+      for model, related_name in ((Sample, 'samples'), (Analysis, 'analyses')):
+        shared_objs = get_objects_for_user(
+          user, perms, model,
+          any_perm=True
+        ).values('pk')
+
+        project_ids.update(Project.objects.filter(
+          Q(**{f'{related_name}__owner': user}) | Q(**{f'{related_name}__pk__in': shared_objs}),
+          **{f'{related_name}__deleted_on__isnull': True}
+        ).values_list('pk', flat=True).distinct())
+      setattr(user, cache_attr, project_ids)
+    return project_ids
 
-    combined_samples = owner_samples.union(shared_samples)
-    combined_analyses = owner_analyses.union(shared_analyses)
+  @staticmethod
+  def filter_sample_analysis_projects(perms, user, queryset):
+    '''Restrict a project queryset to public projects or projects with accessible samples/analyses'''
+    return queryset.filter(
+      Q(visibility='public')
+      | Q(pk__in=BasePermission.get_sample_analysis_project_ids(perms, user))
+    )
 
-    return project.visibility == 'public' \
-      or project.samples.filter(
-        pk__in=combined_samples,
-        deleted_on__isnull=True
-      ).exists() \
-      or project.analyses.filter(
-        pk__in=combined_analyses,
-        deleted_on__isnull=True
-      ).exists()
+  @staticmethod
+  def filter_accessible_projects(user, queryset):
+    '''Restrict a project list queryset to the projects `has_access(..., is_project=True)` allows'''
+    if user.is_superuser:
+      return queryset
+
+    perms = ['view', 'edit', 'admin']
+    shared_projects = get_objects_for_user(
+      user, perms, Project,
+      any_perm=True
+    ).values('pk')
+
+    return queryset.filter(
+      Q(owner=user)
+      | Q(pk__in=shared_projects)
+      | Q(visibility='public')
+      | Q(pk__in=BasePermission.get_sample_analysis_project_ids(perms, user))
+    )
 
   @staticmethod
   def is_owner(user, obj):
@@ -303,10 +307,9 @@ class BasePermission(DRFBasePermission):
         owner=user,
         deleted_on__isnull=True
       ).exists()
-      or Analysis.objects.filter(
+      or Analysis.live.filter(
         info__shared_with__has_key=str(req_user.id),
-        owner=user,
-        deleted_on__isnull=True
+        owner=user
       ).exists()
 
       # if req_user has shared data with user
@@ -320,10 +323,9 @@ class BasePermission(DRFBasePermission):
         owner=req_user,
         deleted_on__isnull=True
       ).exists()
-      or Analysis.objects.filter(
+      or Analysis.live.filter(
         info__shared_with__has_key=str(user.id),
-        owner=req_user,
-        deleted_on__isnull=True
+        owner=req_user
       ).exists()
 
       # if a different user has shared data with both user and req_user
@@ -339,9 +341,8 @@ class BasePermission(DRFBasePermission):
       ).filter(
         info__shared_with__has_key=str(user.id)
       ).exists()
-      or Analysis.objects.filter(
-        info__shared_with__has_key=str(req_user.id),
-        deleted_on__isnull=True
+      or Analysis.live.filter(
+        info__shared_with__has_key=str(req_user.id)
       ).filter(
         info__shared_with__has_key=str(user.id)
       ).exists()
@@ -395,3 +396,71 @@ class BasePermission(DRFBasePermission):
     except Host.DoesNotExist:
       host = Host.get_default_host()
     return host
+
+
+class ProjectMovePlan:
+  '''Project diff of an update request, computed once and shared by validation and apply'''
+
+  def __init__(self, user, obj, project_ids, params):
+    self.user = user
+    self.obj = obj
+    self.old_project_id = params.get('old_project_id')
+    self.new_project_id = params.get('new_project_id')
+
+    self.old_ids = set(obj.projects.filter(
+      deleted_on__isnull=True
+    ).values_list('pk', flat=True))
+
+    self.new_ids = set(Project.objects.filter(
+      pk__in=project_ids or [],
+      deleted_on__isnull=True
+    ).values_list('pk', flat=True))
+
+    # projects obj is being added to, including the one given via 'new_project_id'
+    self.added_ids = self.new_ids - self.old_ids
+    if self.new_project_id:
+      self.added_ids.add(int(self.new_project_id))
+    self.removed_ids = {int(self.old_project_id)} if self.old_project_id else set()
+
+    self._is_authorized = None
+
+  @property
+  def is_moving_or_copying(self):
+    '''Check if the request moves or copies obj'''
+    return bool(self.old_project_id or self.new_project_id or self.added_ids)
+
+  @property
+  def is_authorized(self):
+    '''Check if user is admin on every added project and owner/admin of obj'''
+    if self._is_authorized is None:
+      self._is_authorized = self._has_admin_on_added_projects() \
+        and (
+          BasePermission.is_owner_or_admin(self.user, self.obj) \
+          or BasePermission.has_project_perms(['admin'], self.user, self.obj)
+        )
+    return self._is_authorized
+
+  def apply(self):
+    '''Apply the 'old_project_id'/'new_project_id' move on obj'''
+    if self.removed_ids:
+      self.obj.projects.remove(*self.removed_ids)
+    if self.new_project_id:
+      self.obj.projects.add(self.new_project_id)
+
+  def _has_admin_on_added_projects(self):
+    '''Check in one query that user owns or has admin perm on all added projects'''
+    if not self.added_ids:
+      return True
+
+    shared_projects = get_objects_for_user(
+      self.user, ['admin'], Project
+    ).values('pk')
+
+    authorized_count = Project.objects.filter(
+      Q(owner=self.user) | Q(pk__in=shared_projects),
+      pk__in=self.added_ids
+    ).count()
+
+    existing_count = Project.objects.filter(pk__in=self.added_ids).count() \
+      if authorized_count < len(self.added_ids) else authorized_count
+    return authorized_count == existing_count
@@ -0,0 +1,60 @@
+'''Response compression'''
+
+# Lib imports
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+# App imports
+from bpapp.api3.resources.instrumentation import get_current_metrics
+
+DEFAULT_CONFIG = {
+  'enabled': True,
+  'excluded_content_types': ['text/event-stream'],
+  'min_size': 1024,  # bytes, smaller bodies are sent as-is
+}
+
+def get_config():
+  '''Compression config (settings.API_COMPRESSION)'''
+  return {**DEFAULT_CONFIG, **getattr(settings, 'API_COMPRESSION', {})}
+
+
+class CompressionMiddleware(GZipMiddleware):
+  '''gzip responses through Django's GZipMiddleware
+
+  Django adds random bytes to the gzip header of every response, its BREACH
+  mitigation, and compresses streaming responses (exports) chunk by chunk.
+  On top of it bodies under `min_size` are left alone, event streams are
+  never buffered and the uncompressed size is recorded: list it after
+  InstrumentationMiddleware.
+  '''
+
+  def __init__(self, get_response):
+    super().__init__(get_response)
+    self.config = get_config()
+
+  def process_response(self, request, response):
+    if not self.config['enabled'] or response.has_header('Content-Encoding'):
+      return response
+
+    content_type = response.get('Content-Type', '').split(';')[0].strip()
+    if content_type in self.config['excluded_content_types']:
+      return response
+
+    uncompressed_bytes = None if response.streaming else len(response.content)
+    if uncompressed_bytes is not None and uncompressed_bytes < self.config['min_size']:
+      # the response depends on Accept-Encoding as soon as it could be compressed
+      patch_vary_headers(response, ('Accept-Encoding',))
+      return response
+
+    response = super().process_response(request, response)
+    if uncompressed_bytes is not None and response.has_header('Content-Encoding'):
+      self._record(uncompressed_bytes)
+    return response
+
+  @staticmethod
+  def _record(uncompressed_bytes):
+    '''Report the uncompressed size to the request instrumentation'''
+    metrics = get_current_metrics()
+    if metrics is not None:
+      metrics.record_uncompressed_bytes(uncompressed_bytes)
@@ -0,0 +1,66 @@
+'''Conditional GET'''
+
+# Lib imports
+import hashlib
+import time
+
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+# App imports
+from bpapp.api3.resources.permission_cache import PermissionCache
+from bpapp.models import Analysis
+
+# signed file urls last 8hs, cached copies are revalidated at least every 4hs
+SIGNED_URL_REFRESH_INTERVAL = 4 * 60 * 60
+
+def get_analysis_validators(analysis_id, user, signed_urls=True):
+  '''ETag and Last-Modified of an analysis detail response, from a single aggregate query
+
+  With `signed_urls` the file urls of the response are re-signed every
+  SIGNED_URL_REFRESH_INTERVAL, so both validators move with the interval
+  (If-Modified-Since included) once the analysis has files.
+  '''
+  values = Analysis.objects.filter(pk=analysis_id).aggregate(
+    files_count=Count('files', distinct=True),
+    files_updated=Max('files__last_updated'),
+    last_updated=Max('last_updated'),
+    log_updated=Max('logs__last_updated'),
+  )
+  timestamps = [
+    values[key].timestamp() for key in ['last_updated', 'log_updated', 'files_updated'] if values[key]
+  ]
+  refresh_interval = int(time.time() // SIGNED_URL_REFRESH_INTERVAL) \
+    if signed_urls and values['files_count'] else None
+  if refresh_interval is not None:
+    timestamps.append(refresh_interval * SIGNED_URL_REFRESH_INTERVAL)
+  last_modified = max(timestamps) if timestamps else None
+
+  etag_source = ':'.join(str(part) for part in [
+    analysis_id,
+    user.pk,
+    *PermissionCache.get_versions(user.pk, Analysis._meta.label_lower, analysis_id),
+    *[values[key] and values[key].timestamp() for key in ['last_updated', 'log_updated', 'files_updated']],
+    values['files_count'],
+    refresh_interval,
+  ])
+  etag = quote_etag(hashlib.md5(etag_source.encode()).hexdigest())
+  return etag, last_modified
+
+def is_not_modified(request, etag, last_modified):
+  '''Check If-None-Match / If-Modified-Since against the validators'''
+  if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+  if if_none_match:
+    # weak comparison, compressed responses carry a weak ETag
+    etags = {tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(if_none_match)}
+    return '*' in etags or etag in etags
+
+  if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+  return bool(if_modified_since and last_modified and int(last_modified) <= if_modified_since)
+
+def set_validators(response, etag, last_modified):
+  '''Set ETag and Last-Modified headers'''
+  response['ETag'] = etag
+  if last_modified:
+    response['Last-Modified'] = http_date(last_modified)
+  return response
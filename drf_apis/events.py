@@ -0,0 +1,194 @@
+'''Analysis event stream'''
+
+# Lib imports
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models.signals import pre_save
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer
+
+try:
+  import redis
+except ImportError:  # redis is only needed for multi-worker setups
+  redis = None
+
+# App imports
+from bpapp.models import Analysis
+
+HEARTBEAT_INTERVAL = 15 # seconds
+# streams end after this, clients reconnect after the `retry` delay and the worker is freed
+MAX_STREAM_DURATION = 30 * 60 # seconds
+
+class InProcessSubscription:
+  '''Subscription to an in-process broker channel'''
+
+  def __init__(self, broker, channel, maxsize=1000):
+    self.broker = broker
+    self.channel = channel
+    self.queue = queue.Queue(maxsize=maxsize)
+
+  def get(self, timeout=None):
+    '''Next event, or None after timeout'''
+    try:
+      return self.queue.get(timeout=timeout)
+    except queue.Empty:
+      return None
+
+  def close(self):
+    '''Stop receiving events'''
+    self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+  '''Fan-out of events to subscribers of the same process'''
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._subscriptions = defaultdict(set)
+
+  def publish(self, channel, event):
+    '''Send event to every subscriber of channel'''
+    with self._lock:
+      subscriptions = list(self._subscriptions.get(channel, []))
+    for subscription in subscriptions:
+      try:
+        subscription.queue.put_nowait(event)
+      except queue.Full:
+        pass # slow consumer, it will resync through the REST endpoints
+
+  def subscribe(self, channel):
+    '''Subscribe to channel'''
+    subscription = InProcessSubscription(self, channel)
+    with self._lock:
+      self._subscriptions[channel].add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    '''Remove a subscription'''
+    with self._lock:
+      subscriptions = self._subscriptions.get(subscription.channel)
+      if subscriptions is not None:
+        subscriptions.discard(subscription)
+        if not subscriptions:
+          del self._subscriptions[subscription.channel]
+
+
+class RedisSubscription:
+  '''Subscription to a redis pub/sub channel'''
+
+  def __init__(self, pubsub):
+    self.pubsub = pubsub
+
+  def get(self, timeout=None):
+    '''Next event, or None after timeout'''
+    message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+    return json.loads(message['data']) if message else None
+
+  def close(self):
+    '''Stop receiving events'''
+    self.pubsub.close()
+
+
+class RedisBroker:
+  '''Fan-out of events across workers through redis pub/sub'''
+
+  def __init__(self, url=None):
+    if redis is None:
+      raise ImportError('RedisBroker requires the `redis` package.')
+    self.client = redis.Redis.from_url(url or getattr(settings, 'ANALYSIS_EVENT_REDIS_URL', 'redis://localhost:6379/0'))
+
+  def publish(self, channel, event):
+    '''Send event to every subscriber of channel'''
+    self.client.publish(channel, json.dumps(event, cls=DjangoJSONEncoder))
+
+  def subscribe(self, channel):
+    '''Subscribe to channel'''
+    pubsub = self.client.pubsub()
+    pubsub.subscribe(channel)
+    return RedisSubscription(pubsub)
+
+
+_BROKER = None
+_BROKER_LOCK = threading.Lock()
+
+def get_broker():
+  '''Configured broker (settings.ANALYSIS_EVENT_BROKER), in-process by default'''
+  global _BROKER # pylint: disable=global-statement
+  if _BROKER is None:
+    with _BROKER_LOCK:
+      if _BROKER is None:
+        broker_path = getattr(settings, 'ANALYSIS_EVENT_BROKER', None)
+        _BROKER = import_string(broker_path)() if broker_path else InProcessBroker()
+  return _BROKER
+
+def get_user_channel(user_id):
+  '''Channel of a user's events'''
+  return f'analysis-events:user:{user_id}'
+
+def publish_analysis_event(owner_id, event_type, data):
+  '''Publish an analysis event to its owner once the transaction commits'''
+  if not owner_id:
+    return
+  event = {'type': event_type, 'data': data}
+  transaction.on_commit(lambda: get_broker().publish(get_user_channel(owner_id), event))
+
+def _close_db_connections():
+  '''Close the db connections of the thread, outside of transactions'''
+  for connection in connections.all():
+    if not connection.in_atomic_block:
+      connection.close()
+
+def stream_user_events(user, heartbeat_interval=HEARTBEAT_INTERVAL, max_duration=MAX_STREAM_DURATION):
+  '''Server-sent events of a user, with heartbeats so proxies keep the connection open
+
+  The stream makes no queries: the db connections are closed before it
+  blocks, so an open stream doesn't hold one, and it ends after max_duration.
+  '''
+  user_id = user.pk
+  _close_db_connections()
+  subscription = get_broker().subscribe(get_user_channel(user_id))
+  deadline = time.monotonic() + max_duration
+  try:
+    yield 'retry: 5000\n\n'
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return
+      event = subscription.get(timeout=min(heartbeat_interval, remaining))
+      if event is None:
+        yield ': heartbeat\n\n'
+        continue
+      yield f"event: {event['type']}\ndata: {json.dumps(event['data'], cls=DjangoJSONEncoder)}\n\n"
+  finally:
+    subscription.close()
+
+
+class EventStreamRenderer(BaseRenderer):
+  '''Renderer for `text/event-stream` content negotiation'''
+  format = 'sse'
+  media_type = 'text/event-stream'
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    '''Errors are sent as a single event'''
+    return f'event: error\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'.encode()
+
+# hooks
+def hook_publish_status_event(sender, instance, **kwargs): # pylint: disable=unused-argument
+  '''Hook to publish analysis status changes, alongside hook_send_notification'''
+  if instance.pk and instance.tracker.has_changed('status'):
+    publish_analysis_event(instance.owner_id, 'status', {
+      'completed_on': instance.completed_on,
+      'id': instance.pk,
+      'previous_status': instance.tracker.previous('status'),
+      'started_on': instance.started_on,
+      'status': instance.status,
+    })
+
+pre_save.connect(hook_publish_status_event, sender=Analysis)
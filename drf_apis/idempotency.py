@@ -0,0 +1,66 @@
+'''Request idempotency and deduplication'''
+
+# Lib imports
+import contextlib
+import functools
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_TIMEOUT = 24 * 60 * 60
+# in-flight locks expire after this, should their request die before releasing them
+DEDUPE_WINDOW = 60
+
+def idempotent(view_method):
+  '''Replay the stored response of a request sent again with the same Idempotency-Key header
+
+  Only successful responses are stored: a retry after an error (a conflict
+  with an in-flight request, a failed permission check) runs the view again.
+  '''
+  @functools.wraps(view_method)
+  def wrapper(self, request, *args, **kwargs):
+    idempotency_key = request.META.get(IDEMPOTENCY_HEADER)
+    if not idempotency_key:
+      return view_method(self, request, *args, **kwargs)
+
+    cache_key = f'idempotency:{view_method.__name__}:{request.user.pk}:{idempotency_key}'
+    stored = cache.get(cache_key)
+    if stored is not None:
+      return Response(stored['data'], status=stored['status'])
+
+    response = view_method(self, request, *args, **kwargs)
+    if status.is_success(response.status_code):
+      cache.set(cache_key, {'data': response.data, 'status': response.status_code}, timeout=IDEMPOTENCY_TIMEOUT)
+    return response
+  return wrapper
+
+def _get_analysis_lock_key(action_name, analysis_id):
+  '''Cache key of a per-analysis in-flight lock'''
+  return f'analysis-inflight:{action_name}:{analysis_id}'
+
+def acquire_analysis_lock(action_name, analysis_id, timeout=DEDUPE_WINDOW):
+  '''Take the per-analysis in-flight lock of an action, False if already taken'''
+  return cache.add(_get_analysis_lock_key(action_name, analysis_id), True, timeout=timeout)
+
+def release_analysis_lock(action_name, analysis_id):
+  '''Release the per-analysis in-flight lock of an action'''
+  cache.delete(_get_analysis_lock_key(action_name, analysis_id))
+
+@contextlib.contextmanager
+def hold_analysis_locks(action_name, analysis_ids):
+  '''Hold taken in-flight locks for a block
+
+  They are released at once when the block raises, else once the request's
+  transaction commits, so duplicates only collapse while the first request
+  is in flight.
+  '''
+  keys = [_get_analysis_lock_key(action_name, analysis_id) for analysis_id in analysis_ids]
+  try:
+    yield
+  except BaseException:
+    cache.delete_many(keys)
+    raise
+  transaction.on_commit(lambda: cache.delete_many(keys))
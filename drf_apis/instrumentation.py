@@ -0,0 +1,312 @@
+'''Per-request instrumentation'''
+
+# Lib imports
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.utils import encoders
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+  'enabled': False,
+  'field_sample_rate': 0.0,  # share of responses whose bytes per top-level field are measured
+  'n_plus_one_threshold': 10,
+  'sinks': ['bpapp.api3.resources.instrumentation.LogSink'],
+}
+
+# response size histogram buckets (bytes)
+RESPONSE_BYTES_BUCKETS = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024]
+
+# endpoint label of requests that resolved to no view (404s), keeps the label set bounded
+UNRESOLVED_ENDPOINT = 'unresolved'
+
+_CURRENT = contextvars.ContextVar('drf_apis_request_metrics', default=None)
+
+def get_config():
+  '''Instrumentation config (settings.API_INSTRUMENTATION)'''
+  return {**DEFAULT_CONFIG, **getattr(settings, 'API_INSTRUMENTATION', {})}
+
+def get_current_metrics():
+  '''Metrics of the request being handled, None when instrumentation is disabled'''
+  return _CURRENT.get()
+
+
+class RequestMetrics:
+  '''Metrics collected while handling one request'''
+
+  def __init__(self, method, path):
+    self.action = method.lower()
+    self.endpoint = UNRESOLVED_ENDPOINT
+    self.field_bytes = {}
+    self.method_fields = defaultdict(lambda: [0, 0.0])
+    self.n_plus_one = []
+    self.outbound = defaultdict(lambda: [0, 0.0])
+    # outbound calls may be recorded from worker threads, see bulk_terminate
+    self.outbound_lock = threading.Lock()
+    self.path = path
+    self.response_bytes = None
+    self.sql_count = 0
+    self.sql_templates = Counter()
+    self.sql_time = 0.0
+    self.started = time.perf_counter()
+    self.status_code = None
+    self.uncompressed_bytes = None
+    self.wall_time = None
+
+  def record_sql(self, sql, duration):
+    '''Record one executed query'''
+    self.sql_count += 1
+    self.sql_time += duration
+    self.sql_templates[sql] += 1
+
+  def record_outbound(self, service, duration):
+    '''Record one S3/SQS/SWF call'''
+    with self.outbound_lock:
+      self.outbound[service][0] += 1
+      self.outbound[service][1] += duration
+
+  def record_method_field(self, name, duration):
+    '''Record one SerializerMethodField call'''
+    self.method_fields[name][0] += 1
+    self.method_fields[name][1] += duration
+
+  def record_uncompressed_bytes(self, size):
+    '''Record the body size before compression, the sent size is read at finish'''
+    self.uncompressed_bytes = size
+
+  def record_field_bytes(self, data):
+    '''Record the serialized size of each top-level field, summed over list items'''
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+      data = data['results']
+    items = data if isinstance(data, list) else [data]
+    field_bytes = Counter()
+    for item in items:
+      if isinstance(item, dict):
+        for field, value in item.items():
+          field_bytes[field] += len(json.dumps(value, cls=encoders.JSONEncoder))
+    self.field_bytes = dict(field_bytes)
+
+  def finish(self, response, n_plus_one_threshold):
+    '''Close the measurement'''
+    self.wall_time = time.perf_counter() - self.started
+    self.status_code = response.status_code
+    if not getattr(response, 'streaming', False):
+      self.response_bytes = len(response.content)
+      if self.uncompressed_bytes is None:
+        self.uncompressed_bytes = self.response_bytes
+    self.n_plus_one = [
+      {'count': count, 'sql': sql[:300]}
+      for sql, count in self.sql_templates.most_common() if count > n_plus_one_threshold
+    ]
+
+  def as_dict(self):
+    '''Serializable summary'''
+    return {
+      'action': self.action,
+      'endpoint': self.endpoint,
+      'field_bytes': self.field_bytes,
+      'method_fields': {name: {'count': count, 'time': total} for name, (count, total) in self.method_fields.items()},
+      'n_plus_one': self.n_plus_one,
+      'outbound': {service: {'count': count, 'time': total} for service, (count, total) in self.outbound.items()},
+      'path': self.path,
+      'response_bytes': self.response_bytes,
+      'sql_count': self.sql_count,
+      'sql_time': self.sql_time,
+      'status_code': self.status_code,
+      'uncompressed_bytes': self.uncompressed_bytes,
+      'wall_time': self.wall_time,
+    }
+
+
+class InstrumentationMiddleware:
+  '''Record wall time, SQL, outbound calls and serializer method field time per endpoint and action'''
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    config = get_config()
+    self.enabled = config['enabled']
+    self.field_sample_rate = config['field_sample_rate']
+    self.n_plus_one_threshold = config['n_plus_one_threshold']
+    self.sinks = [import_string(sink)() for sink in config['sinks']] if self.enabled else []
+
+  def __call__(self, request):
+    if not self.enabled:
+      return self.get_response(request)
+
+    metrics = RequestMetrics(request.method, request.path)
+    token = _CURRENT.set(metrics)
+    try:
+      with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+          stack.enter_context(connection.execute_wrapper(self._sql_wrapper(metrics)))
+        response = self.get_response(request)
+    finally:
+      _CURRENT.reset(token)
+
+    metrics.finish(response, self.n_plus_one_threshold)
+    if self.field_sample_rate and random.random() < self.field_sample_rate:
+      data = getattr(response, 'data', None)
+      if data is not None:
+        metrics.record_field_bytes(data)
+    for sink in self.sinks:
+      try:
+        sink.emit(metrics)
+      except Exception as error: # pylint: disable=broad-except
+        LOG.error(f'instrumentation: sink {type(sink).__name__} failed - {error}')
+    return response
+
+  def process_view(self, request, view_func, view_args, view_kwargs):  # pylint: disable=unused-argument
+    '''Name the endpoint and action after the view'''
+    metrics = _CURRENT.get()
+    if metrics is not None:
+      view_class = getattr(view_func, 'cls', None)
+      actions = getattr(view_func, 'actions', None) or {}
+      metrics.endpoint = view_class.__name__ if view_class else view_func.__name__
+      metrics.action = actions.get(request.method.lower(), request.method.lower())
+
+  @staticmethod
+  def _sql_wrapper(metrics):
+    '''Execute wrapper timing each query'''
+    def wrapper(execute, sql, params, many, context):
+      start = time.perf_counter()
+      try:
+        return execute(sql, params, many, context)
+      finally:
+        metrics.record_sql(sql, time.perf_counter() - start)
+    return wrapper
+
+
+@contextlib.contextmanager
+def record_outbound(service):
+  '''Time an outbound call'''
+  metrics = _CURRENT.get()
+  if metrics is None:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    metrics.record_outbound(service, time.perf_counter() - start)
+
+
+class _InstrumentedClient:
+  '''Proxy timing the method calls of an S3/SQS/SWF client'''
+
+  def __init__(self, client, service):
+    self._client = client
+    self._service = service
+
+  def __getattr__(self, name):
+    attribute = getattr(self._client, name)
+    if not callable(attribute):
+      return attribute
+
+    def _call(*args, **kwargs):
+      with record_outbound(self._service):
+        return attribute(*args, **kwargs)
+    return _call
+
+def instrument_client(client, service):
+  '''Wrap an outbound client so its calls are recorded, a no-op when disabled'''
+  if _CURRENT.get() is None:
+    return client
+  return _InstrumentedClient(client, service)
+
+
+class InstrumentedMethodField(serializers.SerializerMethodField):
+  '''SerializerMethodField recording the time spent in its method'''
+
+  def to_representation(self, value):
+    metrics = _CURRENT.get()
+    if metrics is None:
+      return super().to_representation(value)
+    start = time.perf_counter()
+    try:
+      return super().to_representation(value)
+    finally:
+      metrics.record_method_field(f'{type(self.parent).__name__}.{self.method_name}', time.perf_counter() - start)
+
+
+class LogSink:
+  '''Emit one log line per request'''
+
+  def emit(self, metrics):  # pylint: disable=no-self-use
+    '''Log the request metrics'''
+    level = logging.WARNING if metrics.n_plus_one else logging.INFO
+    LOG.log(level, f'instrumentation: {json.dumps(metrics.as_dict())}')
+
+
+class PrometheusSink:
+  '''Aggregate metrics in-process, exposed in prometheus text format by `metrics_view`'''
+
+  _lock = threading.Lock()
+  _counters = defaultdict(float)
+
+  def emit(self, metrics):
+    '''Add the request metrics to the aggregates'''
+    labels = f'endpoint="{self._escape(metrics.endpoint)}",action="{self._escape(metrics.action)}"'
+    with self._lock:
+      self._incr('drf_api_requests_total', labels, 1)
+      self._incr('drf_api_request_seconds_sum', labels, metrics.wall_time)
+      self._incr('drf_api_sql_queries_total', labels, metrics.sql_count)
+      self._incr('drf_api_sql_seconds_sum', labels, metrics.sql_time)
+      self._incr('drf_api_n_plus_one_total', labels, len(metrics.n_plus_one))
+      for service, (count, total) in metrics.outbound.items():
+        service_labels = f'{labels},service="{self._escape(service)}"'
+        self._incr('drf_api_outbound_calls_total', service_labels, count)
+        self._incr('drf_api_outbound_seconds_sum', service_labels, total)
+      for name, (count, total) in metrics.method_fields.items():
+        field_labels = f'{labels},field="{self._escape(name)}"'
+        self._incr('drf_api_method_field_calls_total', field_labels, count)
+        self._incr('drf_api_method_field_seconds_sum', field_labels, total)
+      if metrics.response_bytes is not None:
+        self._observe_response_bytes(labels, metrics)
+      for field, size in metrics.field_bytes.items():
+        field_labels = f'{labels},field="{self._escape(field)}"'
+        self._incr('drf_api_response_field_bytes_sum', field_labels, size)
+        self._incr('drf_api_response_field_samples_total', field_labels, 1)
+
+  @staticmethod
+  def _escape(value):
+    '''Label value escaped for the text format: backslash, double quote and newline'''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+  @classmethod
+  def _observe_response_bytes(cls, labels, metrics):
+    '''Add the response size to the per-endpoint histogram'''
+    for bucket in RESPONSE_BYTES_BUCKETS:
+      if metrics.uncompressed_bytes <= bucket:
+        cls._incr('drf_api_response_bytes_bucket', f'{labels},le="{bucket}"', 1)
+    cls._incr('drf_api_response_bytes_bucket', f'{labels},le="+Inf"', 1)
+    cls._incr('drf_api_response_bytes_count', labels, 1)
+    cls._incr('drf_api_response_bytes_sum', labels, metrics.uncompressed_bytes)
+    cls._incr('drf_api_response_sent_bytes_sum', labels, metrics.response_bytes)
+
+  @classmethod
+  def _incr(cls, name, labels, value):
+    '''Increment a labelled counter'''
+    cls._counters[(name, labels)] += value
+
+  @classmethod
+  def render(cls):
+    '''Prometheus text exposition'''
+    with cls._lock:
+      lines = [f'{name}{{{labels}}} {value}' for (name, labels), value in sorted(cls._counters.items())]
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):  # pylint: disable=unused-argument
+  '''Prometheus scrape endpoint'''
+  return HttpResponse(PrometheusSink.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,48 @@
+'''Analysis.search_text and its trigram index'''
+
+# Lib imports
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+def backfill_search_text(apps, schema_editor, chunk_size=1000): # pylint: disable=unused-argument
+  '''Build search_text of the existing analyses, as `Analysis.get_search_text` does'''
+  Analysis = apps.get_model('bpapp', 'Analysis') # pylint: disable=invalid-name
+  ids = list(Analysis.objects.order_by('pk').values_list('pk', flat=True))
+  for start in range(0, len(ids), chunk_size):
+    analyses = list(Analysis.objects.filter(
+      pk__in=ids[start:start + chunk_size]
+    ).select_related('owner', 'workflow').prefetch_related('samples', 'controls'))
+    for analysis in analyses:
+      names = [
+        str(analysis.id),
+        analysis.name,
+        getattr(analysis.owner, 'username', ''),
+        getattr(analysis.workflow, 'name', ''),
+        *[sample.name for sample in analysis.samples.all()],
+        *[control.name for control in analysis.controls.all()],
+      ]
+      analysis.search_text = ' '.join(name for name in names if name).lower()
+    Analysis.objects.bulk_update(analyses, ['search_text'])
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('bpapp', '0001_initial'),
+  ]
+
+  operations = [
+    TrigramExtension(),
+    migrations.AddField(
+      model_name='analysis',
+      name='search_text',
+      field=models.TextField(blank=True, default=''),
+    ),
+    migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+    migrations.AddIndex(
+      model_name='analysis',
+      index=GinIndex(fields=['search_text'], name='analysis_search_trgm_idx', opclasses=['gin_trgm_ops']),
+    ),
+  ]
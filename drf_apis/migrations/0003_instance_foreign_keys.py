@@ -0,0 +1,72 @@
+'''Instance analysis/owner foreign keys, from the legacy char ids'''
+
+# Lib imports
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def normalize_instance_legacy_ids(apps, schema_editor): # pylint: disable=unused-argument
+  '''Set blank or non-numeric legacy ids to NULL so the integer cast of the columns succeeds
+
+  Dangling ids are kept, the foreign keys have no db constraint.
+  '''
+  Instance = apps.get_model('bpapp', 'Instance') # pylint: disable=invalid-name
+  for field in ['analysis_id', 'owner_id']:
+    Instance.objects.exclude(**{f'{field}__isnull': True}).exclude(
+      **{f'{field}__regex': r'^\s*[0-9]+\s*$'}
+    ).update(**{field: None})
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ('bpapp', '0002_analysis_search_text'),
+  ]
+
+  operations = [
+    # nullable char columns first, legacy ids that are not integers become NULL
+    migrations.AlterField(
+      model_name='instance',
+      name='analysis_id',
+      field=models.CharField(blank=True, max_length=20, null=True),
+    ),
+    migrations.AlterField(
+      model_name='instance',
+      name='owner_id',
+      field=models.CharField(blank=True, max_length=20, null=True),
+    ),
+    migrations.RunPython(normalize_instance_legacy_ids, migrations.RunPython.noop),
+    # `analysis_id` -> `analysis` foreign key, the column keeps its analysis_id name
+    migrations.RenameField(model_name='instance', old_name='analysis_id', new_name='analysis'),
+    migrations.AlterField(
+      model_name='instance',
+      name='analysis',
+      field=models.ForeignKey(
+        blank=True,
+        db_constraint=False,
+        null=True,
+        on_delete=django.db.models.deletion.DO_NOTHING,
+        related_name='instances',
+        to='bpapp.analysis',
+      ),
+    ),
+    migrations.RenameField(model_name='instance', old_name='owner_id', new_name='owner'),
+    migrations.AlterField(
+      model_name='instance',
+      name='owner',
+      field=models.ForeignKey(
+        blank=True,
+        db_constraint=False,
+        null=True,
+        on_delete=django.db.models.deletion.DO_NOTHING,
+        related_name='instances',
+        to=settings.AUTH_USER_MODEL,
+      ),
+    ),
+    migrations.AddIndex(
+      model_name='instance',
+      index=models.Index(fields=['requested_on', 'instance_type', 'lifecycle'], name='instance_report_idx'),
+    ),
+  ]
@@ -0,0 +1,37 @@
+'''Analysis.archived_on and the AnalysisArchive table'''
+
+# Lib imports
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('bpapp', '0003_instance_foreign_keys'),
+  ]
+
+  operations = [
+    # nullable, no default: adding it doesn't rewrite the analysis table
+    migrations.AddField(
+      model_name='analysis',
+      name='archived_on',
+      field=models.DateTimeField(blank=True, null=True),
+    ),
+    migrations.CreateModel(
+      name='AnalysisArchive',
+      fields=[
+        ('analysis', models.OneToOneField(
+          db_constraint=False,
+          on_delete=django.db.models.deletion.DO_NOTHING,
+          primary_key=True,
+          related_name='archive',
+          serialize=False,
+          to='bpapp.analysis',
+        )),
+        ('archived_on', models.DateTimeField(auto_now_add=True)),
+        ('data', models.BinaryField()),
+        ('size', models.BigIntegerField(default=0)),
+      ],
+    ),
+  ]
@@ -0,0 +1,48 @@
+'''Analysis.index_genome_id, its backfill and partial index'''
+
+# Lib imports
+from django.db import migrations, models
+from django.db.models import Max, Min, Q
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+
+
+def backfill_index_genome_ids(apps, schema_editor, chunk_size=10000): # pylint: disable=unused-argument
+  '''Set index_genome_id from params, as `Analysis.backfill_index_genome_ids` does'''
+  Analysis = apps.get_model('bpapp', 'Analysis') # pylint: disable=invalid-name
+  index_genome_id = KeyTextTransform(
+    'index_genome_id', KeyTransform('index_genome', KeyTransform('node', 'params'))
+  )
+  queryset = Analysis.objects.filter(
+    index_genome_id__isnull=True,
+    params__node__index_genome__has_key='index_genome_id',
+  )
+  bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+  if bounds['first'] is None:
+    return
+  for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+    queryset.filter(pk__gte=start, pk__lt=start + chunk_size).update(index_genome_id=index_genome_id)
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('bpapp', '0004_analysis_archive'),
+  ]
+
+  operations = [
+    migrations.AddField(
+      model_name='analysis',
+      name='index_genome_id',
+      field=models.CharField(blank=True, max_length=40, null=True),
+    ),
+    # backfill before the index is built, the updates don't have to maintain it
+    migrations.RunPython(backfill_index_genome_ids, migrations.RunPython.noop),
+    migrations.AddIndex(
+      model_name='analysis',
+      index=models.Index(
+        condition=Q(index_genome_id__isnull=False),
+        fields=['index_genome_id', 'owner'],
+        name='analysis_index_genome_idx',
+      ),
+    ),
+  ]
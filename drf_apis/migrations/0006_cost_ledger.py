@@ -0,0 +1,99 @@
+'''CostLedgerEntry and CostRollup tables'''
+
+# Lib imports
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ('bpapp', '0005_analysis_index_genome_id'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='CostLedgerEntry',
+      fields=[
+        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('accrued_on', models.DateTimeField()),
+        ('amount', models.DecimalField(decimal_places=5, default=Decimal(0), max_digits=20)),
+        ('billing_account_id', models.IntegerField(blank=True, null=True)),
+        ('date_created', models.DateTimeField(auto_now_add=True)),
+        ('kind', models.CharField(max_length=20)),
+        ('rate', models.DecimalField(blank=True, decimal_places=5, max_digits=20, null=True)),
+        ('seconds', models.FloatField(default=0)),
+        ('analysis', models.ForeignKey(
+          db_constraint=False,
+          null=True,
+          on_delete=django.db.models.deletion.DO_NOTHING,
+          related_name='cost_entries',
+          to='bpapp.analysis',
+        )),
+        ('host', models.ForeignKey(
+          db_constraint=False,
+          null=True,
+          on_delete=django.db.models.deletion.DO_NOTHING,
+          related_name='+',
+          to='bpapp.host',
+        )),
+        ('instance', models.ForeignKey(
+          db_constraint=False,
+          null=True,
+          on_delete=django.db.models.deletion.DO_NOTHING,
+          related_name='cost_entries',
+          to='bpapp.instance',
+        )),
+        ('owner', models.ForeignKey(
+          db_constraint=False,
+          null=True,
+          on_delete=django.db.models.deletion.DO_NOTHING,
+          related_name='+',
+          to=settings.AUTH_USER_MODEL,
+        )),
+      ],
+      options={
+        'constraints': [
+          models.UniqueConstraint(
+            condition=Q(kind='compute'),
+            fields=('instance',),
+            name='cost_ledger_compute_instance_uniq',
+          ),
+          models.UniqueConstraint(
+            condition=Q(kind='runtime'),
+            fields=('analysis',),
+            name='cost_ledger_runtime_analysis_uniq',
+          ),
+        ],
+        'indexes': [
+          models.Index(fields=['accrued_on'], name='cost_ledger_accrued_idx'),
+        ],
+      },
+    ),
+    migrations.CreateModel(
+      name='CostRollup',
+      fields=[
+        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('amount', models.DecimalField(decimal_places=5, default=Decimal(0), max_digits=20)),
+        ('entries', models.IntegerField(default=0)),
+        ('kind', models.CharField(max_length=20)),
+        ('period_start', models.DateField()),
+        ('scope', models.CharField(max_length=20)),
+        ('scope_id', models.IntegerField()),
+        ('seconds', models.FloatField(default=0)),
+      ],
+      options={
+        'constraints': [
+          models.UniqueConstraint(
+            fields=('scope', 'scope_id', 'period_start', 'kind'),
+            name='cost_rollup_key_uniq',
+          ),
+        ],
+      },
+    ),
+  ]
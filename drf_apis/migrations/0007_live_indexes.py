@@ -0,0 +1,43 @@
+'''Partial indexes on live (not deleted) analyses, instances and users'''
+
+# Lib imports
+from django.db import migrations, models
+from django.db.models import Q
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('bpapp', '0006_cost_ledger'),
+  ]
+
+  operations = [
+    migrations.AddIndex(
+      model_name='analysis',
+      index=models.Index(
+        condition=Q(archived_on__isnull=True, deleted_on__isnull=True),
+        fields=['host', '-date_created', '-id'],
+        name='analysis_live_host_idx',
+      ),
+    ),
+    migrations.AddIndex(
+      model_name='analysis',
+      index=models.Index(
+        condition=Q(archived_on__isnull=True, deleted_on__isnull=True),
+        fields=['status', '-date_created', '-id'],
+        name='analysis_live_status_idx',
+      ),
+    ),
+    migrations.AddIndex(
+      model_name='instance',
+      index=models.Index(
+        condition=Q(deleted_on__isnull=True),
+        fields=['owner', '-date_created', '-id'],
+        name='instance_live_owner_idx',
+      ),
+    ),
+    migrations.AddIndex(
+      model_name='bpuser',
+      index=models.Index(condition=Q(deleted_on__isnull=True), fields=['email'], name='user_live_email_idx'),
+    ),
+  ]
@@ -0,0 +1,39 @@
+'''Partial composite indexes of the analysis keyset orderings'''
+
+# Lib imports
+from django.db import migrations, models
+from django.db.models import Q
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('bpapp', '0007_live_indexes'),
+  ]
+
+  operations = [
+    migrations.AddIndex(
+      model_name='analysis',
+      index=models.Index(
+        condition=Q(archived_on__isnull=True, deleted_on__isnull=True),
+        fields=['-date_created', '-id'],
+        name='analysis_live_created_idx',
+      ),
+    ),
+    migrations.AddIndex(
+      model_name='analysis',
+      index=models.Index(
+        condition=Q(archived_on__isnull=True, deleted_on__isnull=True),
+        fields=['-last_updated', '-id'],
+        name='analysis_live_updated_idx',
+      ),
+    ),
+    migrations.AddIndex(
+      model_name='analysis',
+      index=models.Index(
+        condition=Q(archived_on__isnull=True, deleted_on__isnull=True),
+        fields=['owner', '-date_created', '-id'],
+        name='analysis_live_owner_idx',
+      ),
+    ),
+  ]
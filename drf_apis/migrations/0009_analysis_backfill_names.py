@@ -0,0 +1,33 @@
+'''Default names of unnamed analyses'''
+
+# Lib imports
+from django.db import migrations, models
+from django.db.models import Case, Exists, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Concat
+
+
+def backfill_names(apps, schema_editor): # pylint: disable=unused-argument
+  '''Name unnamed analyses with a single UPDATE, as `Analysis.backfill_names` does'''
+  Analysis = apps.get_model('bpapp', 'Analysis') # pylint: disable=invalid-name
+  Sample = apps.get_model('bpapp', 'Sample') # pylint: disable=invalid-name
+  Workflow = apps.get_model('bpapp', 'Workflow') # pylint: disable=invalid-name
+  live_samples = Sample.objects.filter(analyses=OuterRef('pk'), deleted_on__isnull=True)
+  workflow_name = Subquery(Workflow.objects.filter(pk=OuterRef('workflow_id')).values('name')[:1])
+  sample_name = Subquery(live_samples.order_by('pk').values('name')[:1])
+
+  Analysis.objects.filter(Q(name='') | Q(name__isnull=True)).update(name=Case(
+    When(Exists(live_samples), then=Concat(workflow_name, Value(' on '), sample_name)),
+    default=workflow_name,
+    output_field=models.CharField(),
+  ))
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('bpapp', '0008_analysis_keyset_indexes'),
+  ]
+
+  operations = [
+    migrations.RunPython(backfill_names, migrations.RunPython.noop),
+  ]
@@ -9,6 +9,36 @@ class BaseModel(models.Model):
     _sanitize_fields(obj=self)
     super().save(*args, **kwargs)
 
+class SoftDeleteQuerySet(models.QuerySet):
+  '''QuerySet of a model soft deleted through `deleted_on`'''
+
+  def deleted(self):
+    '''Soft deleted rows'''
+    return self.filter(deleted_on__isnull=False)
+
+  def live(self):
+    '''Rows that are not soft deleted'''
+    return self.filter(deleted_on__isnull=True)
+
+  def soft_delete(self):
+    '''Soft delete every row of the queryset'''
+    return self.live().update(deleted_on=datetime.now(pytz.utc))
+
+
+class LiveManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+  '''Manager of the rows that are not soft deleted, served by the `*_live_*` partial indexes
+
+  Kept next to the default manager so related lookups and admin still see every row.
+  '''
+
+  def get_queryset(self):
+    return super().get_queryset().live()
+
+
+class BpUserManager(UserManager.from_queryset(SoftDeleteQuerySet)):
+  '''User manager with the soft delete queryset methods'''
+
+
 class AbstractUserBaseModel(AbstractUser):
   '''AbstractUser BaseModel class'''
 
@@ -65,8 +95,17 @@ class BpUser(AbstractUserBaseModel):
     related_name='+',
   )
 
+  objects = BpUserManager()
+  live = LiveManager()
+
   REQUIRED_FIELDS = ['email']
 
+  class Meta(AbstractUserBaseModel.Meta):
+    '''Meta class'''
+    indexes = [
+      models.Index(condition=Q(deleted_on__isnull=True), fields=['email'], name='user_live_email_idx'),
+    ]
+
   def __str__(self):
     '''To string method'''
     return f'{self.id}:{self.name}'
@@ -132,17 +171,30 @@ class BpUser(AbstractUserBaseModel):
 # hooks
 post_save.connect(create_api_key, sender=BpUser)
 
+# analyses served by the hot list indexes
+HOT_ANALYSES = Q(archived_on__isnull=True, deleted_on__isnull=True)
+
+# analysis ids waiting for a search_text refresh, see `Analysis.schedule_search_text_refresh`
+_search_text_pending = threading.local()
+
 class Analysis(BaseModel):
   '''Analysis Model class'''
+  # statuses an analysis goes through, from queueing to its end, started and running may have a suffix
+  STATUSES = ['abort', 'completed', 'error', 'failed', 'running', 'started', 'waiting-in-queue']
+
   tracker = FieldTracker()
 
   app_data = models.JSONField(null=True, blank=True)
   filesize = models.BigIntegerField(default=0)
   host = models.ForeignKey(Host, blank=True, null=True, on_delete=models.DO_NOTHING)
+  # params.node.index_genome.index_genome_id, maintained by hook_set_index_genome_id
+  index_genome_id = models.CharField(blank=True, max_length=40, null=True)
   info = models.JSONField(null=True, blank=True)
   meta = models.JSONField(null=True, blank=True)
   name = models.CharField(max_length=500)
   params = models.JSONField(null=True, blank=True)
+  # lowercased analysis, owner, workflow, sample and control names, see `refresh_search_text`
+  search_text = models.TextField(blank=True, default='')
   status = models.CharField(max_length=100, null=True, blank=True)
   swf_run_id = models.CharField(blank=True, max_length=100, null=True)
   swf_workflow_id = models.CharField(blank=True, max_length=100, null=True)
@@ -151,6 +203,8 @@ class Analysis(BaseModel):
   workflow_data = models.JSONField(null=True, blank=True)
 
   # date on
+  # set while the json columns, logs and files are in AnalysisArchive
+  archived_on = models.DateTimeField(null=True, blank=True)
   completed_on = models.DateTimeField(null=True, blank=True)
   date_created = models.DateTimeField(auto_now_add=True) # TODO: rename to created_on pylint: disable=fixme
   deleted_on = models.DateTimeField(db_index=True, null=True, blank=True)
@@ -168,8 +222,48 @@ class Analysis(BaseModel):
   users = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='analyses')
   workflow = models.ForeignKey(Workflow, on_delete=models.DO_NOTHING, related_name='analyses')
 
+  objects = SoftDeleteQuerySet.as_manager()
+  live = LiveManager()
+
   class Meta:
     '''Meta class'''
+    # hot list paths only cover live, non archived analyses, see HOT_ANALYSES
+    indexes = [
+      # keyset pagination and ordering on live analyses
+      models.Index(
+        condition=HOT_ANALYSES,
+        fields=['-date_created', '-id'],
+        name='analysis_live_created_idx',
+      ),
+      models.Index(
+        condition=HOT_ANALYSES,
+        fields=['-last_updated', '-id'],
+        name='analysis_live_updated_idx',
+      ),
+      models.Index(
+        condition=HOT_ANALYSES,
+        fields=['owner', '-date_created', '-id'],
+        name='analysis_live_owner_idx',
+      ),
+      models.Index(
+        condition=HOT_ANALYSES,
+        fields=['host', '-date_created', '-id'],
+        name='analysis_live_host_idx',
+      ),
+      models.Index(
+        condition=HOT_ANALYSES,
+        fields=['status', '-date_created', '-id'],
+        name='analysis_live_status_idx',
+      ),
+      # re_analyze by genome, only genome index analyses are in the index
+      models.Index(
+        condition=Q(index_genome_id__isnull=False),
+        fields=['index_genome_id', 'owner'],
+        name='analysis_index_genome_idx',
+      ),
+      # q= search, needs the pg_trgm extension (TrigramExtension migration)
+      GinIndex(fields=['search_text'], name='analysis_search_trgm_idx', opclasses=['gin_trgm_ops']),
+    ]
     permissions = (
       ('view', 'Can view analysis'),
       ('edit', 'Can edit analysis'),
@@ -199,6 +293,80 @@ class Analysis(BaseModel):
     else:
       LOG.warning(f'analysis.add_project: analysis {self.id} created without owner')
 
+  @staticmethod
+  def build_name(workflow_name, sample_names):
+    '''Default analysis name from its workflow name and sample names'''
+    name = f'{workflow_name}'
+    if sample_names:
+      name += f' on {sample_names[0]}'
+    return name
+
+  @classmethod
+  def backfill_names(cls):
+    '''Set the default name on every unnamed analysis with a single UPDATE'''
+    live_samples = Sample.objects.filter(analyses=OuterRef('pk'), deleted_on__isnull=True)
+    workflow_name = Subquery(Workflow.objects.filter(pk=OuterRef('workflow_id')).values('name')[:1])
+    sample_name = Subquery(live_samples.order_by('pk').values('name')[:1])
+
+    return cls.objects.filter(Q(name='') | Q(name__isnull=True)).update(name=Case(
+      When(Exists(live_samples), then=Concat(workflow_name, Value(' on '), sample_name)),
+      default=workflow_name,
+      output_field=models.CharField(),
+    ))
+
+  @classmethod
+  def backfill_index_genome_ids(cls, chunk_size=10000):
+    '''Set index_genome_id from params on every analysis missing it, one UPDATE per pk range'''
+    index_genome_id = KeyTextTransform(
+      'index_genome_id', KeyTransform('index_genome', KeyTransform('node', 'params'))
+    )
+    queryset = cls.objects.filter(
+      index_genome_id__isnull=True,
+      params__node__index_genome__has_key='index_genome_id',
+    )
+    bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+      return 0
+
+    updated = 0
+    for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+      updated += queryset.filter(pk__gte=start, pk__lt=start + chunk_size).update(index_genome_id=index_genome_id)
+    return updated
+
+  @classmethod
+  def bulk_update_status(cls, analyses, fields, batch_size=500):
+    '''Save status/timestamp changes of many analyses with bulk_update
+
+    bulk_update skips save(), so the status hooks (notification, status event
+    and cost accrual) are called here once the batch is committed, only for
+    the analyses whose status changed.
+    '''
+    now = datetime.now(pytz.utc)
+    status_changed = [analysis for analysis in analyses if analysis.tracker.has_changed('status')]
+    for analysis in analyses:
+      analysis.last_updated = now
+
+    with transaction.atomic():
+      cls.objects.bulk_update(analyses, [*fields, 'last_updated'], batch_size=batch_size)
+      transaction.on_commit(cls.bump_count_version)
+      if status_changed:
+        transaction.on_commit(lambda: cls._call_status_hooks(status_changed))
+    return status_changed
+
+  @staticmethod
+  def bump_count_version():
+    '''Drop cached analysis list counts, for bulk writes that send no post_save'''
+    from bpapp.api3.resources.pagination import bump_count_version # pylint: disable=import-outside-toplevel
+    bump_count_version(Analysis)
+
+  @classmethod
+  def _call_status_hooks(cls, analyses):
+    '''Status change hooks of save() for analyses saved with bulk_update'''
+    from bpapp.api3.resources.events import hook_publish_status_event # pylint: disable=import-outside-toplevel
+    for analysis in analyses:
+      for hook in [hook_send_notification, hook_publish_status_event, hook_accrue_analysis_cost]:
+        hook(sender=cls, instance=analysis)
+
   def clone(self, owner=None):
     '''Clone analysis'''
     new_analysis = copy(self)
@@ -216,6 +384,61 @@ class Analysis(BaseModel):
 
     return new_analysis
 
+  @staticmethod
+  def get_index_genome_id(params):
+    '''index_genome_id of analysis params, None when it isn't a genome index analysis'''
+    node = params.get('node') if isinstance(params, dict) else None
+    index_genome = node.get('index_genome') if isinstance(node, dict) else None
+    index_genome_id = index_genome.get('index_genome_id') if isinstance(index_genome, dict) else None
+    return None if index_genome_id is None else str(index_genome_id)
+
+  def get_search_text(self):
+    '''Searchable text of the analysis'''
+    names = [
+      str(self.id),
+      self.name,
+      getattr(self.owner, 'username', ''),
+      getattr(self.workflow, 'name', ''),
+      *[sample.name for sample in self.samples.all()],
+      *[control.name for control in self.controls.all()],
+    ]
+    return ' '.join(name for name in names if name).lower()
+
+  @classmethod
+  def refresh_search_text(cls, queryset=None, chunk_size=1000):
+    '''Recompute search_text for the analyses in queryset, in chunks'''
+    queryset = cls.objects.all() if queryset is None else queryset
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True).distinct())
+    for start in range(0, len(ids), chunk_size):
+      analyses = list(cls.objects.filter(
+        pk__in=ids[start:start + chunk_size]
+      ).select_related('owner', 'workflow').prefetch_related(
+        'samples', 'controls'
+      ).only('id', 'name', 'search_text', 'owner__username', 'workflow__name'))
+      for analysis in analyses:
+        analysis.search_text = analysis.get_search_text()
+      cls.objects.bulk_update(analyses, ['search_text'])
+
+  @classmethod
+  def schedule_search_text_refresh(cls, analysis_ids):
+    '''Refresh search_text of analyses once the transaction commits
+
+    The analysis save and its samples/controls links of a transaction are
+    folded into a single refresh per analysis, made after the links are set.
+    '''
+    if not hasattr(_search_text_pending, 'ids'):
+      _search_text_pending.ids = set()
+    _search_text_pending.ids.update(analysis_ids)
+    transaction.on_commit(cls._flush_search_text)
+
+  @classmethod
+  def _flush_search_text(cls):
+    '''Refresh the pending search_text, later callbacks of the same commit find nothing left'''
+    analysis_ids = getattr(_search_text_pending, 'ids', None)
+    if analysis_ids:
+      _search_text_pending.ids = set()
+      cls.refresh_search_text(cls.objects.filter(pk__in=analysis_ids))
+
   @property
   def timetaken(self):
     '''Time taken for the analysis'''
@@ -240,14 +463,63 @@ class Analysis(BaseModel):
     '''The number of files for the analysis'''
     return self.files.count()
 
+@functools.lru_cache(maxsize=None)
+def _get_reset_log():
+  '''Log left by AnalysisLog.reset(), run once on an unsaved log whose save() does nothing'''
+  AnalysisLog = apps.get_model('bpapp.AnalysisLog') # pylint: disable=invalid-name
+  analysis_log = AnalysisLog(analysis=Analysis())
+  analysis_log.save = lambda *args, **kwargs: None
+  analysis_log.reset()
+  return analysis_log.log
+
+def get_reset_log():
+  '''Log of a new analysis, as AnalysisLog.reset() leaves it, without a query'''
+  return deepcopy(_get_reset_log())
+
 # hook
-def hook_create_analysis_log(sender, instance, **kwargs): # pylint: disable=unused-argument
+def hook_create_analysis_log(sender, instance, created=False, raw=False, **kwargs): # pylint: disable=unused-argument
   '''Hook to call create analysis log when new analysis created'''
-  if sender == Analysis:
-    AnalysisLog = apps.get_model('bpapp.AnalysisLog') # pylint: disable=invalid-name
-    if not AnalysisLog.objects.filter(analysis=instance).exists():
-      analysis_log = AnalysisLog.objects.create(analysis=instance)
-      analysis_log.reset()
+  # only on creation, later writes get the log lazily (see `save_log`)
+  if sender == Analysis and created and not raw:
+    provision_analysis_logs([instance])
+
+def provision_analysis_logs(analyses):
+  '''Create the reset logs of new analyses with a single insert (e.g. after bulk_create)'''
+  AnalysisLog = apps.get_model('bpapp.AnalysisLog') # pylint: disable=invalid-name
+  return AnalysisLog.objects.bulk_create([
+    AnalysisLog(analysis=analysis, log=get_reset_log()) for analysis in analyses if analysis.pk
+  ])
+
+def hook_set_index_genome_id(sender, instance, **kwargs): # pylint: disable=unused-argument
+  '''Hook to keep index_genome_id in sync with params, unless params were not loaded or are archived'''
+  if not instance.archived_on and 'params' not in instance.get_deferred_fields():
+    instance.index_genome_id = Analysis.get_index_genome_id(instance.params)
+
+def hook_update_search_text(sender, instance, created=False, **kwargs): # pylint: disable=unused-argument
+  '''Hook to refresh analysis search_text when its own searchable fields change'''
+  if created or any(instance.tracker.has_changed(field) for field in ['name', 'owner_id', 'workflow_id']):
+    Analysis.schedule_search_text_refresh([instance.pk])
+
+def hook_update_m2m_search_text(sender, instance, action, pk_set, **kwargs): # pylint: disable=unused-argument
+  '''Hook to refresh analysis search_text when its samples or controls change'''
+  if action not in ['post_add', 'post_remove', 'post_clear', 'pre_clear']:
+    return
+  if isinstance(instance, Analysis):
+    if action != 'pre_clear':
+      Analysis.schedule_search_text_refresh([instance.pk])
+  elif action == 'pre_clear':
+    # sample side clear, pk_set is not provided
+    Analysis.schedule_search_text_refresh(sender.objects.filter(sample_id=instance.pk).values_list('analysis_id', flat=True))
+  elif pk_set:
+    Analysis.schedule_search_text_refresh(pk_set)
+
+def hook_update_sample_search_text(sender, instance, created=False, **kwargs): # pylint: disable=unused-argument
+  '''Hook to refresh search_text of analyses using a renamed sample'''
+  if created or not instance.tracker.has_changed('name'):
+    return
+  Analysis.schedule_search_text_refresh(
+    Analysis.objects.filter(Q(samples=instance) | Q(controls=instance)).values_list('pk', flat=True).distinct()
+  )
 
 def hook_send_notification(sender, instance, **kwargs): # pylint: disable=unused-argument
   '''Hook to send email notification whenever analysis status updates'''
@@ -354,20 +626,101 @@ def _send_email(analysis, cc_emails, event_name, run_status, user_email):
 
 
 post_save.connect(hook_create_analysis_log, sender=Analysis)
+post_save.connect(hook_update_search_text, sender=Analysis)
+post_save.connect(hook_update_sample_search_text, sender=Sample)
+m2m_changed.connect(hook_update_m2m_search_text, sender=Analysis.samples.through)
+m2m_changed.connect(hook_update_m2m_search_text, sender=Analysis.controls.through)
 pre_save.connect(hook_send_notification, sender=Analysis)
+pre_save.connect(hook_set_index_genome_id, sender=Analysis)
+
+
+class _Seconds(models.Func):
+  '''Seconds elapsed between two datetime expressions, `_Seconds(end, start)`'''
+  arg_joiner = ' - '
+  arity = 2
+  output_field = models.FloatField()
+  template = 'EXTRACT(EPOCH FROM (%(expressions)s))::double precision'
+
+  def as_sqlite(self, compiler, connection, **extra_context):
+    '''julianday difference, sqlite has no interval type'''
+    return self.as_sql(
+      compiler,
+      connection,
+      arg_joiner=') - JULIANDAY(',
+      template='((JULIANDAY(%(expressions)s)) * 86400.0)',
+      **extra_context,
+    )
+
+
+class InstanceQuerySet(SoftDeleteQuerySet):
+  '''Instance lifecycle reporting, durations and cost are computed by the database'''
+
+  # report dimensions, `host_id` is the host of the instance analysis
+  REPORT_GROUPS = {
+    'analysis_id': 'analysis_id',
+    'host_id': 'analysis__host_id',
+    'instance_type': 'instance_type',
+    'lifecycle': 'lifecycle',
+    'mode': 'mode',
+    'owner_id': 'owner_id',
+  }
+
+  def with_durations(self):
+    '''Annotate boot_seconds, run_seconds, billed_seconds and cost (`rate` is per hour)
+
+    Running instances are billed up to now, durations with a missing timestamp are NULL.
+    '''
+    billed_seconds = _Seconds(Coalesce('terminated_on', Now()), 'requested_on')
+    return self.annotate(
+      billed_seconds=billed_seconds,
+      boot_seconds=_Seconds('ready_on', 'requested_on'),
+      cost=ExpressionWrapper(
+        Cast('rate', output_field=models.FloatField()) * billed_seconds / 3600.0,
+        output_field=models.FloatField(),
+      ),
+      run_seconds=_Seconds('terminated_on', 'ready_on'),
+    )
+
+  def requested_between(self, start=None, end=None):
+    '''Instances requested in [start, end)'''
+    queryset = self
+    if start:
+      queryset = queryset.filter(requested_on__gte=start)
+    if end:
+      queryset = queryset.filter(requested_on__lt=end)
+    return queryset
+
+  def report(self, group_by=('instance_type', 'lifecycle')):
+    '''Count, average boot/run seconds, billed hours and cost per group, as one aggregate query'''
+    unknown = [group for group in group_by if group not in self.REPORT_GROUPS]
+    if unknown:
+      raise ValueError(f"unknown report group(s): {', '.join(unknown)}")
+
+    fields = [group for group in group_by if self.REPORT_GROUPS[group] == group]
+    aliases = {group: F(self.REPORT_GROUPS[group]) for group in group_by if group not in fields}
+    return self.with_durations().values(*fields, **aliases).annotate(
+      avg_boot_seconds=Avg('boot_seconds'),
+      avg_run_seconds=Avg('run_seconds'),
+      billed_hours=Sum('billed_seconds') / 3600.0,
+      cost=Sum('cost'),
+      instances=Count('id'),
+    ).order_by(*group_by)
+
+
+class LiveInstanceManager(LiveManager.from_queryset(InstanceQuerySet)):
+  '''Manager of the instances that are not soft deleted'''
 
 
 class Instance(BaseModel):
   '''Instance Model class'''
+  tracker = FieldTracker(fields=['terminated_on'])
 
-  analysis_id = models.CharField(max_length=20)
   aws_instance_id = models.CharField(max_length=40)
   hostname = models.CharField(max_length=100)
   instance_type = models.CharField(max_length=20)
   lifecycle = models.CharField(max_length=20)
   mode = models.CharField(max_length=20)
   name = models.CharField(max_length=50)
-  owner_id = models.CharField(max_length=20)
   rate = models.DecimalField(decimal_places=5, max_digits=20, null=True)
   task_list = models.CharField(max_length=100)
 
@@ -379,6 +732,39 @@ class Instance(BaseModel):
   requested_on = models.DateTimeField(null=True)
   terminated_on = models.DateTimeField(null=True)
 
+  # relations, without db constraints: instances outlive deleted analyses/users
+  analysis = models.ForeignKey(
+    Analysis,
+    blank=True,
+    db_constraint=False,
+    null=True,
+    on_delete=models.DO_NOTHING,
+    related_name='instances',
+  )
+  owner = models.ForeignKey(
+    settings.AUTH_USER_MODEL,
+    blank=True,
+    db_constraint=False,
+    null=True,
+    on_delete=models.DO_NOTHING,
+    related_name='instances',
+  )
+
+  objects = InstanceQuerySet.as_manager()
+  live = LiveInstanceManager()
+
+  class Meta:
+    '''Meta class'''
+    indexes = [
+      # fleet reports over a requested_on window
+      models.Index(fields=['requested_on', 'instance_type', 'lifecycle'], name='instance_report_idx'),
+      models.Index(
+        condition=Q(deleted_on__isnull=True),
+        fields=['owner', '-date_created', '-id'],
+        name='instance_live_owner_idx',
+      ),
+    ]
+
   def __str__(self):
     return self.name
 
@@ -394,4 +780,416 @@ class Instance(BaseModel):
     '''Time to run analysis'''
     return (self.terminated_on - self.ready_on).total_seconds() \
       if self.terminated_on and self.ready_on \
-      else 0
\ No newline at end of file
+      else 0
+
+def get_period_start(date):
+  '''First day of the (monthly) billing period of a datetime'''
+  return date.astimezone(pytz.utc).date().replace(day=1)
+
+def _get_billing_account_ids(owner_ids):
+  '''Billing account id per user id, users without one are left out'''
+  BillingAccountMember = apps.get_model('bpapp.BillingAccountMember') # pylint: disable=invalid-name
+  return dict(BillingAccountMember.objects.filter(
+    user_id__in=[owner_id for owner_id in set(owner_ids) if owner_id]
+  ).order_by('user_id', 'pk').values_list('user_id', 'account_id'))
+
+
+class CostLedgerEntry(models.Model):
+  '''Accrued cost of an analysis, append only
+
+  `compute` entries are the cost of one terminated instance (Instance.rate per
+  hour from request to termination), `runtime` entries the runtime of one
+  completed analysis, charged at the owner rate per hour when the owner is
+  billed by `runtime`. There is at most one entry per instance / analysis, so
+  accruing twice is a no-op.
+  '''
+  KIND_COMPUTE = 'compute'
+  KIND_RUNTIME = 'runtime'
+
+  accrued_on = models.DateTimeField()
+  amount = models.DecimalField(decimal_places=5, max_digits=20, default=Decimal(0))
+  billing_account_id = models.IntegerField(null=True, blank=True)
+  date_created = models.DateTimeField(auto_now_add=True)
+  kind = models.CharField(max_length=20)
+  rate = models.DecimalField(decimal_places=5, max_digits=20, null=True, blank=True)
+  seconds = models.FloatField(default=0)
+
+  # relations, without db constraints: the ledger outlives deleted rows
+  analysis = models.ForeignKey(
+    Analysis, db_constraint=False, null=True, on_delete=models.DO_NOTHING, related_name='cost_entries'
+  )
+  host = models.ForeignKey(Host, db_constraint=False, null=True, on_delete=models.DO_NOTHING, related_name='+')
+  instance = models.ForeignKey(
+    Instance, db_constraint=False, null=True, on_delete=models.DO_NOTHING, related_name='cost_entries'
+  )
+  owner = models.ForeignKey(
+    settings.AUTH_USER_MODEL, db_constraint=False, null=True, on_delete=models.DO_NOTHING, related_name='+'
+  )
+
+  class Meta:
+    '''Meta class'''
+    constraints = [
+      models.UniqueConstraint(
+        condition=Q(kind='compute'),
+        fields=['instance'],
+        name='cost_ledger_compute_instance_uniq',
+      ),
+      models.UniqueConstraint(
+        condition=Q(kind='runtime'),
+        fields=['analysis'],
+        name='cost_ledger_runtime_analysis_uniq',
+      ),
+    ]
+    indexes = [
+      models.Index(fields=['accrued_on'], name='cost_ledger_accrued_idx'),
+    ]
+
+  @staticmethod
+  def _get_amount(rate, seconds):
+    '''Cost of `seconds` at an hourly rate'''
+    return (Decimal(rate or 0) * Decimal(seconds) / 3600).quantize(Decimal('0.00001'))
+
+  @classmethod
+  def build_compute_entry(cls, instance, billing_account_ids):
+    '''Unsaved entry for a terminated instance, None when it can't be billed yet'''
+    if not instance.terminated_on or not instance.requested_on:
+      return None
+    analysis = instance.analysis
+    owner_id = instance.owner_id or (analysis and analysis.owner_id)
+    seconds = max((instance.terminated_on - instance.requested_on).total_seconds(), 0)
+    return cls(
+      accrued_on=instance.terminated_on,
+      amount=cls._get_amount(instance.rate, seconds),
+      analysis_id=instance.analysis_id,
+      billing_account_id=billing_account_ids.get(owner_id),
+      host_id=analysis and analysis.host_id,
+      instance_id=instance.pk,
+      kind=cls.KIND_COMPUTE,
+      owner_id=owner_id,
+      rate=instance.rate,
+      seconds=seconds,
+    )
+
+  @classmethod
+  def build_runtime_entry(cls, analysis, billing_account_ids):
+    '''Unsaved entry for a completed analysis, None when it can't be billed yet'''
+    if analysis.status != 'completed' or not analysis.completed_on:
+      return None
+    owner = analysis.owner
+    rate = owner.rate if owner and owner.bill_by == 'runtime' else None
+    return cls(
+      accrued_on=analysis.completed_on,
+      amount=cls._get_amount(rate, analysis.timetaken),
+      analysis_id=analysis.pk,
+      billing_account_id=billing_account_ids.get(analysis.owner_id),
+      host_id=analysis.host_id,
+      kind=cls.KIND_RUNTIME,
+      owner_id=analysis.owner_id,
+      rate=rate,
+      seconds=analysis.timetaken,
+    )
+
+  @staticmethod
+  def _accrue(entry):
+    '''Save entry and add it to the rollups, unless it is already in the ledger'''
+    if entry is None:
+      return None
+    try:
+      with transaction.atomic():
+        entry.save()
+        CostRollup.add_entries([entry])
+    except IntegrityError:  # already accrued
+      return None
+    return entry
+
+  @classmethod
+  def accrue_instance(cls, instance_id):
+    '''Accrue the compute cost of a terminated instance'''
+    instance = Instance.objects.select_related('analysis').filter(pk=instance_id).first()
+    if instance is None:
+      return None
+    owner_id = instance.owner_id or (instance.analysis and instance.analysis.owner_id)
+    entry = cls.build_compute_entry(instance, _get_billing_account_ids([owner_id]))
+    return cls._accrue(entry)
+
+  @classmethod
+  def accrue_analysis(cls, analysis_id):
+    '''Accrue the runtime of a completed analysis'''
+    analysis = Analysis.objects.select_related('owner').filter(pk=analysis_id).first()
+    if analysis is None:
+      return None
+    entry = cls.build_runtime_entry(analysis, _get_billing_account_ids([analysis.owner_id]))
+    return cls._accrue(entry)
+
+  @classmethod
+  def backfill(cls, since=None, chunk_size=1000):
+    '''Accrue the history not in the ledger yet, chunk by chunk, then rebuild the touched rollups
+
+    Safe to re-run and to run alongside live accruals: conflicting entries are skipped.
+    '''
+    instances = Instance.objects.filter(terminated_on__isnull=False, requested_on__isnull=False).exclude(
+      Exists(cls.objects.filter(kind=cls.KIND_COMPUTE, instance_id=OuterRef('pk')))
+    ).select_related('analysis')
+    analyses = Analysis.objects.filter(status='completed', completed_on__isnull=False).exclude(
+      Exists(cls.objects.filter(kind=cls.KIND_RUNTIME, analysis_id=OuterRef('pk')))
+    ).select_related('owner').defer('app_data', 'info', 'params', 'user_params', 'workflow_data')
+    if since:
+      instances = instances.filter(terminated_on__gte=since)
+      analyses = analyses.filter(completed_on__gte=since)
+
+    accrued = 0
+    oldest = None
+    for queryset, build_entry, get_owner_id in [
+        (instances, cls.build_compute_entry, lambda obj: obj.owner_id or (obj.analysis and obj.analysis.owner_id)),
+        (analyses, cls.build_runtime_entry, lambda obj: obj.owner_id),
+    ]:
+      last_pk = 0
+      while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not chunk:
+          break
+        last_pk = chunk[-1].pk
+        billing_account_ids = _get_billing_account_ids([get_owner_id(obj) for obj in chunk])
+        entries = [entry for entry in (build_entry(obj, billing_account_ids) for obj in chunk) if entry]
+        if entries:
+          cls.objects.bulk_create(entries, ignore_conflicts=True)
+          accrued += len(entries)
+          chunk_oldest = min(entry.accrued_on for entry in entries)
+          oldest = chunk_oldest if oldest is None else min(oldest, chunk_oldest)
+
+    if oldest:
+      CostRollup.rebuild(since=oldest)
+    return accrued
+
+
+class CostRollup(models.Model):
+  '''Ledger totals per user, host or billing account and monthly period, one row per key'''
+  # advisory lock key of the rollups, see `_lock`
+  LOCK_ID = 0x636f7374
+  SCOPES = {
+    'billing_account': 'billing_account_id',
+    'host': 'host_id',
+    'user': 'owner_id',
+  }
+
+  amount = models.DecimalField(decimal_places=5, max_digits=20, default=Decimal(0))
+  entries = models.IntegerField(default=0)
+  kind = models.CharField(max_length=20)
+  period_start = models.DateField()
+  scope = models.CharField(max_length=20)
+  scope_id = models.IntegerField()
+  seconds = models.FloatField(default=0)
+
+  class Meta:
+    '''Meta class'''
+    constraints = [
+      models.UniqueConstraint(
+        fields=['scope', 'scope_id', 'period_start', 'kind'],
+        name='cost_rollup_key_uniq',
+      ),
+    ]
+
+  @classmethod
+  def get_totals(cls, scope, scope_id, date):
+    '''Amount, seconds and entries per kind of a scope over the period of date'''
+    return {
+      row['kind']: row for row in cls.objects.filter(
+        period_start=get_period_start(date),
+        scope=scope,
+        scope_id=scope_id,
+      ).values('kind', 'amount', 'seconds', 'entries')
+    }
+
+  @classmethod
+  def _lock(cls, shared=False):
+    '''Transaction level lock of the rollups: shared by live increments, exclusive for a rebuild
+
+    A rebuild then never runs alongside an increment: entries committed before
+    it are in its aggregates, entries of accruals waiting on it are added to
+    the rebuilt rows once it commits.
+    '''
+    if connection.vendor != 'postgresql':  # sqlite serializes writes already
+      return
+    with connection.cursor() as cursor:
+      cursor.execute(
+        'SELECT pg_advisory_xact_lock_shared(%s)' if shared else 'SELECT pg_advisory_xact_lock(%s)',
+        [cls.LOCK_ID],
+      )
+
+  @classmethod
+  def add_entries(cls, entries):
+    '''Add ledger entries to their rollups with atomic increments, never during a rebuild'''
+    deltas = defaultdict(lambda: [Decimal(0), 0.0, 0])
+    for entry in entries:
+      for scope, attname in cls.SCOPES.items():
+        scope_id = getattr(entry, attname)
+        if scope_id is not None:
+          delta = deltas[(scope, scope_id, get_period_start(entry.accrued_on), entry.kind)]
+          delta[0] += entry.amount
+          delta[1] += entry.seconds
+          delta[2] += 1
+
+    with transaction.atomic():
+      cls._lock(shared=True)
+      for (scope, scope_id, period_start, kind), (amount, seconds, count) in deltas.items():
+        key = {'kind': kind, 'period_start': period_start, 'scope': scope, 'scope_id': scope_id}
+        cls.objects.get_or_create(**key)
+        cls.objects.filter(**key).update(
+          amount=F('amount') + amount,
+          entries=F('entries') + count,
+          seconds=F('seconds') + seconds,
+        )
+
+  @classmethod
+  def rebuild(cls, since=None):
+    '''Recompute the rollups of the periods from `since` on from the ledger, with one aggregate per scope'''
+    period_start = since and get_period_start(since)
+    entries = CostLedgerEntry.objects.all()
+    rollups = cls.objects.all()
+    if period_start:
+      entries = entries.filter(accrued_on__gte=datetime.combine(period_start, datetime.min.time(), tzinfo=pytz.utc))
+      rollups = rollups.filter(period_start__gte=period_start)
+
+    with transaction.atomic():
+      # before the aggregates: they then see every entry already added to the rollups
+      cls._lock()
+      rollups.delete()
+      for scope, attname in cls.SCOPES.items():
+        totals = entries.exclude(**{f'{attname}__isnull': True}).annotate(
+          period=TruncMonth('accrued_on', tzinfo=pytz.utc),
+        ).values(attname, 'period', 'kind').annotate(
+          total_amount=Sum('amount'),
+          total_entries=Count('id'),
+          total_seconds=Sum('seconds'),
+        ).order_by()
+        cls.objects.bulk_create([
+          cls(
+            amount=total['total_amount'],
+            entries=total['total_entries'],
+            kind=total['kind'],
+            period_start=total['period'].date(),
+            scope=scope,
+            scope_id=total[attname],
+            seconds=total['total_seconds'],
+          ) for total in totals.iterator()
+        ], batch_size=1000)
+
+# hooks
+def hook_accrue_instance_cost(sender, instance, created=False, **kwargs): # pylint: disable=unused-argument
+  '''Hook to accrue the cost of an instance once it is terminated'''
+  if instance.terminated_on and (created or instance.tracker.has_changed('terminated_on')):
+    transaction.on_commit(lambda: CostLedgerEntry.accrue_instance(instance.pk))
+
+def hook_accrue_analysis_cost(sender, instance, **kwargs): # pylint: disable=unused-argument
+  '''Hook to accrue the runtime of an analysis once it is completed, also called by bulk_update_status'''
+  if instance.pk and instance.status == 'completed' and instance.tracker.has_changed('status'):
+    analysis_id = instance.pk
+    transaction.on_commit(lambda: CostLedgerEntry.accrue_analysis(analysis_id))
+
+post_save.connect(hook_accrue_instance_cost, sender=Instance)
+pre_save.connect(hook_accrue_analysis_cost, sender=Analysis)
+
+
+class AnalysisArchive(models.Model):
+  '''Cold storage of an analysis: its large json columns, logs and files as one compressed JSON blob
+
+  The Analysis row itself stays (permissions, shares, projects and the cost
+  ledger point to it) with `archived_on` set, out of the hot list indexes.
+  '''
+  # analysis columns moved to the archive
+  ARCHIVED_FIELDS = ['app_data', 'params', 'user_params', 'workflow_data']
+
+  analysis = models.OneToOneField(
+    Analysis, db_constraint=False, on_delete=models.DO_NOTHING, primary_key=True, related_name='archive'
+  )
+  archived_on = models.DateTimeField(auto_now_add=True)
+  data = models.BinaryField()
+  size = models.BigIntegerField(default=0)  # uncompressed bytes
+
+  @staticmethod
+  def _get_related_models():
+    '''AnalysisLog and File models'''
+    return apps.get_model('bpapp.AnalysisLog'), apps.get_model('bpapp.File')
+
+  @classmethod
+  def get_candidates(cls, completed_before=None, idle_days=30):
+    '''Completed analyses older than a year by default, left alone for `idle_days`
+
+    The idle window keeps analyses that were just rehydrated from being archived again.
+    '''
+    now = datetime.now(pytz.utc)
+    return Analysis.objects.filter(
+      archived_on__isnull=True,
+      completed_on__lt=completed_before or now - timedelta(days=365),
+      last_updated__lt=now - timedelta(days=idle_days),
+      status='completed',
+    )
+
+  @classmethod
+  def archive(cls, queryset=None, chunk_size=200, limit=None):
+    '''Move the analyses of queryset (`get_candidates()` by default) to the archive, one transaction per chunk'''
+    AnalysisLog, File = cls._get_related_models()  # pylint: disable=invalid-name
+    queryset = cls.get_candidates() if queryset is None else queryset
+    archived = 0
+    last_pk = 0
+    while limit is None or archived < limit:
+      size = chunk_size if limit is None else min(chunk_size, limit - archived)
+      with transaction.atomic():
+        analyses = list(queryset.filter(pk__gt=last_pk, archived_on__isnull=True).order_by('pk').values(
+          'pk', *cls.ARCHIVED_FIELDS
+        )[:size])
+        if not analyses:
+          break
+        last_pk = analyses[-1]['pk']
+        analysis_ids = [analysis['pk'] for analysis in analyses]
+
+        logs = defaultdict(list)
+        for log in AnalysisLog.objects.filter(analysis_id__in=analysis_ids).values().iterator():
+          logs[log['analysis_id']].append(log)
+        files = defaultdict(list)
+        for file in File.objects.filter(analysis_id__in=analysis_ids).values().iterator():
+          files[file['analysis_id']].append(file)
+
+        archives = []
+        for analysis in analyses:
+          payload = json.dumps({
+            'fields': {field: analysis[field] for field in cls.ARCHIVED_FIELDS},
+            'files': files[analysis['pk']],
+            'logs': logs[analysis['pk']],
+          }, cls=DjangoJSONEncoder).encode('utf-8')
+          archives.append(cls(analysis_id=analysis['pk'], data=zlib.compress(payload), size=len(payload)))
+        cls.objects.bulk_create(archives)
+
+        # raw deletes: no delete signals, the stored objects of the files must stay in place
+        File.objects.filter(analysis_id__in=analysis_ids)._raw_delete(File.objects.db)  # pylint: disable=protected-access
+        AnalysisLog.objects.filter(analysis_id__in=analysis_ids)._raw_delete(AnalysisLog.objects.db)  # pylint: disable=protected-access
+        # update() keeps last_updated, the archive doesn't change the analysis
+        Analysis.objects.filter(pk__in=analysis_ids).update(
+          archived_on=datetime.now(pytz.utc),
+          **{field: None for field in cls.ARCHIVED_FIELDS},
+        )
+        transaction.on_commit(Analysis.bump_count_version)
+      archived += len(analyses)
+    return archived
+
+  @classmethod
+  def rehydrate(cls, analysis_id):
+    '''Restore an archived analysis, its logs and files, returns whether it was archived'''
+    AnalysisLog, File = cls._get_related_models()  # pylint: disable=invalid-name
+    with transaction.atomic():
+      archive = cls.objects.select_for_update().filter(analysis_id=analysis_id).first()
+      transaction.on_commit(Analysis.bump_count_version)
+      if archive is None:
+        return bool(Analysis.objects.filter(pk=analysis_id, archived_on__isnull=False).update(archived_on=None))
+
+      payload = json.loads(zlib.decompress(bytes(archive.data)))
+      AnalysisLog.objects.bulk_create([AnalysisLog(**log) for log in payload['logs']])
+      File.objects.bulk_create([File(**file) for file in payload['files']])
+      Analysis.objects.filter(pk=analysis_id).update(
+        archived_on=None,
+        last_updated=datetime.now(pytz.utc),
+        **payload['fields'],
+      )
+      archive.delete()
+    return True
+
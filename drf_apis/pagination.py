@@ -0,0 +1,204 @@
+'''Pagination'''
+
+# Lib imports
+import hashlib
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# App imports
+from bpapp.models import Analysis, Sample
+
+COUNT_VERSION_KEY = 'count_cache:version:{}'
+
+class KeysetCursorPagination(CursorPagination):
+  '''Cursor pagination on a (timestamp, id) keyset
+
+  Deep pages are a range scan on a composite index instead of an OFFSET scan.
+  Only the orderings listed in `keyset_orderings` are accepted.
+  '''
+
+  cursor_mode_query_param = 'pagination'
+  keyset_orderings = ()
+  ordering = ()
+  ordering_param = 'ordering'
+  page_size_query_param = 'limit'
+  max_page_size = 1000
+
+  @classmethod
+  def is_requested(cls, request):
+    '''Check if the request asked for cursor pagination'''
+    params = request.query_params
+    return cls.cursor_query_param in params or params.get(cls.cursor_mode_query_param) == 'cursor'
+
+  def get_ordering(self, request, queryset, view):
+    '''Map the requested ordering to its (timestamp, id) keyset'''
+    requested = request.query_params.get(self.ordering_param)
+    if not requested:
+      return self.ordering
+
+    for field in self.keyset_orderings:
+      if requested == field:
+        return (field, 'id')
+      if requested == f'-{field}':
+        return (f'-{field}', '-id')
+
+    allowed = ', '.join(self.keyset_orderings)
+    raise ValidationError({self.ordering_param: f'Cursor pagination only supports ordering by: {allowed}.'})
+
+
+class AnalysisCursorPagination(KeysetCursorPagination):
+  '''Analysis cursor pagination'''
+  keyset_orderings = ('date_created', 'last_updated')
+  ordering = ('-date_created', '-id')
+
+
+class CountingLimitOffsetPagination(LimitOffsetPagination):
+  '''Limit/offset pagination with a counting strategy
+
+  - `count=false` skips the count, `next` is found by fetching one extra row
+  - unfiltered querysets on large postgres tables use the planner estimate,
+    of `live_estimate_index` (a partial index on the live rows) when the only
+    filter is the soft delete one
+  - other counts are cached per (user, query) and dropped on any write to the model
+  '''
+
+  count_cache_timeout = 30
+  count_query_param = 'count'
+  estimate_threshold = 100000
+  live_estimate_index = None
+
+  def paginate_queryset(self, queryset, request, view=None):
+    '''Paginate, skipping the count when asked to'''
+    self.include_count = request.query_params.get(self.count_query_param, '').lower() not in ['0', 'false']
+    if self.include_count:
+      return super().paginate_queryset(queryset, request, view)
+
+    self.limit = self.get_limit(request)
+    if self.limit is None:
+      return None
+
+    self.count = None
+    self.offset = self.get_offset(request)
+    self.request = request
+    page = list(queryset[self.offset:self.offset + self.limit + 1])
+    self.has_next = len(page) > self.limit
+    return page[:self.limit]
+
+  def get_count(self, queryset):
+    '''Estimated or cached exact count'''
+    estimated_count = self._get_estimated_count(queryset)
+    if estimated_count is not None:
+      return estimated_count
+
+    try:
+      key = self._get_count_cache_key(queryset)
+    except EmptyResultSet:  # .none() or an empty `__in`, the query can't even be compiled
+      return 0
+    count = cache.get(key)
+    if count is None:
+      count = super().get_count(queryset)
+      cache.set(key, count, timeout=self.count_cache_timeout)
+    return count
+
+  def get_next_link(self):
+    '''Next link, without a count when it was skipped'''
+    if self.include_count:
+      return super().get_next_link()
+    if not self.has_next:
+      return None
+    url = self.request.build_absolute_uri()
+    url = replace_query_param(url, self.limit_query_param, self.limit)
+    return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+  def get_paginated_response(self, data):
+    '''Paginated response, without `count` when it was skipped'''
+    if self.include_count:
+      return super().get_paginated_response(data)
+    return Response(OrderedDict([
+      ('next', self.get_next_link()),
+      ('previous', self.get_previous_link()),
+      ('results', data),
+    ]))
+
+  def _get_count_cache_key(self, queryset):
+    '''Cache key of a count'''
+    label = queryset.model._meta.label_lower
+    version = cache.get(COUNT_VERSION_KEY.format(label), 0)
+    query_hash = hashlib.md5(str(queryset.query).encode()).hexdigest()
+    user_id = getattr(getattr(self.request, 'user', None), 'pk', None)
+    return f'count_cache:{label}:{version}:{user_id}:{query_hash}'
+
+  @staticmethod
+  def get_live_queryset(model):
+    '''Queryset of the rows covered by `live_estimate_index`'''
+    return model.objects.live()
+
+  def _get_estimated_count(self, queryset):
+    '''Planner row estimate for an unfiltered queryset on a large postgres table'''
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.distinct:
+      return None
+
+    if not queryset.query.where:
+      relation = queryset.model._meta.db_table
+    elif self.live_estimate_index and queryset.query.where == self.get_live_queryset(queryset.model).query.where:
+      relation = self.live_estimate_index
+    else:
+      return None
+
+    # to_regclass() is NULL for a missing relation (index not migrated yet), the count is then exact
+    with connection.cursor() as cursor:
+      cursor.execute(
+        'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)',
+        [relation]
+      )
+      row = cursor.fetchone()
+    estimated_count = row[0] if row else None
+    if estimated_count is None or estimated_count < self.estimate_threshold:
+      return None
+    return estimated_count
+
+
+class AnalysisPagination(CountingLimitOffsetPagination):
+  '''Analysis limit/offset pagination'''
+  live_estimate_index = 'analysis_live_created_idx'
+
+  @staticmethod
+  def get_live_queryset(model):
+    '''The live analysis indexes only cover the non archived analyses'''
+    return model.objects.live().filter(archived_on__isnull=True)
+
+def bump_count_version(model):
+  '''Drop cached counts of a model'''
+  key = COUNT_VERSION_KEY.format(model._meta.label_lower)
+  if not cache.add(key, 1, timeout=None):
+    try:
+      cache.incr(key)
+    except ValueError:
+      cache.set(key, 1, timeout=None)
+
+# hooks
+def hook_invalidate_analysis_counts(sender, **kwargs): # pylint: disable=unused-argument
+  '''Hook to drop cached analysis counts on writes'''
+  bump_count_version(Analysis)
+
+def hook_invalidate_sample_counts(sender, **kwargs): # pylint: disable=unused-argument
+  '''Hook to drop cached sample counts on writes'''
+  bump_count_version(Sample)
+
+post_save.connect(hook_invalidate_analysis_counts, sender=Analysis)
+post_delete.connect(hook_invalidate_analysis_counts, sender=Analysis)
+m2m_changed.connect(hook_invalidate_analysis_counts, sender=Analysis.controls.through)
+m2m_changed.connect(hook_invalidate_analysis_counts, sender=Analysis.projects.through)
+m2m_changed.connect(hook_invalidate_analysis_counts, sender=Analysis.samples.through)
+post_save.connect(hook_invalidate_sample_counts, sender=Sample)
+post_delete.connect(hook_invalidate_sample_counts, sender=Sample)
+m2m_changed.connect(hook_invalidate_sample_counts, sender=Sample.projects.through)
@@ -115,4 +115,18 @@ class SamplePermission(BasePermission):
     projects = Project.objects.filter(pk__in=projects_ids) or [user.active_project]
     return BasePermission.has_auth_on_all_objs(
       ['edit', 'admin'], user, projects
-    )
\ No newline at end of file
+    )
+
+
+class InstancePermission(BasePermission):
+  '''Instance permission, instances are read only and visible to their owner'''
+
+  def has_permission(self, request, view):
+    '''Instances are written by the worker fleet, not through the API'''
+    return request.method.lower() in ['get', 'options'] \
+      and super().has_permission(request, view)
+
+  def _get(self, request, user, obj):  # pylint: disable=no-self-use
+    '''read detail access'''
+    return obj.owner_id == user.id
+
@@ -0,0 +1,250 @@
+'''Permission decision cache'''
+
+# Lib imports
+import threading
+import uuid
+from collections import Counter
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from guardian import shortcuts
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+# App imports
+from bpapp.models import Analysis, BpUser, Project, Sample
+
+class PermissionCache:
+  '''Cross-request cache of object permission decisions
+
+  Keys are (permission class, user, model, object id, action, object owner)
+  plus two version tokens:
+
+  - the object token, replaced when a guardian perm on the object or its
+    project links change, or when one of its projects changes owner,
+    visibility or is deleted
+  - the user token, replaced when the user's project perms or groups change
+
+  Tokens are replaced once the transaction commits, so a decision computed
+  from uncommitted state is never stored under a current token.
+  '''
+
+  CACHEABLE_ACTIONS = ('get', 'patch', 'put', 'delete')
+  OBJECT_VERSION_KEY = 'permission_cache:version:{}:{}'
+  TIMEOUT = 60 * 60
+  USER_VERSION_KEY = 'permission_cache:version:user:{}'
+
+  _metrics = Counter()
+  _metrics_lock = threading.Lock()
+
+  @staticmethod
+  def _get_tokens(keys):
+    '''Current token of each version key, created when missing'''
+    tokens = cache.get_many(keys)
+    for key in keys:
+      if key not in tokens:
+        token = uuid.uuid4().hex
+        tokens[key] = token if cache.add(key, token, timeout=None) else cache.get(key, token)
+    return [tokens[key] for key in keys]
+
+  @staticmethod
+  def get_object_version_key(label, pk):
+    '''Version key of an object'''
+    return PermissionCache.OBJECT_VERSION_KEY.format(label, pk)
+
+  @staticmethod
+  def get_versions(user_id, label, pk):
+    '''(object token, user token) of a decision'''
+    return PermissionCache._get_tokens([
+      PermissionCache.get_object_version_key(label, pk),
+      PermissionCache.USER_VERSION_KEY.format(user_id),
+    ])
+
+  @staticmethod
+  def bump_objects(label, pks):
+    '''Invalidate the decisions on objects, once the transaction commits'''
+    PermissionCache._bump([PermissionCache.get_object_version_key(label, pk) for pk in pks])
+
+  @staticmethod
+  def bump_users(user_ids):
+    '''Invalidate the decisions of users, once the transaction commits'''
+    PermissionCache._bump([PermissionCache.USER_VERSION_KEY.format(user_id) for user_id in user_ids])
+
+  @staticmethod
+  def _bump(keys):
+    '''Replace the tokens of version keys on commit'''
+    keys = list(dict.fromkeys(keys))
+    if keys:
+      transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None))
+
+  @staticmethod
+  def get_key(permission, user, obj, action):
+    '''Cache key for a decision'''
+    label = obj._meta.label_lower
+    object_version, user_version = PermissionCache.get_versions(user.pk, label, obj.pk)
+    return 'permission_cache:{}:{}:{}:{}:{}:{}:{}:{}'.format(
+      type(permission).__name__,
+      user.pk,
+      label,
+      obj.pk,
+      action,
+      getattr(obj, 'owner_id', None),
+      object_version,
+      user_version,
+    )
+
+  @staticmethod
+  def get_or_compute(permission, user, obj, action, compute):
+    '''Return the cached decision or compute and store it'''
+    if action not in PermissionCache.CACHEABLE_ACTIONS or not user.pk or not obj.pk:
+      return compute()
+
+    key = PermissionCache.get_key(permission, user, obj, action)
+    decision = cache.get(key)
+    if decision is not None:
+      PermissionCache._incr_metric('hits')
+      return decision
+
+    PermissionCache._incr_metric('misses')
+    decision = bool(compute())
+    cache.set(key, decision, timeout=PermissionCache.TIMEOUT)
+    return decision
+
+  @staticmethod
+  def get_metrics():
+    '''Hit/miss counters of this process'''
+    with PermissionCache._metrics_lock:
+      metrics = {name: PermissionCache._metrics[name] for name in ['hits', 'misses']}
+    total = metrics['hits'] + metrics['misses']
+    metrics['hit_ratio'] = metrics['hits'] / total if total else 0.0
+    return metrics
+
+  @staticmethod
+  def reset_metrics():
+    '''Reset hit/miss counters'''
+    with PermissionCache._metrics_lock:
+      PermissionCache._metrics.clear()
+
+  @staticmethod
+  def _incr_metric(name):
+    '''Increment a metric counter, in process: no cache round trip per check'''
+    with PermissionCache._metrics_lock:
+      PermissionCache._metrics[name] += 1
+
+
+def _get_pks(obj):
+  '''Model label and primary keys of an object, a list or a queryset of objects'''
+  if isinstance(obj, QuerySet):
+    return obj.model._meta.label_lower, list(obj.values_list('pk', flat=True))
+  objs = obj if isinstance(obj, (list, tuple, set)) else [obj]
+  objs = [item for item in objs if item is not None]
+  return (objs[0]._meta.label_lower, [item.pk for item in objs]) if objs else (None, [])
+
+def _get_user_ids(user_or_group):
+  '''Users affected by a perm change of a user or a group'''
+  if isinstance(user_or_group, Group):
+    return list(user_or_group.user_set.values_list('pk', flat=True))
+  return [user_or_group.pk] if user_or_group is not None and user_or_group.pk else []
+
+def invalidate_perm_change(user_or_group, label, pks):
+  '''Invalidate the decisions a guardian perm change can affect
+
+  Perms on a project change what its members can do with the project samples
+  and analyses, so they invalidate the user(s) instead of the objects only.
+  '''
+  if label is None:
+    PermissionCache.bump_users(_get_user_ids(user_or_group))
+    return
+  PermissionCache.bump_objects(label, pks)
+  if label == Project._meta.label_lower:
+    PermissionCache.bump_users(_get_user_ids(user_or_group))
+
+def assign_perm(perm, user_or_group, obj=None):
+  '''guardian `assign_perm`, covering its bulk path (bulk_create sends no post_save)'''
+  result = shortcuts.assign_perm(perm, user_or_group, obj)
+  invalidate_perm_change(user_or_group, *_get_pks(obj))
+  return result
+
+def remove_perm(perm, user_or_group, obj=None):
+  '''guardian `remove_perm`, covering its bulk path'''
+  label, pks = _get_pks(obj)
+  result = shortcuts.remove_perm(perm, user_or_group, obj)
+  invalidate_perm_change(user_or_group, label, pks)
+  return result
+
+def _get_project_state(project_id):
+  '''Project fields permission decisions depend on'''
+  return Project.objects.filter(pk=project_id).values('deleted_on', 'owner_id', 'visibility').first()
+
+def _bump_project_members(project_ids):
+  '''Invalidate the decisions on projects and on their analyses and samples'''
+  project_ids = list(project_ids)
+  PermissionCache.bump_objects(Project._meta.label_lower, project_ids)
+  for model in [Analysis, Sample]:
+    PermissionCache.bump_objects(
+      model._meta.label_lower,
+      model.projects.through.objects.filter(project_id__in=project_ids).values_list(
+        f'{model._meta.model_name}_id', flat=True
+      ),
+    )
+
+# hooks
+def hook_invalidate_object_perm(sender, instance, **kwargs): # pylint: disable=unused-argument
+  '''Hook to invalidate decisions on a guardian perm save/delete'''
+  model = instance.content_type.model_class()
+  user_or_group = getattr(instance, 'user', None) if sender is UserObjectPermission else instance.group
+  invalidate_perm_change(user_or_group, model and model._meta.label_lower, [instance.object_pk])
+
+def hook_invalidate_project_links(sender, instance, action, reverse, model, pk_set, **kwargs): # pylint: disable=unused-argument, too-many-arguments
+  '''Hook to invalidate decisions on objects added to / removed from projects'''
+  if action not in ['post_add', 'post_remove', 'pre_clear']:
+    return
+  if not reverse:
+    PermissionCache.bump_objects(instance._meta.label_lower, [instance.pk])
+    return
+  # project side: pk_set holds the analyses/samples, a clear affects all of them
+  if action == 'pre_clear':
+    object_field = f'{model._meta.model_name}_id'
+    pk_set = sender.objects.filter(project_id=instance.pk).values_list(object_field, flat=True)
+  PermissionCache.bump_objects(model._meta.label_lower, pk_set or [])
+
+def hook_track_project_state(sender, instance, **kwargs): # pylint: disable=unused-argument
+  '''Hook to remember the stored owner/visibility/deleted_on of a project before it is saved'''
+  instance._permission_state = _get_project_state(instance.pk) if instance.pk else None # pylint: disable=protected-access
+
+def hook_invalidate_project_state(sender, instance, created=False, **kwargs): # pylint: disable=unused-argument
+  '''Hook to invalidate decisions when a project owner, visibility or deletion changes'''
+  previous = getattr(instance, '_permission_state', None)
+  if created or previous is None:
+    return
+  current = {'deleted_on': instance.deleted_on, 'owner_id': instance.owner_id, 'visibility': instance.visibility}
+  if current != previous:
+    _bump_project_members([instance.pk])
+
+def hook_invalidate_deleted_project(sender, instance, **kwargs): # pylint: disable=unused-argument
+  '''Hook to invalidate decisions on the members of a deleted project'''
+  _bump_project_members([instance.pk])
+
+def hook_invalidate_user_groups(sender, instance, action, reverse, pk_set, **kwargs): # pylint: disable=unused-argument
+  '''Hook to invalidate the decisions of users joining or leaving groups'''
+  if action not in ['post_add', 'post_remove', 'pre_clear']:
+    return
+  if not reverse:
+    PermissionCache.bump_users([instance.pk])
+  elif action == 'pre_clear':
+    PermissionCache.bump_users(instance.user_set.values_list('pk', flat=True))
+  else:
+    PermissionCache.bump_users(pk_set or [])
+
+post_save.connect(hook_invalidate_object_perm, sender=UserObjectPermission)
+post_delete.connect(hook_invalidate_object_perm, sender=UserObjectPermission)
+post_save.connect(hook_invalidate_object_perm, sender=GroupObjectPermission)
+post_delete.connect(hook_invalidate_object_perm, sender=GroupObjectPermission)
+pre_save.connect(hook_track_project_state, sender=Project)
+post_save.connect(hook_invalidate_project_state, sender=Project)
+pre_delete.connect(hook_invalidate_deleted_project, sender=Project)
+m2m_changed.connect(hook_invalidate_project_links, sender=Analysis.projects.through)
+m2m_changed.connect(hook_invalidate_project_links, sender=Sample.projects.through)
+m2m_changed.connect(hook_invalidate_user_groups, sender=BpUser.groups.through)
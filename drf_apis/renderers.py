@@ -0,0 +1,120 @@
+'''Fast JSON renderer and parser'''
+
+# Lib imports
+import uuid
+
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+  import orjson
+except ImportError:  # stdlib json is used instead
+  orjson = None
+
+# orjson >= 3.9 can embed pre-serialized json
+HAS_ORJSON_FRAGMENT = orjson is not None and hasattr(orjson, 'Fragment')
+
+class RawJSON(str):
+  '''Pre-serialized JSON document, rendered as-is'''
+
+
+class RawJSONField(serializers.JSONField):
+  '''JSONField rendered from the raw column text when the queryset annotated `<source>_raw`
+
+  The json column is then passed through without being decoded and re-encoded.
+  '''
+
+  def get_attribute(self, instance):
+    raw_attr = f'{self.source}_raw'
+    if raw_attr in instance.__dict__:
+      raw = instance.__dict__[raw_attr]
+      return None if raw is None else RawJSON(raw)
+    return super().get_attribute(instance)
+
+  def to_representation(self, value):
+    if isinstance(value, RawJSON):
+      return value
+    return super().to_representation(value)
+
+
+def _orjson_default(obj):
+  '''orjson fallback for the types it doesn't serialize natively'''
+  if isinstance(obj, RawJSON):
+    return orjson.Fragment(str(obj))
+  if isinstance(obj, str):
+    return str(obj)
+  if isinstance(obj, dict):
+    return dict(obj)
+  if isinstance(obj, (list, tuple)):
+    return list(obj)
+  if isinstance(obj, int):
+    return int(obj)
+  if isinstance(obj, float):
+    return float(obj)
+  return encoders.JSONEncoder().default(obj)
+
+
+def _replace_raw(data, raw_values, token):
+  '''Replace RawJSON values by placeholders for the stdlib encoder'''
+  if isinstance(data, RawJSON):
+    raw_values.append(str(data))
+    return f'{token}{len(raw_values) - 1}'
+  if isinstance(data, dict):
+    return {key: _replace_raw(value, raw_values, token) for key, value in data.items()}
+  if isinstance(data, (list, tuple)):
+    return [_replace_raw(value, raw_values, token) for value in data]
+  return data
+
+
+class FastJSONRenderer(JSONRenderer):
+  '''JSONRenderer using orjson when installed, passing RawJSON values through unchanged'''
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    if data is None:
+      return b''
+
+    renderer_context = renderer_context or {}
+    indent = self.get_indent(accepted_media_type, renderer_context)
+
+    if HAS_ORJSON_FRAGMENT and indent is None:
+      return orjson.dumps(
+        data,
+        default=_orjson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_SUBCLASS,
+      )
+
+    # stdlib: raw values are swapped for placeholders and spliced back in after encoding
+    raw_values = []
+    token = f'__raw_json_{uuid.uuid4().hex}_'
+    data = _replace_raw(data, raw_values, token)
+    rendered = super().render(data, accepted_media_type, renderer_context)
+    if raw_values:
+      rendered = rendered.decode('utf-8')
+      for index in range(len(raw_values) - 1, -1, -1):
+        rendered = rendered.replace(f'"{token}{index}"', raw_values[index])
+      rendered = rendered.encode('utf-8')
+    return rendered
+
+
+class FastJSONParser(JSONParser):
+  '''JSONParser using orjson when installed'''
+  renderer_class = FastJSONRenderer
+
+  def parse(self, stream, media_type=None, parser_context=None):
+    if orjson is None:
+      return super().parse(stream, media_type, parser_context)
+
+    parser_context = parser_context or {}
+    encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+    try:
+      content = stream.read()
+      if encoding.lower() not in ['utf-8', 'utf8']:
+        content = content.decode(encoding).encode('utf-8')
+      return orjson.loads(content)
+    except (ValueError, UnicodeDecodeError) as error:
+      raise ParseError(f'JSON parse error - {error}') from error
+
@@ -1,7 +1,7 @@
 
 class BaseSerializer(serializers.ModelSerializer):
   '''Base serializer'''
-  resource_uri = serializers.SerializerMethodField()
+  resource_uri = InstrumentedMethodField()
 
   def get_resource_uri(self, obj):
     '''reverse viewset detail to get resource_uri'''
@@ -38,11 +38,48 @@ class HostSerializer(BaseSerializer):
     fields = '__all__'
 
 
+class BulkManyRelatedField(serializers.ManyRelatedField):
+  '''ManyRelatedField resolving all its primary keys with a single `pk__in` query'''
+
+  def to_internal_value(self, data):
+    if isinstance(data, str) or not hasattr(data, '__iter__'):
+      self.fail('not_a_list', input_type=type(data).__name__)
+    if not self.allow_empty and len(data) == 0:
+      self.fail('empty')
+
+    pks = list(data)
+    try:
+      objs = {str(obj.pk): obj for obj in self.child_relation.get_queryset().filter(pk__in=pks)}
+    except (TypeError, ValueError):
+      self.child_relation.fail('incorrect_type', data_type=type(pks[0]).__name__)
+    for pk in pks:
+      if str(pk) not in objs:
+        self.child_relation.fail('does_not_exist', pk_value=pk)
+    return [objs[str(pk)] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+  '''PrimaryKeyRelatedField whose `many=True` form is a BulkManyRelatedField'''
+
+  @classmethod
+  def many_init(cls, *args, **kwargs):
+    list_kwargs = {key: value for key, value in kwargs.items() if key in MANY_RELATION_KWARGS}
+    return BulkManyRelatedField(child_relation=cls(*args, **kwargs), **list_kwargs)
+
+
 class AnalysisSerializer(BaseSerializer):
   '''Analysis serializer class'''
+  # samples/controls/projects are resolved with one query each, not one per pk
+  serializer_related_field = BulkPrimaryKeyRelatedField
+
+  # large json columns, passed through pre-serialized when the queryset annotates them
+  app_data = RawJSONField(allow_null=True, required=False)
+  params = RawJSONField(allow_null=True, required=False)
+  user_params = RawJSONField(allow_null=True, required=False)
+  workflow_data = RawJSONField(allow_null=True, required=False)
   owner__username = serializers.ReadOnlyField(source='owner.username', default='')
-  permission = serializers.SerializerMethodField()
-  log = serializers.SerializerMethodField()
+  permission = InstrumentedMethodField()
+  log = InstrumentedMethodField()
 
   def get_permission(self, obj):
     '''Populate `permission` field'''
@@ -84,8 +121,8 @@ class SampleSerializer(BaseSerializer):
   owner_fullname = serializers.ReadOnlyField(source='owner.name', default='')
   genome_name = serializers.ReadOnlyField(source='genome.name', default='')
   spike_in_name = serializers.ReadOnlyField(source='spike_in.name', default='')
-  meta = serializers.SerializerMethodField()
-  permission = serializers.SerializerMethodField()
+  meta = InstrumentedMethodField()
+  permission = InstrumentedMethodField()
 
   def get_meta(self, obj):
     '''Populate `meta` field'''
@@ -105,10 +142,19 @@ class SampleSerializer(BaseSerializer):
     model = SampleModel
     fields = '__all__'
 
+class InstanceSerializer(BaseSerializer):
+  '''Instance serializer class'''
+  time_to_boot = serializers.ReadOnlyField()
+  time_to_run_analysis = serializers.ReadOnlyField()
+
+  class Meta:
+    model = Instance
+    fields = '__all__'
+
 class FileSerializer(BaseSerializer):
   '''File serializer class'''
-  analysis_id = serializers.SerializerMethodField()
-  analysis_name = serializers.SerializerMethodField()
+  analysis_id = InstrumentedMethodField()
+  analysis_name = InstrumentedMethodField()
 
   def get_analysis_id(self, obj):
     '''Populate `analysis_id` field'''
@@ -124,11 +170,11 @@ class FileSerializer(BaseSerializer):
       host = analysis.host or Host.get_host_by_domain(api_cfg.get('host', ''))
       storage_cfg = (host.config or {}).get('storage', {}).get('user', {})
       storage_settings = storage_cfg.get('settings', {})
-      storage = S3({
+      storage = instrument_client(S3({
         'bucket': storage_settings.get('bucket'),
         'credentials': storage_cfg.get('credentials'),
         'region': storage_settings.get('region'),
-      })
+      }), 's3')
       session_credential = storage.get_credentials()
       if obj.path and obj.is_url_expired(session_credential):
         result = storage.get_self_signed(obj.path, 28800)  # 8hs
@@ -0,0 +1,25 @@
+'''Background tasks'''
+
+# Lib imports
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, transaction
+
+LOG = logging.getLogger(__name__)
+
+# small bounded pool: tasks are short cleanups queued once their request commits
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='drf-apis-task')
+
+def _run_task(func, args, kwargs):
+  '''Run a task, logging errors and closing the thread's db connection'''
+  try:
+    func(*args, **kwargs)
+  except Exception as error: # pylint: disable=broad-except
+    LOG.error(f'tasks.run_in_background: {getattr(func, "__qualname__", func)} failed - {error}')
+  finally:
+    connection.close()
+
+def run_in_background(func, *args, **kwargs):
+  '''Run func in a background thread once the current transaction commits'''
+  transaction.on_commit(lambda: _EXECUTOR.submit(_run_task, func, args, kwargs))
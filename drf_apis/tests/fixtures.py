@@ -0,0 +1,56 @@
+'''Test fixtures'''
+
+# Lib imports
+import itertools
+
+# App imports
+from bpapp.models import Analysis, BpUser, Host, Project, Sample, Workflow
+
+_COUNTER = itertools.count()
+
+def create_user(**kwargs):
+  '''User with a unique username/email'''
+  index = next(_COUNTER)
+  return BpUser.objects.create(**{
+    'email': f'user-{index}@example.com',
+    'username': f'user-{index}',
+    **kwargs,
+  })
+
+def create_host(domain='testserver'):
+  '''Host of the test client domain'''
+  host, _ = Host.objects.get_or_create(domain=domain, defaults={'config': {}, 'name': 'test'})
+  return host
+
+def create_workflow(**kwargs):
+  '''Workflow'''
+  return Workflow.objects.create(**{'name': f'pipeline-{next(_COUNTER)}', **kwargs})
+
+def create_project(owner, **kwargs):
+  '''Project of owner, private by default'''
+  return Project.objects.create(**{
+    'name': f'project-{next(_COUNTER)}',
+    'owner': owner,
+    'visibility': 'private',
+    **kwargs,
+  })
+
+def create_sample(owner, projects=(), **kwargs):
+  '''Sample of owner linked to projects'''
+  sample = Sample.objects.create(**{'name': f'sample-{next(_COUNTER)}', 'owner': owner, **kwargs})
+  if projects:
+    sample.projects.add(*projects)
+  return sample
+
+def create_analysis(owner, projects=(), workflow=None, **kwargs):
+  '''Analysis of owner linked to projects'''
+  analysis = Analysis.objects.create(**{
+    'name': f'analysis-{next(_COUNTER)}',
+    'owner': owner,
+    'status': 'completed',
+    'workflow': workflow or create_workflow(),
+    **kwargs,
+  })
+  if projects:
+    analysis.projects.add(*projects)
+  return analysis
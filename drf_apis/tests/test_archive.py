@@ -0,0 +1,58 @@
+'''Analysis archive tests: archived analyses are restored before any detail action'''
+
+# Lib imports
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+# App imports
+from bpapp.api3.resources.api_views import AnalysisViewSet
+from bpapp.api3.resources.tests.fixtures import create_analysis, create_user
+from bpapp.models import Analysis, AnalysisArchive
+
+PARAMS = {'node': {'index_genome': {'index_genome_id': 7}}}
+
+
+class AnalysisArchiveTest(TestCase):
+  '''Archive / rehydrate of analyses'''
+
+  def setUp(self):
+    self.owner = create_user()
+    self.analysis = create_analysis(self.owner, params=PARAMS)
+    AnalysisArchive.archive(Analysis.objects.filter(pk=self.analysis.pk))
+
+  def get_object(self, action, method):
+    '''`get_object()` of the analysis viewset for a detail action'''
+    request = Request(getattr(APIRequestFactory(), method)('/'))
+    request.user = self.owner
+    view = AnalysisViewSet(action=action, format_kwarg=None, kwargs={'pk': self.analysis.pk}, request=request)
+    return view.get_object()
+
+  def assert_restored(self, obj):
+    '''The analysis and its json columns are back in the hot table'''
+    self.assertIsNone(obj.archived_on)
+    self.assertEqual(obj.params, PARAMS)
+    self.assertFalse(AnalysisArchive.objects.filter(analysis_id=self.analysis.pk).exists())
+
+  def test_archive(self):
+    analysis = Analysis.objects.get(pk=self.analysis.pk)
+    self.assertIsNotNone(analysis.archived_on)
+    self.assertIsNone(analysis.params)
+    self.assertEqual(analysis.index_genome_id, '7')
+
+  def test_detail_actions_rehydrate(self):
+    for action, method in [
+        ('destroy', 'delete'),
+        ('partial_update', 'patch'),
+        ('retrieve', 'get'),
+        ('update', 'put'),
+    ]:
+      with self.subTest(action=action):
+        self.assert_restored(self.get_object(action, method))
+        AnalysisArchive.archive(Analysis.objects.filter(pk=self.analysis.pk))
+
+  def test_archived_save_keeps_index_genome_id(self):
+    analysis = Analysis.objects.get(pk=self.analysis.pk)
+    analysis.name = 'renamed'
+    analysis.save()
+    self.assertEqual(Analysis.objects.get(pk=self.analysis.pk).index_genome_id, '7')
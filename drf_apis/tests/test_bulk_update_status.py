@@ -0,0 +1,74 @@
+'''Bulk analysis status update tests'''
+
+# Lib imports
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+# App imports
+from bpapp.api3.resources.api_views import AnalysisViewSet
+from bpapp.api3.resources.tests.fixtures import create_analysis, create_user
+from bpapp.models import Analysis
+
+
+class BulkUpdateStatusTest(TestCase):
+  '''POST /analyses/status/'''
+
+  def setUp(self):
+    self.owner = create_user()
+    self.analysis = create_analysis(self.owner, status='running')
+
+  def post(self, analyses):
+    '''Response of a bulk status update by the owner'''
+    request = APIRequestFactory().post('/analyses/status/', {'analyses': analyses}, format='json')
+    force_authenticate(request, user=self.owner)
+    return AnalysisViewSet.as_view({'post': 'bulk_update_status'})(request)
+
+  def test_invalid_rows(self):
+    for row in [
+        {'filesize': 'big'},
+        {'filesize': -1},
+        {'started_on': 'yesterday'},
+        {'started_on': '2021-02-30T10:00:00Z'},
+        {'completed_on': 12},
+        {'status': 'done'},
+        {'status': 'not-running'},
+        {'status': None},
+        {'completed_on': '2021-01-01T00:00:00Z', 'started_on': '2021-01-02T00:00:00Z'},
+    ]:
+      with self.subTest(row=row):
+        response = self.post([{'id': self.analysis.pk, **row}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['id'], str(self.analysis.pk))
+    self.assertEqual(Analysis.objects.get(pk=self.analysis.pk).status, 'running')
+
+  def test_status_hooks_on_commit(self):
+    with mock.patch('bpapp.models.hook_send_notification') as send_notification, \
+        mock.patch('bpapp.api3.resources.events.hook_publish_status_event') as publish_status_event:
+      with self.captureOnCommitCallbacks(execute=False) as callbacks:
+        response = self.post([{'id': self.analysis.pk, 'filesize': '10', 'status': 'completed'}])
+      send_notification.assert_not_called()
+      for callback in callbacks:
+        callback()
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data['status_changed'], [self.analysis.pk])
+    send_notification.assert_called_once()
+    publish_status_event.assert_called_once()
+
+    analysis = Analysis.objects.get(pk=self.analysis.pk)
+    self.assertEqual((analysis.status, analysis.filesize), ('completed', 10))
+
+  def test_suffixed_running_status(self):
+    with self.captureOnCommitCallbacks(execute=True):
+      response = self.post([{'id': self.analysis.pk, 'status': 'running-alignment'}])
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(Analysis.objects.get(pk=self.analysis.pk).status, 'running-alignment')
+
+  def test_no_hooks_without_status_change(self):
+    with mock.patch('bpapp.models.hook_send_notification') as send_notification:
+      with self.captureOnCommitCallbacks(execute=True):
+        response = self.post([{'id': self.analysis.pk, 'filesize': 10}])
+    self.assertEqual(response.data['status_changed'], [])
+    send_notification.assert_not_called()
@@ -0,0 +1,43 @@
+'''Response compression tests'''
+
+# Lib imports
+import gzip
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+# App imports
+from bpapp.api3.resources.compression import CompressionMiddleware
+
+BODY = b'{"results": [' + b'{"name": "analysis"},' * 200 + b'{}]}'
+
+
+class CompressionMiddlewareTest(SimpleTestCase):
+  '''gzip negotiation and BREACH mitigation'''
+
+  def compress(self, response, accept_encoding='gzip, br'):
+    '''Response of the middleware'''
+    request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+    return CompressionMiddleware(lambda request: response)(request)
+
+  def test_gzip_with_random_padding(self):
+    first = self.compress(HttpResponse(BODY, content_type='application/json'))
+    second = self.compress(HttpResponse(BODY, content_type='application/json'))
+    self.assertEqual(first['Content-Encoding'], 'gzip')
+    self.assertEqual(gzip.decompress(first.content), BODY)
+    self.assertEqual(gzip.decompress(second.content), BODY)
+    # compressed lengths vary from response to response
+    lengths = {len(self.compress(HttpResponse(BODY, content_type='application/json')).content) for _ in range(20)}
+    self.assertGreater(len(lengths), 1)
+
+  def test_small_bodies_and_event_streams(self):
+    small = self.compress(HttpResponse(b'{}', content_type='application/json'))
+    self.assertFalse(small.has_header('Content-Encoding'))
+    self.assertIn('Accept-Encoding', small['Vary'])
+
+    events = self.compress(StreamingHttpResponse(iter([b'data: {}\n\n']), content_type='text/event-stream'))
+    self.assertFalse(events.has_header('Content-Encoding'))
+
+  def test_identity(self):
+    response = self.compress(HttpResponse(BODY, content_type='application/json'), accept_encoding='identity')
+    self.assertEqual(response.content, BODY)
@@ -0,0 +1,39 @@
+'''Analysis conditional GET tests'''
+
+# Lib imports
+from unittest import mock
+
+from django.test import TestCase
+from django.utils.http import http_date
+from rest_framework.test import APIRequestFactory
+
+# App imports
+from bpapp.api3.resources.conditional import (
+  SIGNED_URL_REFRESH_INTERVAL, get_analysis_validators, is_not_modified
+)
+from bpapp.api3.resources.tests.fixtures import create_analysis, create_user
+from bpapp.models import File
+
+
+class AnalysisValidatorsTest(TestCase):
+  '''ETag / Last-Modified of signed file urls'''
+
+  def setUp(self):
+    self.owner = create_user()
+    self.analysis = create_analysis(self.owner)
+    File.objects.create(analysis=self.analysis, owner=self.owner, path='out/report.html')
+
+  def is_not_modified(self, signed_urls, now):
+    '''Whether a poll made before the next url refresh is still fresh at `now`'''
+    with mock.patch('time.time', return_value=now - SIGNED_URL_REFRESH_INTERVAL):
+      etag, last_modified = get_analysis_validators(self.analysis.pk, self.owner, signed_urls=signed_urls)
+    request = APIRequestFactory().get('/', HTTP_IF_MODIFIED_SINCE=http_date(last_modified + 1))
+    with mock.patch('time.time', return_value=now):
+      etag, last_modified = get_analysis_validators(self.analysis.pk, self.owner, signed_urls=signed_urls)
+    return is_not_modified(request, etag, last_modified)
+
+  def test_if_modified_since_follows_url_refresh(self):
+    self.assertFalse(self.is_not_modified(True, self.analysis.last_updated.timestamp() + 10 * SIGNED_URL_REFRESH_INTERVAL))
+
+  def test_if_modified_since_without_signing(self):
+    self.assertTrue(self.is_not_modified(False, self.analysis.last_updated.timestamp() + 10 * SIGNED_URL_REFRESH_INTERVAL))
@@ -0,0 +1,62 @@
+'''Analysis create tests'''
+
+# Lib imports
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+# App imports
+from bpapp.api3.resources.api_views import AnalysisViewSet
+from bpapp.api3.resources.tests.fixtures import (
+  create_host, create_project, create_sample, create_user, create_workflow
+)
+from bpapp.models import Analysis
+
+# queries of one create, pipeline validation aside: the request measured ~15 before
+# the single-write create, the budget fails as soon as a create costs that again
+CREATE_QUERY_BUDGET = 14
+
+
+class AnalysisCreateQueryBudgetTest(TestCase):
+  '''Query count of POST /analyses/'''
+
+  def setUp(self):
+    create_host()
+    self.owner = create_user()
+    self.project = create_project(self.owner)
+    self.workflow = create_workflow()
+
+  def count_create_queries(self, samples):
+    '''Queries of an analysis create with samples, the analysis is checked too'''
+    request = APIRequestFactory().post('/analyses/', {
+      'meta': {'source': 'web'},
+      'name': 'budget',
+      'params': {},
+      'projects': [self.project.pk],
+      'samples': [sample.pk for sample in samples],
+      'workflow': self.workflow.pk,
+    }, format='json')
+    force_authenticate(request, user=self.owner)
+
+    # validation runs the pipeline validator, its queries are not part of the create path
+    with mock.patch('bpapp.api3.resources.api_views.validate', return_value={}), \
+        CaptureQueriesContext(connection) as captured:
+      response = AnalysisViewSet.as_view({'post': 'create'})(request)
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    analysis = Analysis.objects.latest('pk')
+    self.assertEqual(set(analysis.samples.values_list('pk', flat=True)), {sample.pk for sample in samples})
+    return len(captured.captured_queries)
+
+  def test_within_budget(self):
+    self.assertLessEqual(self.count_create_queries([create_sample(self.owner)]), CREATE_QUERY_BUDGET)
+
+  def test_independent_of_sample_count(self):
+    # sample pks are resolved with one `pk__in` query and linked with one bulk insert
+    one = self.count_create_queries([create_sample(self.owner)])
+    many = self.count_create_queries([create_sample(self.owner) for _ in range(10)])
+    self.assertEqual(one, many)
@@ -0,0 +1,25 @@
+'''Analysis event stream tests'''
+
+# Lib imports
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+# App imports
+from bpapp.api3.resources.events import get_broker, get_user_channel, stream_user_events
+
+
+class StreamUserEventsTest(SimpleTestCase):
+  '''Server-sent events of a user'''
+
+  def test_events_and_heartbeats(self):
+    stream = stream_user_events(SimpleNamespace(pk=1), heartbeat_interval=0.01)
+    self.assertEqual(next(stream), 'retry: 5000\n\n')
+    get_broker().publish(get_user_channel(1), {'type': 'status', 'data': {'id': 2}})
+    self.assertEqual(next(stream), 'event: status\ndata: {"id": 2}\n\n')
+    self.assertEqual(next(stream), ': heartbeat\n\n')
+    stream.close()
+
+  def test_ends_after_max_duration(self):
+    stream = stream_user_events(SimpleNamespace(pk=1), heartbeat_interval=0.01, max_duration=0.05)
+    self.assertEqual(list(stream)[0], 'retry: 5000\n\n')
@@ -0,0 +1,80 @@
+'''Idempotency and in-flight analysis lock tests'''
+
+# Lib imports
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+# App imports
+from bpapp.api3.resources.idempotency import acquire_analysis_lock, hold_analysis_locks, idempotent
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class StatusView:
+  '''View answering with the next status of `statuses`'''
+
+  def __init__(self, *statuses):
+    self.statuses = list(statuses)
+    self.calls = 0
+
+  @idempotent
+  def post(self, request):  # pylint: disable=unused-argument
+    '''Next status'''
+    self.calls += 1
+    return Response({'call': self.calls}, status=self.statuses.pop(0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IdempotentTest(TestCase):
+  '''Idempotency-Key replays'''
+
+  def setUp(self):
+    cache.clear()
+
+  @staticmethod
+  def build_request():
+    '''Request with an Idempotency-Key'''
+    request = APIRequestFactory().post('/', HTTP_IDEMPOTENCY_KEY='key')
+    request.user = SimpleNamespace(pk=1)
+    return request
+
+  def test_success_is_replayed(self):
+    view = StatusView(status.HTTP_200_OK, status.HTTP_200_OK)
+    self.assertEqual(view.post(self.build_request()).data, {'call': 1})
+    self.assertEqual(view.post(self.build_request()).data, {'call': 1})
+    self.assertEqual(view.calls, 1)
+
+  def test_error_is_not_replayed(self):
+    view = StatusView(status.HTTP_409_CONFLICT, status.HTTP_200_OK)
+    self.assertEqual(view.post(self.build_request()).status_code, status.HTTP_409_CONFLICT)
+    self.assertEqual(view.post(self.build_request()).status_code, status.HTTP_200_OK)
+    self.assertEqual(view.calls, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AnalysisLockTest(TestCase):
+  '''Per-analysis in-flight locks'''
+
+  def setUp(self):
+    cache.clear()
+
+  def test_released_on_commit(self):
+    with self.captureOnCommitCallbacks(execute=True):
+      self.assertTrue(acquire_analysis_lock('terminate', 1))
+      with hold_analysis_locks('terminate', [1]):
+        pass
+      # a duplicate of the in-flight request collapses into it
+      self.assertFalse(acquire_analysis_lock('terminate', 1))
+    self.assertTrue(acquire_analysis_lock('terminate', 1))
+
+  def test_released_on_error(self):
+    self.assertTrue(acquire_analysis_lock('re_analyze', 1))
+    with self.assertRaises(ValueError):
+      with hold_analysis_locks('re_analyze', [1]):
+        raise ValueError()
+    self.assertTrue(acquire_analysis_lock('re_analyze', 1))
@@ -0,0 +1,50 @@
+'''Request instrumentation tests'''
+
+# Lib imports
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+# App imports
+from bpapp.api3.resources.instrumentation import (
+  _CURRENT, UNRESOLVED_ENDPOINT, PrometheusSink, RequestMetrics, record_outbound
+)
+
+
+class RequestMetricsTest(SimpleTestCase):
+  '''Endpoint labels and outbound calls of worker threads'''
+
+  def test_unresolved_endpoint(self):
+    metrics = RequestMetrics('GET', '/api/v3/unknown/123/')
+    self.assertEqual(metrics.endpoint, UNRESOLVED_ENDPOINT)
+    self.assertEqual(metrics.as_dict()['path'], '/api/v3/unknown/123/')
+
+  def test_outbound_from_copied_context(self):
+    metrics = RequestMetrics('POST', '/analyses/bulk_terminate/')
+    token = _CURRENT.set(metrics)
+    try:
+      def call():
+        with record_outbound('sqs'):
+          pass
+      with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(contextvars.copy_context().run, call) for _ in range(8)]:
+          future.result()
+    finally:
+      _CURRENT.reset(token)
+    self.assertEqual(metrics.outbound['sqs'][0], 8)
+
+
+class PrometheusSinkTest(SimpleTestCase):
+  '''Prometheus text exposition'''
+
+  def test_label_values_are_escaped(self):
+    metrics = RequestMetrics('GET', '/')
+    metrics.endpoint = 'View"\\'
+    metrics.wall_time = 0.1
+    with mock.patch.object(PrometheusSink, '_counters', defaultdict(float)):
+      PrometheusSink().emit(metrics)
+      rendered = PrometheusSink.render()
+    self.assertIn('endpoint="View\\"\\\\"', rendered)
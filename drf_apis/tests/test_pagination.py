@@ -0,0 +1,39 @@
+'''Analysis list count tests'''
+
+# Lib imports
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+# App imports
+from bpapp.api3.resources.pagination import COUNT_VERSION_KEY, AnalysisPagination
+from bpapp.api3.resources.tests.fixtures import create_analysis, create_user
+from bpapp.models import Analysis
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AnalysisCountTest(TestCase):
+  '''Cached analysis list counts'''
+
+  def setUp(self):
+    cache.clear()
+    self.owner = create_user()
+    self.analysis = create_analysis(self.owner, status='running')
+    self.pagination = AnalysisPagination()
+    self.pagination.request = Request(APIRequestFactory().get('/analyses/'))
+
+  def test_empty_querysets(self):
+    for name, queryset in [('none', Analysis.objects.none()), ('empty in', Analysis.objects.filter(pk__in=[]))]:
+      with self.subTest(name), self.assertNumQueries(0):
+        self.assertEqual(self.pagination.get_count(queryset), 0)
+
+  def test_bulk_update_status_drops_counts(self):
+    key = COUNT_VERSION_KEY.format(Analysis._meta.label_lower)
+    version = cache.get(key, 0)
+    self.analysis.status = 'started'
+    with self.captureOnCommitCallbacks(execute=True):
+      Analysis.bulk_update_status([self.analysis], ['status'])
+    self.assertGreater(cache.get(key, 0), version)
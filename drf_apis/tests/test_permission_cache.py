@@ -0,0 +1,148 @@
+'''Permission cache tests: cached decisions must match uncached ones after every change'''
+
+# Lib imports
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+# App imports
+from bpapp.api3.resources.permission import AnalysisPermission, SamplePermission
+from bpapp.api3.resources.permission_cache import PermissionCache, assign_perm, remove_perm
+from bpapp.api3.resources.tests.fixtures import (
+  create_analysis, create_project, create_sample, create_user
+)
+from bpapp.models import Analysis, BpUser, Sample
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PermissionCacheTest(TestCase):
+  '''Cached vs uncached object permission decisions'''
+
+  def setUp(self):
+    cache.clear()
+    PermissionCache.reset_metrics()
+    self.owner = create_user()
+    self.other = create_user()
+    self.project = create_project(self.owner)
+    self.analysis = create_analysis(self.owner, projects=[self.project])
+    self.sample = create_sample(self.owner, projects=[self.project])
+
+  def check(self, permission, user, obj, method='get'):
+    '''Decision of a fresh request, asserting the cached and uncached decisions agree'''
+    user = BpUser.objects.get(pk=user.pk)
+    obj = type(obj).objects.get(pk=obj.pk)
+    request = Request(getattr(APIRequestFactory(), method)('/'))
+    request.user = user
+
+    with mock.patch.object(
+        PermissionCache, 'get_or_compute',
+        side_effect=lambda permission, user, obj, action, compute: compute()
+    ):
+      uncached = bool(permission.has_object_permission(request, None, obj))
+    # computed then served from the cache
+    for _ in range(2):
+      self.assertEqual(bool(permission.has_object_permission(request, None, obj)), uncached)
+    return uncached
+
+  def test_second_check_is_a_hit(self):
+    self.check(AnalysisPermission(), self.other, self.analysis)
+    self.assertEqual(PermissionCache.get_metrics()['misses'], 1)
+    self.assertEqual(PermissionCache.get_metrics()['hits'], 1)
+
+  def test_assign_and_remove_perm(self):
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis))
+    with self.captureOnCommitCallbacks(execute=True):
+      assign_perm('view', self.other, self.analysis)
+    self.assertTrue(self.check(AnalysisPermission(), self.other, self.analysis))
+    with self.captureOnCommitCallbacks(execute=True):
+      remove_perm('view', self.other, self.analysis)
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis))
+
+  def test_bulk_assign_and_remove_perm(self):
+    second = create_analysis(self.owner, projects=[self.project])
+    for analysis in [self.analysis, second]:
+      self.assertFalse(self.check(AnalysisPermission(), self.other, analysis))
+
+    # guardian bulk_creates the perms of a queryset, without post_save
+    with self.captureOnCommitCallbacks(execute=True):
+      assign_perm('view', self.other, Analysis.objects.filter(pk__in=[self.analysis.pk, second.pk]))
+    for analysis in [self.analysis, second]:
+      self.assertTrue(self.check(AnalysisPermission(), self.other, analysis))
+
+    with self.captureOnCommitCallbacks(execute=True):
+      remove_perm('view', self.other, Analysis.objects.filter(pk__in=[self.analysis.pk, second.pk]))
+    for analysis in [self.analysis, second]:
+      self.assertFalse(self.check(AnalysisPermission(), self.other, analysis))
+
+  def test_project_perm(self):
+    self.assertFalse(self.check(SamplePermission(), self.other, self.sample))
+    with self.captureOnCommitCallbacks(execute=True):
+      assign_perm('view', self.other, self.project)
+    self.assertTrue(self.check(SamplePermission(), self.other, self.sample))
+
+  def test_project_visibility(self):
+    self.assertFalse(self.check(SamplePermission(), self.other, self.sample))
+    with self.captureOnCommitCallbacks(execute=True):
+      self.project.visibility = 'public'
+      self.project.save()
+    self.assertTrue(self.check(SamplePermission(), self.other, self.sample))
+
+  def test_project_links(self):
+    shared_project = create_project(self.owner)
+    with self.captureOnCommitCallbacks(execute=True):
+      assign_perm('edit', self.other, shared_project)
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis, method='patch'))
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.analysis.projects.add(shared_project)
+    self.assertTrue(self.check(AnalysisPermission(), self.other, self.analysis, method='patch'))
+
+    # from the project side
+    with self.captureOnCommitCallbacks(execute=True):
+      shared_project.analyses.remove(self.analysis)
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis, method='patch'))
+
+  def test_owner_change(self):
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis, method='patch'))
+    with self.captureOnCommitCallbacks(execute=True):
+      Analysis.objects.filter(pk=self.analysis.pk).update(owner=self.other)
+    self.assertTrue(self.check(AnalysisPermission(), self.other, self.analysis, method='patch'))
+
+  def test_group_perm_and_membership(self):
+    group = Group.objects.create(name='analysts')
+    with self.captureOnCommitCallbacks(execute=True):
+      assign_perm('view', group, self.analysis)
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis))
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.other.groups.add(group)
+    self.assertTrue(self.check(AnalysisPermission(), self.other, self.analysis))
+
+    with self.captureOnCommitCallbacks(execute=True):
+      group.user_set.remove(self.other)
+    self.assertFalse(self.check(AnalysisPermission(), self.other, self.analysis))
+
+  def test_unrelated_writes_keep_entries(self):
+    self.check(AnalysisPermission(), self.other, self.analysis)
+    with self.captureOnCommitCallbacks(execute=True):
+      create_analysis(self.owner, projects=[self.project])
+      create_sample(self.owner, projects=[self.project])
+      self.project.name = 'renamed'
+      self.project.save()
+    PermissionCache.reset_metrics()
+    self.check(AnalysisPermission(), self.other, self.analysis)
+    self.assertEqual(PermissionCache.get_metrics()['misses'], 0)
+
+  def test_sample_owner_save_without_change(self):
+    self.check(SamplePermission(), self.other, self.sample)
+    with self.captureOnCommitCallbacks(execute=True):
+      Sample.objects.get(pk=self.sample.pk).save()
+    PermissionCache.reset_metrics()
+    self.check(SamplePermission(), self.other, self.sample)
+    self.assertEqual(PermissionCache.get_metrics()['misses'], 0)
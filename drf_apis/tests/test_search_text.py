@@ -0,0 +1,55 @@
+'''Analysis search_text tests'''
+
+# Lib imports
+from unittest import mock
+
+from django.test import TestCase
+
+# App imports
+from bpapp.api3.resources.tests.fixtures import create_analysis, create_sample, create_user
+from bpapp.models import Analysis
+
+
+class SearchTextTest(TestCase):
+  '''search_text upkeep'''
+
+  def setUp(self):
+    self.owner = create_user()
+
+  def get_search_text(self, analysis):
+    '''Stored search_text of an analysis'''
+    return Analysis.objects.values_list('search_text', flat=True).get(pk=analysis.pk)
+
+  def test_built_once_after_links(self):
+    sample = create_sample(self.owner, name='Tumor-1')
+    control = create_sample(self.owner, name='Normal-1')
+    with mock.patch.object(Analysis, 'refresh_search_text', wraps=Analysis.refresh_search_text) as refresh:
+      with self.captureOnCommitCallbacks(execute=True):
+        analysis = create_analysis(self.owner, name='Run')
+        analysis.samples.add(sample)
+        analysis.controls.add(control)
+    self.assertEqual(refresh.call_count, 1)
+    self.assertIn('tumor-1', self.get_search_text(analysis))
+    self.assertIn('normal-1', self.get_search_text(analysis))
+
+  def test_sample_rename_to_substring(self):
+    sample = create_sample(self.owner, name='abc')
+    with self.captureOnCommitCallbacks(execute=True):
+      analysis = create_analysis(self.owner)
+      analysis.samples.add(sample)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      sample.name = 'ab'
+      sample.save()
+    self.assertNotIn('abc', self.get_search_text(analysis))
+    self.assertIn('ab', self.get_search_text(analysis).split())
+
+  def test_sample_save_without_rename(self):
+    sample = create_sample(self.owner)
+    with self.captureOnCommitCallbacks(execute=True):
+      create_analysis(self.owner).samples.add(sample)
+
+    with mock.patch.object(Analysis, 'refresh_search_text') as refresh:
+      with self.captureOnCommitCallbacks(execute=True):
+        sample.save()
+    refresh.assert_not_called()
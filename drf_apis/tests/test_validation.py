@@ -0,0 +1,41 @@
+'''Pipeline validation tests'''
+
+# Lib imports
+from django.test import SimpleTestCase
+
+# App imports
+from bpapp.api3.resources.validation import get_workflow_uri, parse_pipeline_id, validate, validate_batch
+
+
+class RecordingValidator:
+  '''Validator with the PipelineValidator signature, recording the payloads it is given'''
+  calls = []
+
+  def __init__(self, payload):
+    self.payload = payload
+
+  def validate_all(self):
+    '''Errors of payloads asking for one'''
+    RecordingValidator.calls.append(self.payload)
+    return {'error': 'invalid'} if self.payload.get('invalid') else {}
+
+
+class ValidationTest(SimpleTestCase):
+  '''Single and batched payload validation'''
+
+  def setUp(self):
+    RecordingValidator.calls = []
+
+  def test_every_payload_is_validated_in_order(self):
+    payload = {'workflow': get_workflow_uri(12)}
+    payloads = [payload, {**payload, 'invalid': True}, {'workflow': None}]
+    self.assertEqual(validate_batch(payloads, RecordingValidator), [{}, {'error': 'invalid'}, {}])
+    self.assertEqual(RecordingValidator.calls, payloads)
+
+  def test_single_payload(self):
+    self.assertEqual(validate({'invalid': True}, RecordingValidator), {'error': 'invalid'})
+
+  def test_parse_pipeline_id(self):
+    self.assertEqual(parse_pipeline_id(get_workflow_uri(12)), 12)
+    self.assertEqual(parse_pipeline_id('12'), 12)
+    self.assertIsNone(parse_pipeline_id(None))
@@ -0,0 +1,37 @@
+'''Pipeline validation of single and batched analysis payloads
+
+PipelineValidator only takes the payload and loads its workflow and node
+schemas itself, so nothing can be compiled ahead of it: each payload is
+validated with `PipelineValidator(payload).validate_all()`, as in create.
+'''
+
+# Lib imports
+import re
+
+WORKFLOW_URI = '/api/v3/pipelines/{}/'
+
+# trailing id of a workflow/pipeline uri (`/api/v3/pipelines/12/`) or a bare id
+_PIPELINE_ID_RE = re.compile(r'(\d+)/?$')
+
+def parse_pipeline_id(workflow):
+  '''Pipeline id of a workflow uri or id, None when there is none'''
+  if isinstance(workflow, int):
+    return workflow
+  match = _PIPELINE_ID_RE.search(str(workflow or '').strip())
+  return int(match.group(1)) if match else None
+
+def get_workflow_uri(pipeline_id):
+  '''Workflow uri of a pipeline id, the `workflow` of create payloads'''
+  return WORKFLOW_URI.format(pipeline_id)
+
+def validate_batch(payloads, validator_class):
+  '''`validator_class(payload).validate_all()` of each payload, in order'''
+  return [validator_class(payload).validate_all() for payload in payloads]
+
+def validate(payload, validator_class):
+  '''`validator_class(payload).validate_all()` of one payload'''
+  return validator_class(payload).validate_all()
+
+def get_errors(result):
+  '''Errors and warnings of a validation result, None when it is valid'''
+  return result if result.get('error') or result.get('warning') else None